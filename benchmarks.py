@@ -0,0 +1,669 @@
+"""
+Micro-benchmarks for django-timedelta-field.
+
+Run with:
+
+    python benchmarks.py [name ...] [--all] [--json results.json]
+                         [--baseline baseline.json] [--threshold 0.25]
+                         [--noise-floor 1]
+
+where each name is one of the benchmarks below, without its ``bench_``
+prefix. By default, all of BENCHMARKS are run; the slow ones, over a
+million values or rows (SLOW_BENCHMARKS), only run when they are named,
+or with --all.
+
+Each benchmark prints the median per-call time out of a few repeats. With
+--json, the results are also written to a file ('-' for stdout, when the
+printed timings go to stderr instead), as a JSON object mapping each
+label to seconds per call. Such a file can be given as the --baseline for
+a later run, which then exits with status 1 if any benchmark is both more
+than --threshold (a fraction, by default 0.25) and more than
+--noise-floor microseconds (by default 1) slower than it was: the floor
+stops timer noise from failing the sub-microsecond benchmarks. The
+database benchmarks use an in-memory sqlite database, unless another
+backend is named in BENCHMARK_DB_ENGINE (e.g. postgresql_psycopg2, with
+BENCHMARK_DB_NAME, BENCHMARK_DB_USER, etc). BENCHMARK_BULK_ROWS sets the
+number of rows saved by the bulk_create() benchmark.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import timeit
+from collections import OrderedDict
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_PATH)
+
+REPEAT = 7
+NUMBER = 20000
+THRESHOLD = 0.25
+NOISE_FLOOR = 1e-6
+
+# label -> the median time per call, in seconds, of each benchmark run.
+RESULTS = OrderedDict()
+OUTPUT = sys.stdout
+
+
+_models = {}
+
+
+def setup_django():
+    """
+    Configure django, and create the tables for the benchmark models.
+    """
+    if _models:
+        return _models
+
+    import django
+    from django.conf import settings
+
+    engine = os.environ.get('BENCHMARK_DB_ENGINE', 'sqlite3')
+    settings.configure(
+        INSTALLED_APPS=['timedelta'],
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.%s' % engine,
+                'NAME': os.environ.get('BENCHMARK_DB_NAME', ':memory:'),
+                'USER': os.environ.get('BENCHMARK_DB_USER', ''),
+                'PASSWORD': os.environ.get('BENCHMARK_DB_PASSWORD', ''),
+                'HOST': os.environ.get('BENCHMARK_DB_HOST', ''),
+            }
+        },
+    )
+    if getattr(django, 'setup', None):
+        django.setup()
+
+    from django.db import connection, models
+    from timedelta.fields import TimedeltaField
+
+    class BenchmarkModel(models.Model):
+        duration = TimedeltaField(db_index=True)
+
+        class Meta:
+            app_label = 'timedelta'
+            db_table = 'timedelta_benchmark'
+
+    with connection.schema_editor() as editor:
+        editor.create_model(BenchmarkModel)
+
+    _models['duration'] = BenchmarkModel
+    return _models
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def bench(label, stmt, number=NUMBER, repeat=REPEAT):
+    median = _median(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+    RESULTS[label] = median
+    report(label, median, 'call')
+    return median
+
+
+def report(label, seconds, unit):
+    print('%-50s %10.3f us/%s' % (label, seconds * 1e6, unit), file=OUTPUT)
+
+
+def _invalid(function, value):
+    try:
+        function(value)
+    except (TypeError, ValueError):
+        pass
+
+
+def _import_time(module):
+    """
+    The time, in seconds, that a fresh python process takes to import
+    module, from -X importtime if this python has it (3.7+), or else the
+    time the whole process takes, less that of a bare interpreter.
+    """
+    env = dict(os.environ, PYTHONPATH=BASE_PATH)
+    if sys.version_info >= (3, 7):
+        output = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+            env=env, stderr=subprocess.STDOUT,
+        ).decode()
+        for line in output.splitlines():
+            match = re.match(r'import time:\s*\d+ \|\s*(\d+) \| %s$' % re.escape(module), line)
+            if match:
+                return int(match.group(1)) / 1e6
+        raise ValueError('No import time for %s in: %s' % (module, output))
+
+    def run(code):
+        started = timeit.default_timer()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        return timeit.default_timer() - started
+    return run('import %s' % module) - run('pass')
+
+
+def bench_import(repeat=REPEAT):
+    """
+    How long importing the package takes, in a new process each time.
+    """
+    for module in ('timedelta', 'timedelta.helpers', 'timedelta.fields'):
+        label = 'import %s' % module
+        try:
+            RESULTS[label] = min(_import_time(module) for i in range(repeat))
+        except subprocess.CalledProcessError:
+            print('%-50s %10s' % (label, 'failed'), file=OUTPUT)
+        else:
+            report(label, RESULTS[label], 'import')
+
+
+def bench_parse():
+    from timedelta.helpers import parse
+
+    colon = '3 days, 8:42:42.342161'
+    flexible = '1 week, 2 days, 3 hours, 4 minutes, 5.5 seconds'
+    short = '30 minutes'
+
+    bench('parse: colon format', lambda: parse(colon))
+    bench('parse: flexible format', lambda: parse(flexible))
+    bench('parse: flexible format (one unit)', lambda: parse(short))
+    bench('parse: invalid colon format', lambda: _invalid(parse, '3 days, 8:42:4x'))
+    bench('parse: invalid flexible format', lambda: _invalid(parse, '1 week, 2 fortnights'))
+
+    from timedelta.helpers import iso8601_repr, parse_iso8601
+    import datetime
+
+    iso = iso8601_repr(datetime.timedelta(days=3, seconds=31362, microseconds=342161))
+    bench('parse: iso8601', lambda: parse(iso))
+    bench('parse_iso8601', lambda: parse_iso8601(iso))
+    values = [datetime.timedelta(seconds=i * 37, microseconds=i) for i in range(100000)]
+    bench('iso8601 round trip: 100k values', lambda: [parse_iso8601(iso8601_repr(x)) for x in values], number=1)
+
+
+def bench_nice_repr():
+    import datetime
+    from django.test.utils import override_settings
+    from timedelta import cache
+    from timedelta.helpers import nice_repr
+
+    setup_django()
+    value = datetime.timedelta(days=9, seconds=3723)
+
+    for display in ('long', 'short', 'minimal', 'sql', 'H:i:s'):
+        bench('nice_repr: %s' % display, lambda: nice_repr(value, display))
+    with override_settings(TIMEDELTA_NICE_REPR_CACHE_SIZE=1024):
+        bench('nice_repr: long, cached', lambda: cache.nice_repr(value))
+
+
+def bench_nice_repr_many():
+    import datetime
+    from array import array
+    from timedelta.helpers import (
+        iso8601_repr, iso8601_repr_many, nice_repr, nice_repr_many, total_microseconds,
+    )
+
+    column = [datetime.timedelta(seconds=i * 37) for i in range(100000)]
+    microseconds = array('q', [total_microseconds(value) for value in column])
+
+    bench('nice_repr: 100k timedeltas, one at a time', lambda: [nice_repr(x) for x in column], number=1)
+    bench('nice_repr_many: 100k timedeltas', lambda: nice_repr_many(column), number=1)
+    bench('nice_repr_many: 100k microseconds', lambda: nice_repr_many(microseconds), number=1)
+    bench('iso8601_repr: 100k timedeltas, one at a time', lambda: [iso8601_repr(x) for x in column], number=1)
+    bench('iso8601_repr_many: 100k microseconds', lambda: iso8601_repr_many(microseconds), number=1)
+
+
+def bench_parse_many():
+    from timedelta.helpers import parse, parse_many
+
+    column = ['1 hour', '30 minutes', '1 day, 0:00:00', '2 days, 4:00:00'] * 25000
+
+    bench('parse: 100k rows, one at a time', lambda: [parse(x) for x in column], number=1)
+    bench('parse_many: 100k rows', lambda: parse_many(column, use_numpy=False), number=1)
+
+
+def bench_round_to_nearest():
+    import datetime
+    from array import array
+    from timedelta.helpers import round_to_nearest, round_to_nearest_many
+
+    second = datetime.timedelta(seconds=1)
+    minute = datetime.timedelta(minutes=1)
+    weeks = datetime.timedelta(weeks=6, seconds=1, microseconds=600000)
+    evening = datetime.datetime(2012, 1, 1, 23, 42, 31)
+    column = array('q', range(0, 100000 * 1000003, 1000003))
+
+    for label, value, interval in (
+        ('1.5 seconds to 1 millisecond', datetime.timedelta(seconds=1, microseconds=500400), datetime.timedelta(milliseconds=1)),
+        ('6 weeks to 1 second', weeks, second),
+        ('6 weeks to 1 hour', weeks, datetime.timedelta(hours=1)),
+        ('10 years to 1 day', datetime.timedelta(days=3652, hours=13), datetime.timedelta(days=1)),
+    ):
+        bench('round_to_nearest: %s' % label, lambda: round_to_nearest(value, interval))
+    bench('round_to_nearest: 23:42 to 1 minute', lambda: round_to_nearest(evening, minute))
+    bench('round_to_nearest_many: 100k microseconds', lambda: round_to_nearest_many(column, second), number=1)
+
+
+def bench_arithmetic():
+    import datetime
+    from array import array
+    from decimal import Decimal
+    from timedelta.helpers import divide, modulo, multiply, multiply_many, total_microseconds
+
+    shift = datetime.timedelta(hours=7, minutes=42, microseconds=5)
+    hour = datetime.timedelta(hours=1)
+    rate = Decimal('1.25')
+    column = [shift] * 100000
+    microseconds = array('q', [total_microseconds(shift)] * 100000)
+
+    bench('multiply: by a float', lambda: multiply(shift, 1.5))
+    bench('multiply: by a Decimal', lambda: multiply(shift, rate))
+    bench('divide: by a timedelta', lambda: divide(shift, hour))
+    bench('divide: by a timedelta, as a float', lambda: divide(shift, hour, as_float=True))
+    bench('divide: by a float', lambda: divide(shift, 2.5))
+    bench('modulo: by a timedelta', lambda: modulo(shift, hour))
+    bench('modulo: by seconds', lambda: modulo(shift, 900))
+    bench('multiply: 100k timedeltas, one at a time', lambda: [multiply(x, rate) for x in column], number=1)
+    bench('multiply_many: 100k timedeltas', lambda: multiply_many(column, rate), number=1)
+    bench('multiply_many: 100k microseconds', lambda: multiply_many(microseconds, rate), number=1)
+
+    try:
+        import numpy
+    except ImportError:
+        return
+    values = numpy.frombuffer(microseconds, dtype=numpy.int64)
+    # 0.1 is 3602879701896397 / 2 ** 55, so the products overflow an int64.
+    bench('multiply_many: 100k numpy microseconds, by 0.1', lambda: multiply_many(values, 0.1), number=10)
+
+
+def bench_decimal_hours():
+    import datetime
+    import random
+    from array import array
+    from django.template import Context, Template
+    from timedelta.helpers import decimal_hours, decimal_hours_many, total_microseconds
+
+    setup_django()
+
+    random.seed(0)
+    column = [datetime.timedelta(minutes=random.randint(0, 600)) for i in range(100000)]
+    microseconds = array('q', [total_microseconds(x) for x in column])
+    template = Template('{% load decimal_hours %}{% for x in column %}{{ x|decimal_hours:2 }} {% endfor %}')
+    context = Context({'column': column[:10000]})
+
+    bench('decimal_hours: 100k timedeltas, one at a time', lambda: [decimal_hours(x) for x in column], number=1)
+    bench('decimal_hours: 100k timedeltas to 2 places, one at a time', lambda: [decimal_hours(x, 2) for x in column], number=1)
+    bench('decimal_hours_many: 100k timedeltas to 2 places', lambda: decimal_hours_many(column, 2), number=1)
+    bench('decimal_hours_many: 100k microseconds to 2 places', lambda: decimal_hours_many(microseconds, 2), number=1)
+    bench('decimal_hours filter: 10k values', lambda: template.render(context), number=1)
+
+
+def bench_field():
+    import datetime
+    from django.db import connection
+
+    model = setup_django()['duration']
+    field = model._meta.get_field('duration')
+    value = datetime.timedelta(days=1, hours=2, minutes=3, microseconds=4)
+    instance = model(duration=value)
+    microseconds = field.get_db_prep_value(value, connection)
+
+    bench('to_python: timedelta', lambda: field.to_python(value))
+    bench('to_python: string', lambda: field.to_python('1 day, 2:03:00.000004'))
+    bench('to_python: microseconds', lambda: field.to_python(microseconds))
+    bench('get_prep_value: timedelta', lambda: field.get_prep_value(value))
+    bench('get_prep_value: string', lambda: field.get_prep_value('1 day, 2 hours, 3 minutes'))
+    bench('get_db_prep_value: timedelta', lambda: field.get_db_prep_value(value, connection))
+    bench('from_db_value', lambda: field.from_db_value(microseconds, None, connection, None))
+    bench('value_to_string', lambda: field.value_to_string(instance))
+
+
+def bench_instrumentation():
+    from timedelta import instrumentation
+    from timedelta.helpers import nice_repr, parse
+
+    field = setup_django()['duration']._meta.get_field('duration')
+    value = parse('1 day, 2 hours')
+
+    instrumentation.enable()
+    try:
+        bench('instrumented: parse', lambda: parse('1 day, 2 hours'))
+        bench('instrumented: nice_repr', lambda: nice_repr(value))
+        bench('instrumented: to_python: string', lambda: field.to_python('1 day, 2 hours'))
+    finally:
+        instrumentation.disable()
+    bench('uninstrumented: parse', lambda: parse('1 day, 2 hours'))
+    bench('uninstrumented: nice_repr', lambda: nice_repr(value))
+    bench('uninstrumented: to_python: string', lambda: field.to_python('1 day, 2 hours'))
+
+
+def bench_arrays(size=1000000):
+    import datetime
+    import random
+    from timedelta.arrays import TimedeltaArray
+
+    random.seed(0)
+    values = [datetime.timedelta(microseconds=random.randint(0, 10 ** 12)) for i in range(size)]
+    durations = TimedeltaArray(values)
+    zero = datetime.timedelta(0)
+
+    try:
+        import tracemalloc
+    except ImportError:
+        pass
+    else:
+        for label, build in (
+            ('list', lambda: [datetime.timedelta(0, 0, microseconds) for microseconds in durations.microseconds]),
+            ('TimedeltaArray', lambda: TimedeltaArray.from_microseconds(durations.microseconds.tolist())),
+        ):
+            tracemalloc.start()
+            built = build()
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del built
+            print('%-50s %10.1f MB' % ('memory: %s of %i timedeltas' % (label, size), used / 1e6), file=OUTPUT)
+
+    bench('TimedeltaArray: build from %i timedeltas' % size, lambda: TimedeltaArray(values), number=1)
+    bench('list: sum of %i timedeltas' % size, lambda: sum(values, zero), number=1)
+    bench('TimedeltaArray: sum of %i' % size, durations.sum, number=1)
+    bench('list: min and max of %i timedeltas' % size, lambda: (min(values), max(values)), number=1)
+    bench('TimedeltaArray: min and max of %i' % size, lambda: (durations.min(), durations.max()), number=1)
+    bench('list: sorted %i timedeltas' % size, lambda: sorted(values), number=1)
+    bench('TimedeltaArray: sorted %i' % size, durations.sorted, number=1)
+
+
+def bench_streaming(size=1000000):
+    import datetime
+    import random
+    from array import array
+    from timedelta.streaming import DurationStats
+
+    random.seed(0)
+    microseconds = array('q', [random.randint(0, 10 ** 10) for i in range(size)])
+    values = [datetime.timedelta(0, 0, value) for value in microseconds[:size // 10]]
+
+    def update(values):
+        stats = DurationStats()
+        stats.update(values)
+        return stats.quantiles((0.5, 0.9, 0.99))
+
+    bench('DurationStats: %i microseconds' % size, lambda: update(microseconds), number=1, repeat=3)
+    bench('DurationStats: %i timedeltas' % len(values), lambda: update(values), number=1, repeat=3)
+    def sorted_percentiles(values):
+        ordered = sorted(values)
+        return [ordered[int(q * (len(ordered) - 1))] for q in (0.5, 0.9, 0.99)]
+
+    bench('sorted percentiles: %i timedeltas' % len(values), lambda: sorted_percentiles(values), number=1, repeat=3)
+
+
+def bench_storage(rows=10000):
+    import datetime
+    from django.db import connection
+
+    model = setup_django()['duration']
+    durations = [datetime.timedelta(seconds=i * 37, microseconds=i) for i in range(rows)]
+    low, high = datetime.timedelta(hours=1), datetime.timedelta(hours=2)
+    vendor = connection.vendor
+
+    def insert():
+        model.objects.all().delete()
+        model.objects.bulk_create([model(duration=duration) for duration in durations])
+
+    bench('%s: insert %i rows' % (vendor, rows), insert, number=1)
+    bench('%s: read %i rows' % (vendor, rows), lambda: list(model.objects.all()), number=1)
+    bench('%s: ordered range scan' % vendor, lambda: list(
+        model.objects.filter(duration__gte=low, duration__lt=high).order_by('duration')
+    ), number=10)
+    def python_sum():
+        total = datetime.timedelta(0)
+        for duration in model.objects.values_list('duration', flat=True):
+            total += duration
+        return total
+
+    from timedelta.aggregates import Sum
+    bench('%s: sum in python' % vendor, python_sum, number=1)
+    bench('%s: Sum() aggregate' % vendor, lambda: model.objects.aggregate(Sum('duration')), number=10)
+    def python_percentiles():
+        values = sorted(model.objects.values_list('duration', flat=True))
+        return [values[int(fraction * (len(values) - 1))] for fraction in (0.5, 0.95, 0.99)]
+
+    from timedelta.aggregates import percentiles
+    bench('%s: percentiles in python' % vendor, python_percentiles, number=1)
+    bench('%s: percentiles()' % vendor, lambda: percentiles(model.objects.all(), 'duration', (0.5, 0.95, 0.99)), number=10)
+    bench('%s: seconds__range scan' % vendor, lambda: list(
+        model.objects.filter(duration__seconds__range=(3600, 7200)).order_by('duration')
+    ), number=10)
+
+    from timedelta.expressions import Multiply
+    from timedelta.helpers import multiply
+    def python_rescale():
+        for instance in model.objects.all():
+            instance.duration = multiply(instance.duration, 1.5)
+            instance.save(update_fields=['duration'])
+
+    bench('%s: rescale %i rows in python' % (vendor, rows), python_rescale, number=1)
+    bench('%s: rescale %i rows with Multiply()' % (vendor, rows), lambda: model.objects.update(
+        duration=Multiply('duration', 1.5)
+    ), number=1)
+
+
+def bench_load(rows=100000):
+    import datetime
+
+    model = setup_django()['duration']
+    durations = [datetime.timedelta(seconds=i, microseconds=i) for i in range(rows)]
+
+    def save():
+        model.objects.all().delete()
+        model.objects.bulk_create([model(duration=duration) for duration in durations], batch_size=500)
+
+    per_row = bench('save %i instances' % rows, save, number=1, repeat=3) / rows
+    report('', per_row, 'row')
+
+    def load():
+        return list(model.objects.all())
+
+    def load_and_read():
+        return [instance.duration for instance in model.objects.all()]
+
+    per_row = bench('load %i instances' % rows, load, number=1, repeat=3) / rows
+    report('', per_row, 'row')
+    per_row = bench('load %i instances, reading the duration' % rows, load_and_read, number=1, repeat=3) / rows
+    report('', per_row, 'row')
+
+    from timedelta.expressions import values_list_microseconds
+    from timedelta.helpers import total_seconds
+
+    bench('values_list: total_seconds of %i rows' % rows, lambda: [
+        total_seconds(duration) for duration in model.objects.values_list('duration', flat=True).iterator()
+    ], number=1, repeat=3)
+    bench('values_list_microseconds: %i rows' % rows, lambda: [
+        microseconds / 1e6 for microseconds in values_list_microseconds(model.objects.all(), 'duration', flat=True).iterator()
+    ], number=1, repeat=3)
+
+
+def bench_bulk_create(rows=None):
+    """
+    Save BENCHMARK_BULK_ROWS (by default a million) rows with bulk_create().
+    """
+    import datetime
+    from django.db import connection
+
+    if rows is None:
+        rows = int(os.environ.get('BENCHMARK_BULK_ROWS', 1000000))
+    model = setup_django()['duration']
+    field = model._meta.get_field('duration')
+    durations = [datetime.timedelta(seconds=i, microseconds=i) for i in range(rows)]
+    vendor = connection.vendor
+
+    bench('%s: prepare %i values' % (vendor, rows), lambda: [
+        field.get_db_prep_save(duration, connection) for duration in durations
+    ], number=1, repeat=3)
+
+    def insert():
+        model.objects.all().delete()
+        model.objects.bulk_create([model(duration=duration) for duration in durations], batch_size=500)
+
+    per_row = bench('%s: bulk_create %i rows' % (vendor, rows), insert, number=1, repeat=1) / rows
+    report('', per_row, 'row')
+
+
+def bench_forms():
+    import datetime
+    from django.core.exceptions import ValidationError
+    from timedelta.forms import TimedeltaFormField
+    from timedelta.widgets import TimedeltaWidget
+
+    setup_django()
+    widget = TimedeltaWidget()
+    field = TimedeltaFormField()
+    value = datetime.timedelta(days=1, hours=2, minutes=30)
+    values = [datetime.timedelta(minutes=i) for i in range(1000)]
+
+    bench('widget: render', lambda: widget.render('duration', value))
+    bench('widget: render 1000 distinct values', lambda: [widget.render('duration', x) for x in values], number=10)
+    bench('form field: clean', lambda: field.clean('1 day, 2 hours, 30 minutes'))
+    bench('form field: clean invalid', lambda: _invalid_form_value(field, '1 day, 2 fortnights', ValidationError))
+    bench('form field: has_changed', lambda: field.has_changed(value, '26 hours, 30 minutes'))
+
+
+def _invalid_form_value(field, value, exception):
+    try:
+        field.clean(value)
+    except exception:
+        pass
+
+
+def bench_formset(forms=1000):
+    import datetime
+    from django import forms as django_forms
+    from django.forms.formsets import formset_factory
+    from django.test.utils import override_settings
+    from timedelta.forms import TimedeltaFormField
+
+    setup_django()
+
+    class DurationForm(django_forms.Form):
+        duration = TimedeltaFormField()
+
+    DurationFormSet = formset_factory(DurationForm, extra=0)
+    initial = [{'duration': datetime.timedelta(minutes=15 * (i % 8))} for i in range(forms)]
+    data = {'form-TOTAL_FORMS': str(forms), 'form-INITIAL_FORMS': str(forms)}
+    for i in range(forms):
+        data['form-%i-duration' % i] = '%i minutes' % (15 * (i % 8))
+
+    bench('formset: render %i forms' % forms, lambda: DurationFormSet(initial=initial).as_table(), number=1)
+    with override_settings(TIMEDELTA_NICE_REPR_CACHE_SIZE=1024):
+        bench('formset: render %i forms, nice_repr cache' % forms,
+              lambda: DurationFormSet(initial=initial).as_table(), number=1)
+
+    def validate():
+        formset = DurationFormSet(data, initial=initial)
+        formset.is_valid()
+        return formset.has_changed()
+
+    bench('formset: validate %i forms' % forms, validate, number=1)
+
+
+BENCHMARKS = [
+    bench_import,
+    bench_parse,
+    bench_nice_repr,
+    bench_nice_repr_many,
+    bench_parse_many,
+    bench_round_to_nearest,
+    bench_arithmetic,
+    bench_decimal_hours,
+    bench_field,
+    bench_instrumentation,
+    bench_storage,
+    bench_load,
+    bench_forms,
+    bench_formset,
+]
+
+# Only run when named, or with --all.
+SLOW_BENCHMARKS = [
+    bench_arrays,
+    bench_streaming,
+    bench_bulk_create,
+]
+
+
+def compare(results, baseline, threshold=THRESHOLD, noise_floor=NOISE_FLOOR):
+    """
+    Return a list of (label, baseline, result) for each benchmark in
+    results that is more than threshold (a fraction), and more than
+    noise_floor seconds, slower than in the baseline. Benchmarks that are
+    missing from either are ignored.
+    """
+    return [
+        (label, baseline[label], seconds)
+        for label, seconds in results.items()
+        if label in baseline
+        and seconds > baseline[label] * (1 + threshold)
+        and seconds > baseline[label] + noise_floor
+    ]
+
+
+def main(argv=None):
+    global OUTPUT
+
+    benchmarks = OrderedDict(
+        (benchmark.__name__[len('bench_'):], benchmark) for benchmark in BENCHMARKS + SLOW_BENCHMARKS
+    )
+    parser = argparse.ArgumentParser(description='Run the django-timedelta-field benchmarks.')
+    parser.add_argument('names', nargs='*', metavar='name', help=', '.join(benchmarks))
+    parser.add_argument('--all', action='store_true', help='also run the slow benchmarks')
+    parser.add_argument('--json', help="write the results to this file ('-' for stdout)")
+    parser.add_argument('--baseline', help='compare the results with this file, written by --json')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='the fraction slower than the baseline that fails (default %(default)s)')
+    parser.add_argument('--noise-floor', type=float, default=NOISE_FLOOR * 1e6,
+                        help='the microseconds per call slower than the baseline that fails, '
+                             'as well as --threshold (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.names if name not in benchmarks]
+    if unknown:
+        parser.error('unknown benchmark: %s' % ', '.join(unknown))
+    if args.json == '-':
+        OUTPUT = sys.stderr
+
+    names = args.names
+    if not names:
+        names = [name for name, benchmark in benchmarks.items()
+                 if args.all or benchmark not in SLOW_BENCHMARKS]
+    for name in names:
+        benchmarks[name]()
+
+    if args.json:
+        import django
+        data = {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'results': RESULTS,
+        }
+        if args.json == '-':
+            json.dump(data, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as handle:
+                json.dump(data, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)['results']
+        regressions = compare(RESULTS, baseline, args.threshold, args.noise_floor / 1e6)
+        for label, before, after in regressions:
+            print('REGRESSION: %-38s %10.3f -> %10.3f us/call' % (label, before * 1e6, after * 1e6), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,14 @@
 import os.path
+import re
 from setuptools import setup
 
+# Read the version without importing the package, which needs django.
+with open(os.path.join(os.path.dirname(__file__), 'timedelta', '_version.py')) as version_file:
+    VERSION = re.search(r"__version__ = '([^']+)'", version_file.read()).group(1)
+
 setup(
     name = "django-timedeltafield",
-    version = open(os.path.join(os.path.dirname(__file__), 'timedelta', 'VERSION')).read().strip(),
+    version = VERSION,
     description = "TimedeltaField for django models",
     long_description = open("README").read(),
     url = "http://hg.schinckel.net/django-timedelta-field/",
@@ -12,13 +17,19 @@ setup(
     packages = [
         "timedelta",
         "timedelta.templatetags",
+        "timedelta.management",
+        "timedelta.management.commands",
     ],
-    package_data = {'timedelta': ['VERSION']},
+    install_requires = ['Django>=1.8'],
     classifiers = [
         'Programming Language :: Python',
         'License :: OSI Approved :: BSD License',
         'Operating System :: OS Independent',
         'Framework :: Django',
+        'Framework :: Django :: 1.8',
+        'Framework :: Django :: 1.9',
+        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
     ],
     test_suite='tests.main',
 )
@@ -1,19 +1,69 @@
-import os
-
-__version__ = open(os.path.join(os.path.dirname(__file__), "VERSION")).read().strip()
-
-try:
-    from django.core.exceptions import ImproperlyConfigured
-except ImportError:
-    ImproperlyConfigured = ImportError
-
-try:
-    from .fields import TimedeltaField
-    from .helpers import (
-        divide, multiply, modulo, 
-        parse, nice_repr, 
-        percentage, decimal_percentage,
-        total_seconds
-    )
-except (ImportError, ImproperlyConfigured):
-    pass
\ No newline at end of file
+"""
+A TimedeltaField for django models, and helpers for working with
+timedeltas.
+
+The public names below are imported from their modules the first time
+they are used, so that ``import timedelta.helpers`` does not pull in
+django's model and form machinery as well.
+"""
+import importlib
+import sys
+
+from ._version import __version__
+
+default_app_config = 'timedelta.apps.TimedeltaConfig'
+
+_LAZY_ATTRIBUTES = {
+    'TimedeltaArray': 'arrays',
+    'TimedeltaField': 'fields',
+    'divide': 'helpers',
+    'multiply': 'helpers',
+    'modulo': 'helpers',
+    'parse': 'helpers',
+    'nice_repr': 'helpers',
+    'percentage': 'helpers',
+    'decimal_percentage': 'helpers',
+    'total_seconds': 'helpers',
+}
+
+_SUBMODULES = (
+    'aggregates', 'apps', 'arrays', 'bulk', 'cache', 'expressions', 'fields', 'forms', 'helpers',
+    'instrumentation', 'lookups', 'operations', 'streaming', 'widgets',
+)
+
+__all__ = sorted(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    try:
+        module = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES) | set(_SUBMODULES))
+
+
+if sys.version_info < (3, 7):
+    # Module __getattr__ (PEP 562) is new in python 3.7. Before that, the
+    # same thing needs a module subclass, which replaces this module.
+    import types
+
+    class _LazyModule(types.ModuleType):
+        def __getattr__(self, name):
+            value = __getattr__(name)
+            setattr(self, name, value)
+            return value
+
+        def __dir__(self):
+            return __dir__()
+
+    _module = _LazyModule(__name__, __doc__)
+    _module.__dict__.update(globals())
+    sys.modules[__name__] = _module
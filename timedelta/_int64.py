@@ -0,0 +1,101 @@
+"""
+Exact scaling of int64 numpy arrays, for helpers.multiply_many() and
+divide_many(), when value * numerator might overflow an int64 but the
+rounded results do not.
+
+A float's ratio has a large numerator (0.1 is 3602879701896397 / 2 ** 55),
+so this is the usual case for float factors. The products are built from
+21 bit limbs, so that the product of two limbs, and the sum of three of
+those, fit in an int64, and then divided by shifting them (for a power of
+two) or by long division. tests.py compares the results with
+helpers._divide_rounded() on random values.
+"""
+from .helpers import _round_array
+
+
+LIMB_BITS = 21
+LIMB_MASK = (1 << LIMB_BITS) - 1
+
+
+def wrapped_power_of_two(exponent):
+    """
+    2 ** exponent as an int64, modulo 2 ** 64 (so None if that is 0).
+    """
+    if exponent >= 64:
+        return None
+    if exponent == 63:
+        return -2 ** 63
+    return 1 << exponent
+
+
+def product_limbs(numpy, values, factor):
+    """
+    The exact products of an int64 array and an integer factor, where
+    abs(factor) < 2 ** 63, as a list of arrays of limbs, least significant
+    first: all but the last are between 0 and 2 ** 21, and the last has
+    the sign.
+    """
+    value_limbs = [values & LIMB_MASK, (values >> LIMB_BITS) & LIMB_MASK, values >> 2 * LIMB_BITS]
+    factor_limbs = [(abs(factor) >> shift) & LIMB_MASK for shift in (0, LIMB_BITS, 2 * LIMB_BITS)]
+
+    limbs = []
+    carry = numpy.zeros_like(values)
+    for column in range(5):
+        total = carry
+        for i in range(max(0, column - 2), min(column, 2) + 1):
+            if factor_limbs[column - i]:
+                if factor < 0:
+                    total = total - value_limbs[i] * factor_limbs[column - i]
+                else:
+                    total = total + value_limbs[i] * factor_limbs[column - i]
+        limbs.append(total & LIMB_MASK)
+        carry = total >> LIMB_BITS
+    limbs.append(carry)
+    return limbs
+
+
+def scale_array(numpy, values, numerator, denominator, rounding):
+    """
+    helpers._divide_rounded(value * numerator, denominator, rounding) for
+    each of an int64 array, where the results fit in an int64, and
+    abs(numerator) < 2 ** 63. denominator must be a power of two (as for
+    any float), or less than 2 ** 42.
+    """
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    limbs = product_limbs(numpy, values, numerator)
+    zero = numpy.zeros_like(values)
+    quotient = zero
+
+    if not denominator & (denominator - 1):
+        shift = denominator.bit_length() - 1
+        # The bit worth half the denominator, and those below it.
+        half_bit = shift - 1
+        half = below = zero != 0
+        for index, limb in enumerate(limbs):
+            position = index * LIMB_BITS
+            if position >= shift:
+                multiplier = wrapped_power_of_two(position - shift)
+                if multiplier is not None:
+                    quotient = quotient + limb * multiplier
+            elif position + LIMB_BITS > shift or index == len(limbs) - 1:
+                quotient = quotient + (limb >> min(shift - position, 63))
+
+            if position + LIMB_BITS <= half_bit and index < len(limbs) - 1:
+                below = below | (limb != 0)
+            elif position <= half_bit:
+                offset = min(half_bit - position, 63)
+                half = (limb >> offset) & 1 == 1
+                below = below | (limb & ((1 << offset) - 1) != 0)
+        return _round_array(quotient, half | below, half & below, half & ~below, rounding)
+
+    remainder = zero
+    for index in reversed(range(len(limbs))):
+        total = (remainder << LIMB_BITS) + limbs[index]
+        digit = numpy.floor_divide(total, denominator)
+        remainder = total - digit * denominator
+        multiplier = wrapped_power_of_two(index * LIMB_BITS)
+        if multiplier is not None:
+            quotient = quotient + digit * multiplier
+    doubled = remainder * 2
+    return _round_array(quotient, remainder != 0, doubled > denominator, doubled == denominator, rounding)
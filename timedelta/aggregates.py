@@ -0,0 +1,248 @@
+"""
+Aggregates over TimedeltaFields, which are calculated in the database and
+return datetime.timedelta objects:
+
+    Job.objects.aggregate(total=Sum('duration'), average=Avg('duration'))
+
+PostgreSQL aggregates the INTERVAL column natively; other backends
+aggregate the stored number of microseconds.
+
+There are also Percentile and Median aggregates, and the portable
+percentiles() and DurationHistogram, for distributions of durations.
+"""
+import datetime
+from array import array
+
+from django.db import connections, models, transaction
+
+from .expressions import TotalMicroseconds
+from .fields import TimedeltaField, stores_microseconds
+from .helpers import MICROSECONDS_TYPECODE
+
+
+class DurationAggregate(object):
+    def __init__(self, expression, **extra):
+        extra.setdefault('output_field', TimedeltaField())
+        super(DurationAggregate, self).__init__(expression, **extra)
+
+
+class Sum(DurationAggregate, models.Sum):
+    pass
+
+
+class Avg(DurationAggregate, models.Avg):
+    pass
+
+
+class Min(DurationAggregate, models.Min):
+    pass
+
+
+class Max(DurationAggregate, models.Max):
+    pass
+
+
+class Percentile(DurationAggregate, models.Aggregate):
+    """
+    The (continuous, interpolated) percentile of a TimedeltaField, where
+    fraction is between 0 and 1:
+
+        Job.objects.aggregate(p95=Percentile('duration', 0.95))
+
+    This uses PERCENTILE_CONT in PostgreSQL, and an aggregate function
+    registered with sqlite. Other backends should use percentiles().
+    """
+    name = 'Percentile'
+
+    def __init__(self, expression, fraction, **extra):
+        if not 0 <= fraction <= 1:
+            raise ValueError('Percentile fraction must be between 0 and 1.')
+        self.fraction = float(fraction)
+        super(Percentile, self).__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection):
+        raise NotImplementedError(
+            '%s is not supported on %s: use timedelta.aggregates.percentiles().' % (self.name, connection.vendor)
+        )
+
+    def as_postgresql(self, compiler, connection):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return 'PERCENTILE_CONT(%r) WITHIN GROUP (ORDER BY %s)' % (self.fraction, sql), params
+
+    def as_sqlite(self, compiler, connection):
+        connection.ensure_connection()
+        connection.connection.create_aggregate('timedelta_percentile', 2, SqlitePercentile)
+        sql, params = compiler.compile(self.source_expressions[0])
+        return 'timedelta_percentile(%s, %r)' % (sql, self.fraction), params
+
+
+class Median(Percentile):
+    name = 'Median'
+
+    def __init__(self, expression, **extra):
+        super(Median, self).__init__(expression, 0.5, **extra)
+
+
+def _interpolate(values, fraction):
+    """
+    The percentile of a sorted sequence, interpolated in the same way as
+    PERCENTILE_CONT.
+
+    >>> _interpolate([0, 10, 20, 30], 0.5)
+    15.0
+    >>> _interpolate([0, 10, 20, 30], 1)
+    30
+    """
+    position = fraction * (len(values) - 1)
+    lower = int(position)
+    if lower == position:
+        return values[lower]
+    return values[lower] + (values[lower + 1] - values[lower]) * (position - lower)
+
+
+class SqlitePercentile(object):
+    """
+    The sqlite aggregate function behind Percentile.
+    """
+    def __init__(self):
+        self.values = array(MICROSECONDS_TYPECODE)
+        self.fraction = None
+
+    def step(self, value, fraction):
+        if value is not None:
+            self.values.append(value)
+            self.fraction = fraction
+
+    def finalize(self):
+        if not self.values:
+            return None
+        return _interpolate(sorted(self.values), self.fraction)
+
+
+def percentiles(queryset, field, fractions):
+    """
+    Return a list of the percentiles of field (the name of a TimedeltaField)
+    across the queryset, one timedelta (or None, if there are no values) for
+    each item of fractions.
+
+    This works on every backend: in PostgreSQL it uses PERCENTILE_CONT, and
+    elsewhere it counts the rows, and then fetches the one or two (numeric)
+    values around each percentile from the sorted column, which an index on
+    the column makes cheap. Those queries are made in one transaction, and
+    if rows are deleted between them anyway (without a repeatable read
+    snapshot), the rows are counted again.
+    """
+    fractions = list(fractions)
+    for fraction in fractions:
+        if not 0 <= fraction <= 1:
+            raise ValueError('Percentile fraction must be between 0 and 1.')
+    connection = connections[queryset.db]
+
+    if not stores_microseconds(connection):
+        result = queryset.aggregate(**dict(
+            ('p%i' % index, Percentile(field, fraction))
+            for index, fraction in enumerate(fractions)
+        ))
+        return [result['p%i' % index] for index in range(len(fractions))]
+
+    queryset = queryset.filter(**{'%s__isnull' % field: False})
+    values = queryset.annotate(
+        _microseconds=TotalMicroseconds(field)
+    ).order_by('_microseconds').values_list('_microseconds', flat=True)
+
+    with transaction.atomic(using=queryset.db):
+        count = queryset.count()
+        result = []
+        for fraction in fractions:
+            while True:
+                if not count:
+                    result.append(None)
+                    break
+                position = fraction * (count - 1)
+                lower = int(position)
+                around = list(values[lower:lower + 2])
+                if len(around) > (lower != position):
+                    microseconds = _interpolate(around, position - lower)
+                    result.append(datetime.timedelta(microseconds=int(round(microseconds))))
+                    break
+                count = queryset.count()
+    return result
+
+
+class DurationHistogram(object):
+    """
+    Count the values of a TimedeltaField that fall between each of a list
+    of edges (timedeltas, in ascending order):
+
+        histogram = DurationHistogram('duration', [timedelta(minutes=1), timedelta(hours=1)])
+        histogram.count(Job.objects.all())
+
+    returns a list with one more item than there are edges: the number of
+    values less than the first edge, then the number between each pair of
+    edges (including the lower edge), then the number greater than or equal
+    to the last edge. NULLs are not counted.
+
+    This uses WIDTH_BUCKET in PostgreSQL, and a single pass of conditional
+    counts on other backends.
+    """
+    def __init__(self, field, edges):
+        self.field = field
+        self.edges = list(edges)
+        if self.edges != sorted(self.edges):
+            raise ValueError('DurationHistogram edges must be in ascending order.')
+
+    def buckets(self):
+        """
+        The (lower, upper) edges of each bucket: None for an open end.
+        """
+        lowers = [None] + self.edges
+        uppers = self.edges + [None]
+        return list(zip(lowers, uppers))
+
+    def count(self, queryset):
+        connection = connections[queryset.db]
+        if stores_microseconds(connection):
+            return self._count_conditional(queryset)
+        counts = [0] * (len(self.edges) + 1)
+        rows = queryset.annotate(
+            _bucket=WidthBucket(self.field, self.edges)
+        ).filter(**{'%s__isnull' % self.field: False}).values('_bucket').annotate(
+            _count=models.Count('pk')
+        ).order_by()
+        for row in rows:
+            counts[row['_bucket']] = row['_count']
+        return counts
+
+    def _count_conditional(self, queryset):
+        aggregates = {}
+        for index, (lower, upper) in enumerate(self.buckets()):
+            condition = {}
+            if lower is not None:
+                condition['%s__gte' % self.field] = lower
+            if upper is not None:
+                condition['%s__lt' % self.field] = upper
+            if not condition:
+                condition['%s__isnull' % self.field] = False
+            aggregates['b%i' % index] = models.Count(
+                models.Case(models.When(then=1, **condition), output_field=models.IntegerField())
+            )
+        result = queryset.aggregate(**aggregates)
+        return [result['b%i' % index] for index in range(len(self.edges) + 1)]
+
+
+class WidthBucket(models.Func):
+    """
+    PostgreSQL's WIDTH_BUCKET(operand, thresholds), for an interval column.
+    """
+    def __init__(self, expression, edges, **extra):
+        self.edges = edges
+        extra.setdefault('output_field', models.IntegerField())
+        super(WidthBucket, self).__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection):
+        sql, params = compiler.compile(self.source_expressions[0])
+        field = TimedeltaField()
+        thresholds = ', '.join(['%s::interval'] * len(self.edges))
+        return 'WIDTH_BUCKET(%s, ARRAY[%s])' % (sql, thresholds), list(params) + [
+            field.get_db_prep_value(edge, connection) for edge in self.edges
+        ]
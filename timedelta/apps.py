@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class TimedeltaConfig(AppConfig):
+    name = 'timedelta'
+    verbose_name = 'Timedelta'
+
+    def ready(self):
+        # fields -> lookups -> expressions -> fields would be an import
+        # cycle, so the lookups are registered once everything is loaded.
+        from .fields import TimedeltaField
+        from .lookups import Seconds
+
+        TimedeltaField.register_lookup(Seconds)
@@ -0,0 +1,215 @@
+"""
+A compact container for many timedeltas.
+
+A list of a million datetime.timedelta objects takes around 60MB; a
+TimedeltaArray holds the same durations as one array of 64 bit integer
+microseconds, in 8MB, and only builds timedeltas as they are read:
+
+    >>> durations = TimedeltaArray(['1 hour', datetime.timedelta(minutes=30), 900000000])
+    >>> durations.sum()
+    datetime.timedelta(0, 6300)
+    >>> durations[1]
+    datetime.timedelta(0, 1800)
+    >>> durations.sorted().tolist()
+    [datetime.timedelta(0, 900), datetime.timedelta(0, 1800), datetime.timedelta(0, 3600)]
+"""
+import datetime
+from array import array
+
+from django.utils import six
+
+from .helpers import (
+    MICROSECONDS_TYPECODE, _divide_rounded, _numpy, _parse_microseconds,
+)
+
+
+def _microseconds(value, seen):
+    """
+    The number of microseconds in a timedelta, a string that parse()
+    accepts, or an integer (which is already a number of microseconds).
+    Parsed strings are remembered in seen.
+    """
+    if isinstance(value, datetime.timedelta):
+        return (value.days * 86400 + value.seconds) * 1000000 + value.microseconds
+    if isinstance(value, six.integer_types):
+        return value
+    if isinstance(value, six.string_types):
+        try:
+            return seen[value]
+        except KeyError:
+            pass
+        microseconds = _parse_microseconds(six.text_type(value.strip()))
+        if microseconds is None:
+            raise TypeError("'%s' is not a valid time interval" % value.strip())
+        seen[value] = microseconds
+        return microseconds
+    raise TypeError('%r is not a timedelta, string or integer.' % (value,))
+
+
+class TimedeltaArray(object):
+    """
+    A sequence of durations, stored as an array.array of microseconds.
+
+    It can be built from, and extended with, timedeltas, strings (which
+    are parsed as by helpers.parse()) and integers (which are a number of
+    microseconds, not seconds). Items are returned as timedeltas.
+
+    A slice is a copy, as for a list. view() gives a slice that shares the
+    same memory instead: while a view exists, the array it came from can't
+    grow (array.array raises a BufferError), and appending to a view first
+    copies it.
+
+    >>> durations = TimedeltaArray(['1 hour', '2 hours', '3 hours'])
+    >>> durations[1:].microseconds.tolist()
+    [7200000000, 10800000000]
+    >>> durations.view(1).microseconds.tolist()
+    [7200000000, 10800000000]
+    >>> durations.mean(), durations.min(), durations.max()
+    (datetime.timedelta(0, 7200), datetime.timedelta(0, 3600), datetime.timedelta(0, 10800))
+    >>> durations.append('foo')
+    Traceback (most recent call last):
+        ...
+    TypeError: 'foo' is not a valid time interval
+    """
+    __slots__ = ('_data',)
+
+    def __init__(self, values=()):
+        self._data = array(MICROSECONDS_TYPECODE)
+        self.extend(values)
+
+    @classmethod
+    def from_microseconds(cls, values):
+        """
+        A TimedeltaArray of a sequence of integer microseconds, such as the
+        values of helpers.parse_many() or expressions.values_list_microseconds().
+        An array.array of the right type is used as it is, not copied.
+        """
+        instance = cls.__new__(cls)
+        if isinstance(values, array) and values.typecode == MICROSECONDS_TYPECODE:
+            instance._data = values
+        else:
+            instance._data = array(MICROSECONDS_TYPECODE, values)
+        return instance
+
+    @property
+    def microseconds(self):
+        """
+        The durations, in microseconds: an array.array, or a memoryview of
+        one for a view().
+        """
+        return self._data
+
+    @property
+    def nbytes(self):
+        return len(self._data) * self._data.itemsize
+
+    def _writable(self):
+        if not isinstance(self._data, array):
+            self._data = array(MICROSECONDS_TYPECODE, self._data)
+        return self._data
+
+    def append(self, value):
+        self._writable().append(_microseconds(value, {}))
+
+    def extend(self, values):
+        data = self._writable()
+        if isinstance(values, TimedeltaArray):
+            values = values._data
+        if isinstance(values, array) and values.typecode == MICROSECONDS_TYPECODE:
+            data.extend(values)
+            return
+        seen = {}
+        data.extend(_microseconds(value, seen) for value in values)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TimedeltaArray.from_microseconds(self._data[index])
+        return datetime.timedelta(0, 0, self._data[index])
+
+    def view(self, start=None, stop=None, step=None):
+        """
+        The slice [start:stop:step], sharing this array's memory rather than
+        copying it. This array can't be extended while the view exists.
+        """
+        index = slice(start, stop, step)
+        try:
+            data = memoryview(self._data)
+        except TypeError:
+            # Python 2's array.array does not support memoryview.
+            return self[index]
+        instance = TimedeltaArray.__new__(TimedeltaArray)
+        instance._data = data[index]
+        return instance
+
+    def __iter__(self):
+        for microseconds in self._data:
+            yield datetime.timedelta(0, 0, microseconds)
+
+    def __eq__(self, other):
+        if isinstance(other, TimedeltaArray):
+            return len(self) == len(other) and all(a == b for a, b in zip(self._data, other._data))
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'TimedeltaArray.from_microseconds(%r)' % (self._data.tolist(),)
+
+    def tolist(self):
+        """
+        The durations, as a list of timedeltas.
+        """
+        return [datetime.timedelta(0, 0, microseconds) for microseconds in self._data]
+
+    def _numpy_values(self):
+        numpy = _numpy()
+        if numpy is None or not len(self._data):
+            return None
+        data = self._data
+        if isinstance(data, memoryview) and not data.c_contiguous:
+            # numpy.frombuffer() can't read a stepped slice.
+            data = array(MICROSECONDS_TYPECODE, data)
+        return numpy.frombuffer(data, dtype=numpy.int64)
+
+    def sum(self):
+        # Summing python integers can't overflow, where numpy's int64 would.
+        return datetime.timedelta(0, 0, sum(self._data))
+
+    def mean(self):
+        """
+        The mean duration, rounded half to even to a whole microsecond.
+        """
+        if not len(self._data):
+            raise ValueError('mean() of an empty TimedeltaArray')
+        return datetime.timedelta(0, 0, _divide_rounded(sum(self._data), len(self._data)))
+
+    def min(self):
+        values = self._numpy_values()
+        if values is None:
+            return datetime.timedelta(0, 0, min(self._data))
+        return datetime.timedelta(0, 0, int(values.min()))
+
+    def max(self):
+        values = self._numpy_values()
+        if values is None:
+            return datetime.timedelta(0, 0, max(self._data))
+        return datetime.timedelta(0, 0, int(values.max()))
+
+    def sorted(self, reverse=False):
+        """
+        A new TimedeltaArray of the same durations, in order.
+        """
+        values = self._numpy_values()
+        if values is None:
+            return TimedeltaArray.from_microseconds(sorted(self._data, reverse=reverse))
+        values = _numpy().sort(values)
+        if reverse:
+            values = values[::-1]
+        return TimedeltaArray.from_microseconds(array(MICROSECONDS_TYPECODE, values.tobytes()))
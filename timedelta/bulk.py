@@ -0,0 +1,208 @@
+"""
+Bulk loading of CSV/TSV files into models with TimedeltaFields.
+
+The file is split into chunks of roughly ``chunk_size`` bytes, which are
+read and parsed in a pool of worker processes: only the finished rows are
+sent back to this process, to be saved with bulk_create().
+
+A chunk holds every line that *starts* within its byte range, so quoted
+values must not contain newlines.
+"""
+import csv
+import datetime
+import io
+import os
+import time
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import router, transaction
+
+from .fields import TimedeltaField
+from .helpers import _parse_microseconds
+
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ChunkResult(object):
+    """
+    The rows read from one chunk of the file, and how long it took.
+    """
+    def __init__(self, index, rows, errors, size, seconds):
+        self.index = index
+        self.rows = rows
+        self.errors = errors
+        self.size = size
+        self.seconds = seconds
+
+    def __repr__(self):
+        return '<ChunkResult %i: %i rows, %i errors>' % (self.index, len(self.rows), len(self.errors))
+
+
+def _read_chunk(handle, start, end):
+    """
+    Read the lines that start within the byte range [start, end).
+    """
+    if start:
+        handle.seek(start - 1)
+        if handle.read(1) != b'\n':
+            # The line we are part-way through belongs to the previous chunk.
+            handle.readline()
+    begin = handle.tell()
+    if begin >= end:
+        return b''
+    data = handle.read(end - begin)
+    if data and not data.endswith(b'\n'):
+        data += handle.readline()
+    return data
+
+
+def parse_chunk(path, index, start, end, duration_columns, delimiter=',', encoding='utf-8',
+                columns=None, null_columns=()):
+    """
+    Read one chunk of a file, and parse the values in duration_columns (a
+    sequence of column indexes) into integer microseconds. Empty values in
+    null_columns (a subset of duration_columns) become None.
+
+    Returns a ChunkResult: rows that contain an invalid duration, or that
+    don't have columns values (or, if columns is None, are too short to
+    hold every duration column), are left out of its rows, and their text
+    is added to its errors instead.
+
+    This runs in the worker processes, so it must be importable, and only
+    deals with plain python values.
+    """
+    started = time.time()
+    with open(path, 'rb') as handle:
+        data = _read_chunk(handle, start, end)
+
+    if columns is None:
+        columns = max(duration_columns) + 1 if duration_columns else 0
+        short = lambda row: len(row) < columns
+    else:
+        short = lambda row: len(row) != columns
+
+    rows = []
+    errors = []
+    for row in csv.reader(io.StringIO(data.decode(encoding)), delimiter=delimiter):
+        if not row:
+            continue
+        if short(row):
+            errors.append(delimiter.join(row))
+            continue
+        for column in duration_columns:
+            value = row[column].strip()
+            if not value and column in null_columns:
+                row[column] = None
+                continue
+            microseconds = _parse_microseconds(value) if value else None
+            if microseconds is None:
+                errors.append(delimiter.join(row))
+                break
+            row[column] = microseconds
+        else:
+            rows.append(row)
+
+    return ChunkResult(index, rows, errors, len(data), time.time() - started)
+
+
+def chunk_ranges(path, start, chunk_size):
+    """
+    Split the file, from the byte offset start, into ranges of chunk_size.
+    """
+    size = os.path.getsize(path)
+    return [
+        (offset, min(offset + chunk_size, size))
+        for offset in range(start, size, chunk_size)
+    ]
+
+
+def import_durations(path, model, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                     ordered=True, delimiter=None, encoding='utf-8',
+                     batch_size=1000, using=None, skip_invalid=False,
+                     report=None):
+    """
+    Load a CSV (or TSV) file into model, using bulk_create().
+
+    The first line of the file must name the model field for each column:
+    an unknown name raises a ValueError. The columns for TimedeltaFields
+    are parsed in a pool of ``workers`` processes (by default, one per CPU),
+    each handling ``chunk_size`` bytes of the file at a time. An empty value
+    is saved as None if the field has null=True.
+
+    If ordered is True, rows are saved in the order they appear in the
+    file: otherwise each chunk is saved as soon as it has been parsed.
+
+    A row with an invalid duration, or with a different number of values
+    than the first line, raises a ValueError, unless skip_invalid is True,
+    in which case it is left out. Everything is saved in a single
+    transaction, so nothing is saved if an error is raised.
+
+    report, if given, is called with each ChunkResult (and the time it took
+    to save its rows) once it has been saved.
+
+    Returns the number of rows that were saved.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if delimiter is None:
+        delimiter = '\t' if path.endswith('.tsv') else ','
+
+    with open(path, 'rb') as handle:
+        header = handle.readline()
+        data_start = handle.tell()
+    names = next(csv.reader([header.decode(encoding)], delimiter=delimiter))
+    names = [name.strip() for name in names]
+
+    fields = []
+    for name in names:
+        try:
+            fields.append(model._meta.get_field(name))
+        except FieldDoesNotExist:
+            raise ValueError('Unknown column %r: %s has no such field.' % (name, model._meta.object_name))
+    duration_columns = [
+        column for column, field in enumerate(fields)
+        if isinstance(field, TimedeltaField)
+    ]
+    null_columns = set(column for column in duration_columns if fields[column].null)
+    ranges = chunk_ranges(path, data_start, chunk_size)
+
+    if using is None:
+        using = router.db_for_write(model)
+
+    saved = 0
+    manager = model._default_manager.db_manager(using)
+    with ProcessPoolExecutor(max_workers=workers) as executor, transaction.atomic(using):
+        futures = [
+            executor.submit(
+                parse_chunk, path, index, start, end, duration_columns, delimiter, encoding, len(names),
+                null_columns,
+            )
+            for index, (start, end) in enumerate(ranges)
+        ]
+        if ordered:
+            results = (future.result() for future in futures)
+        else:
+            from concurrent.futures import as_completed
+            results = (future.result() for future in as_completed(futures))
+
+        for result in results:
+            if result.errors and not skip_invalid:
+                for future in futures:
+                    future.cancel()
+                raise ValueError('Invalid row: %r' % result.errors[0])
+
+            started = time.time()
+            objects = []
+            for row in result.rows:
+                for column in duration_columns:
+                    if row[column] is not None:
+                        row[column] = datetime.timedelta(microseconds=row[column])
+                objects.append(model(**dict(zip(names, row))))
+            manager.bulk_create(objects, batch_size=batch_size)
+            saved += len(objects)
+
+            if report is not None:
+                report(result, time.time() - started)
+
+    return saved
@@ -0,0 +1,180 @@
+"""
+Opt-in memoization of parsed and formatted timedeltas.
+
+Most columns and form inputs only ever hold a handful of distinct values
+("1 hour", "30 minutes", "1 day, 0:00:00"), so rather than running them
+through helpers.parse() every time a row is loaded, the results can be
+kept in a bounded LRU cache. Likewise, the strings that nice_repr() (and
+the timedelta template filter) returns can be cached. Enable them in your
+settings:
+
+    TIMEDELTA_PARSE_CACHE_SIZE = 1024
+    TIMEDELTA_NICE_REPR_CACHE_SIZE = 1024
+
+The default of 0 disables a cache.
+"""
+import threading
+from collections import OrderedDict
+
+from django.utils import six
+
+from . import helpers, instrumentation
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping that holds at most ``maxsize`` items, discarding
+    the least recently used one when it is full.
+
+    >>> cache = LRUCache(2)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> sorted(cache.info().items())
+    [('evictions', 1), ('hits', 1), ('maxsize', 2), ('misses', 1), ('size', 2)]
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+            elif len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            self._data[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _get_cache(setting):
+    try:
+        return _caches[setting]
+    except KeyError:
+        pass
+    from django.conf import settings
+    with _caches_lock:
+        if setting not in _caches:
+            size = getattr(settings, setting, 0)
+            _caches[setting] = LRUCache(size) if size else None
+        return _caches[setting]
+
+
+def get_parse_cache():
+    """
+    Return the LRUCache used by parse(), or None if it is disabled by the
+    TIMEDELTA_PARSE_CACHE_SIZE setting.
+    """
+    return _get_cache('TIMEDELTA_PARSE_CACHE_SIZE')
+
+
+def get_nice_repr_cache():
+    """
+    Return the LRUCache used by nice_repr(), or None if it is disabled by
+    the TIMEDELTA_NICE_REPR_CACHE_SIZE setting.
+    """
+    return _get_cache('TIMEDELTA_NICE_REPR_CACHE_SIZE')
+
+
+def reset_caches(**kwargs):
+    """
+    Forget the configured caches: the settings will be re-read the next
+    time each cache is used.
+    """
+    setting = kwargs.get('setting')
+    if setting is None:
+        _caches.clear()
+    else:
+        _caches.pop(setting, None)
+
+
+try:
+    from django.test.signals import setting_changed
+except ImportError:
+    pass
+else:
+    setting_changed.connect(reset_caches)
+
+
+def parse(string):
+    """
+    The same as helpers.parse(), but the result is looked up in (and then
+    stored in) the parse cache, if one is configured.
+
+    Strings are cached on their stripped value, and strings that can't be
+    parsed are never cached.
+    """
+    cache = get_parse_cache()
+    if cache is None:
+        return helpers.parse(string)
+    key = string.strip()
+    if not isinstance(key, six.text_type):
+        key = six.text_type(key)
+    value = cache.get(key)
+    if instrumentation.enabled:
+        instrumentation.cache_lookup('parse', value is not None)
+    if value is None:
+        value = helpers.parse(key)
+        cache.set(key, value)
+    return value
+
+
+def nice_repr(timedelta, display="long", sep=", "):
+    """
+    The same as helpers.nice_repr(), but the result is looked up in (and
+    then stored in) the nice_repr cache, if one is configured.
+
+    Results are cached on the whole number of seconds, which is all that
+    nice_repr() displays, along with display and sep.
+    """
+    cache = get_nice_repr_cache()
+    if cache is None:
+        return helpers.nice_repr(timedelta, display, sep)
+    key = (timedelta.days, timedelta.seconds, display, sep)
+    value = cache.get(key)
+    if instrumentation.enabled:
+        instrumentation.cache_lookup('nice_repr', value is not None)
+    if value is None:
+        value = helpers.nice_repr(timedelta, display, sep)
+        cache.set(key, value)
+    return value
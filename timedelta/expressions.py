@@ -0,0 +1,329 @@
+"""
+Query expressions for working with durations in the database.
+"""
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, FieldError
+from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+
+from .fields import TimedeltaField, stores_microseconds
+from .helpers import total_microseconds
+
+
+class TotalSeconds(models.Func):
+    """
+    The number of seconds in a TimedeltaField (or interval expression), as
+    a float.
+
+        Job.objects.annotate(seconds=TotalSeconds('duration')).order_by('-seconds')
+    """
+    def __init__(self, expression, **extra):
+        extra.setdefault('output_field', models.FloatField())
+        super(TotalSeconds, self).__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection):
+        sql, params = compiler.compile(self.source_expressions[0])
+        if stores_microseconds(connection):
+            return '(%s / 1000000.0)' % sql, params
+        return 'EXTRACT(EPOCH FROM %s)' % sql, params
+
+
+class TotalMicroseconds(models.Func):
+    """
+    The number of microseconds in a TimedeltaField (or interval expression),
+    as an integer.
+
+    The database already returns an integer, so no timedelta is ever built,
+    and no converters run on the values: see values_list_microseconds().
+    """
+    def __init__(self, expression, **extra):
+        extra.setdefault('output_field', models.BigIntegerField())
+        super(TotalMicroseconds, self).__init__(expression, **extra)
+
+    def get_db_converters(self, connection):
+        return self.output_field.get_db_converters(connection)
+
+    def as_sql(self, compiler, connection):
+        sql, params = compiler.compile(self.source_expressions[0])
+        if stores_microseconds(connection):
+            return sql, params
+        return 'CAST(EXTRACT(EPOCH FROM %s) * 1000000 AS BIGINT)' % sql, params
+
+
+def _timedelta_field(queryset, name):
+    """
+    The TimedeltaField that a values_list() name refers to, following
+    'pk' and related__field paths, or None for anything else (including
+    annotations).
+    """
+    if name in queryset.query.annotations:
+        return None
+    model = queryset.model
+    parts = name.split(LOOKUP_SEP)
+    try:
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+            if model is None:
+                return None
+        if parts[-1] == 'pk':
+            field = model._meta.pk
+        else:
+            field = model._meta.get_field(parts[-1])
+    except FieldDoesNotExist:
+        return None
+    if isinstance(field, TimedeltaField):
+        return field
+
+
+def values_list_microseconds(queryset, *fields, **kwargs):
+    """
+    queryset.values_list(*fields), except that TimedeltaFields come back as
+    integer numbers of microseconds, straight from the database, rather
+    than as timedeltas:
+
+        for pk, microseconds in values_list_microseconds(Job.objects.all(), 'pk', 'duration').iterator():
+            ...
+
+    Fields on related models ('job__duration') are converted too; other
+    names, such as 'pk' or annotations, are passed to values_list() as they
+    are. flat=True is accepted, as for values_list().
+    """
+    names = []
+    annotations = {}
+    for field in fields:
+        if _timedelta_field(queryset, field) is not None:
+            alias = '_%s_microseconds' % field.replace(LOOKUP_SEP, '_')
+            annotations[alias] = TotalMicroseconds(field)
+            field = alias
+        names.append(field)
+    return queryset.annotate(**annotations).values_list(*names, **kwargs)
+
+
+class TimeBucket(models.Func):
+    """
+    The start of the fixed-width bucket that a datetime expression falls
+    into, counted from the unix epoch, like helpers.time_bucket():
+
+        Event.objects.annotate(
+            bucket=TimeBucket('start', datetime.timedelta(minutes=15))
+        ).values('bucket').annotate(count=Count('pk')).order_by('bucket')
+
+    The width must be a whole number of seconds.
+    """
+    def __init__(self, expression, width, **extra):
+        microseconds = total_microseconds(width)
+        if microseconds <= 0 or microseconds % 1000000:
+            raise ValueError('TimeBucket width must be a positive, whole number of seconds.')
+        self.seconds = microseconds // 1000000
+        extra.setdefault('output_field', models.DateTimeField())
+        super(TimeBucket, self).__init__(expression, **extra)
+
+    def _compile(self, compiler, connection):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return sql, list(params)
+
+    def as_sql(self, compiler, connection):
+        raise NotImplementedError('TimeBucket is not supported on %s.' % connection.vendor)
+
+    def as_postgresql(self, compiler, connection):
+        sql, params = self._compile(compiler, connection)
+        sql = 'TO_TIMESTAMP(FLOOR(EXTRACT(EPOCH FROM %s) / %i) * %i)' % (sql, self.seconds, self.seconds)
+        if not settings.USE_TZ:
+            sql = "(%s AT TIME ZONE 'UTC')" % sql
+        return sql, params
+
+    def as_mysql(self, compiler, connection):
+        sql, params = self._compile(compiler, connection)
+        return (
+            "TIMESTAMPADD(SECOND, FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %s) / %i) * %i, "
+            "'1970-01-01 00:00:00')" % (sql, self.seconds, self.seconds)
+        ), params
+
+    def as_sqlite(self, compiler, connection):
+        sql, params = self._compile(compiler, connection)
+        # Integer division truncates towards zero, so datetimes before the
+        # epoch need to be moved down a bucket.
+        epoch = 'CAST(STRFTIME(%%s, %s) AS INTEGER)' % sql
+        return (
+            "DATETIME(CASE WHEN {epoch} >= 0 THEN {epoch} / {seconds} "
+            "ELSE ({epoch} - {seconds} + 1) / {seconds} END * {seconds}, 'unixepoch')".format(
+                epoch=epoch, seconds=self.seconds,
+            )
+        ), (['%s'] + params) * 3
+
+
+INTEGER_TYPES = {
+    'sqlite': 'INTEGER',
+    'mysql': 'SIGNED',
+    'oracle': 'NUMBER(19)',
+}
+
+
+def _is_duration(expression):
+    try:
+        return isinstance(expression.output_field, (TimedeltaField, models.DurationField))
+    except FieldError:
+        return False
+
+
+class DurationArithmetic(models.Func):
+    """
+    Base class for the arithmetic expressions below, which mirror the
+    functions of the same names in helpers.
+
+    Arguments may be field names, expressions, timedeltas or numbers.
+    PostgreSQL works on the intervals directly where it can; other backends
+    do integer arithmetic on the stored microseconds, rounding the result
+    to the nearest microsecond.
+    """
+    def __init__(self, *expressions, **extra):
+        super(DurationArithmetic, self).__init__(*[
+            models.Value(expression, output_field=TimedeltaField())
+            if isinstance(expression, datetime.timedelta) else expression
+            for expression in expressions
+        ], **extra)
+
+    def _compile(self, compiler, connection):
+        compiled = [compiler.compile(expression) for expression in self.source_expressions]
+        return [sql for sql, params in compiled], [list(params) for sql, params in compiled]
+
+    def _microseconds(self, expression, sql, connection):
+        """
+        The SQL for the (possibly fractional) number of microseconds in an
+        argument: for numbers this is their value in seconds.
+        """
+        if not _is_duration(expression):
+            return '(%s * 1000000)' % sql
+        if stores_microseconds(connection):
+            return sql
+        return '(EXTRACT(EPOCH FROM %s) * 1000000)' % sql
+
+    def _from_microseconds(self, sql, connection):
+        """
+        The SQL to store a number of microseconds in a TimedeltaField.
+        """
+        if stores_microseconds(connection):
+            return 'CAST(ROUND(%s) AS %s)' % (sql, INTEGER_TYPES.get(connection.vendor, 'BIGINT'))
+        return "(ROUND(%s) * INTERVAL '1 microsecond')" % sql
+
+
+class Multiply(DurationArithmetic):
+    """
+    A duration multiplied by a number, like helpers.multiply():
+
+        Booking.objects.update(length=Multiply('length', 1.5))
+    """
+    def __init__(self, expression, factor, **extra):
+        extra.setdefault('output_field', TimedeltaField())
+        super(Multiply, self).__init__(expression, factor, **extra)
+
+    def as_sql(self, compiler, connection):
+        (duration, factor), (duration_params, factor_params) = self._compile(compiler, connection)
+        params = duration_params + factor_params
+        if stores_microseconds(connection):
+            return self._from_microseconds('%s * %s' % (duration, factor), connection), params
+        return '(%s * %s)' % (duration, factor), params
+
+
+class Divide(DurationArithmetic):
+    """
+    A duration divided by a number (giving a duration) or by another
+    duration (giving an integer, truncated towards zero, or a float if
+    as_float is True), like helpers.divide():
+
+        Job.objects.update(estimate=Divide('estimate', 2))
+        Job.objects.annotate(ratio=Divide('duration', 'estimate', as_float=True))
+
+    Dividing by a zero duration gives NULL, or an error on PostgreSQL.
+    """
+    def __init__(self, expression, divisor, as_float=False, **extra):
+        self.as_float = as_float
+        super(Divide, self).__init__(expression, divisor, **extra)
+
+    def _resolve_output_field(self):
+        if not _is_duration(self.source_expressions[1]):
+            self._output_field = TimedeltaField()
+        elif self.as_float:
+            self._output_field = models.FloatField()
+        else:
+            self._output_field = models.BigIntegerField()
+
+    def as_sql(self, compiler, connection):
+        (duration, divisor), (duration_params, divisor_params) = self._compile(compiler, connection)
+        params = duration_params + divisor_params
+        if not _is_duration(self.source_expressions[1]):
+            assert not self.as_float, "as_float=True is inappropriate when dividing timedelta by a number."
+            if stores_microseconds(connection):
+                return self._from_microseconds('%s * 1.0 / %s' % (duration, divisor), connection), params
+            return '(%s / %s)' % (duration, divisor), params
+
+        sql = '(%s * 1.0 / %s)' % (
+            self._microseconds(self.source_expressions[0], duration, connection),
+            self._microseconds(self.source_expressions[1], divisor, connection),
+        )
+        if self.as_float:
+            return sql, params
+        if connection.vendor == 'mysql':
+            return 'TRUNCATE(%s, 0)' % sql, params
+        if connection.vendor == 'sqlite':
+            # Casting a real to an integer truncates it.
+            return 'CAST(%s AS INTEGER)' % sql, params
+        return 'CAST(TRUNC(%s) AS BIGINT)' % sql, params
+
+
+class Modulo(DurationArithmetic):
+    """
+    The remainder of dividing a duration by another duration, or by a
+    whole number of seconds, like helpers.modulo():
+
+        Job.objects.annotate(overrun=Modulo('duration', datetime.timedelta(hours=1)))
+
+    As in python, the result has the same sign as the divisor.
+    """
+    def __init__(self, expression, divisor, **extra):
+        extra.setdefault('output_field', TimedeltaField())
+        super(Modulo, self).__init__(expression, divisor, **extra)
+
+    def as_sql(self, compiler, connection):
+        (duration, divisor), (duration_params, divisor_params) = self._compile(compiler, connection)
+        duration = self._microseconds(self.source_expressions[0], duration, connection)
+        divisor = self._microseconds(self.source_expressions[1], divisor, connection)
+        if not stores_microseconds(connection):
+            duration = 'CAST(ROUND(%s) AS BIGINT)' % duration
+            divisor = 'CAST(ROUND(%s) AS BIGINT)' % divisor
+        # SQL takes the sign of the remainder from the dividend.
+        sql = '((%s %%%% %s) + %s) %%%% %s' % (duration, divisor, divisor, divisor)
+        return self._from_microseconds(sql, connection), duration_params + divisor_params * 3
+
+
+class Percentage(DurationArithmetic):
+    """
+    What percentage of the second duration is the first, as a float, like
+    helpers.percentage():
+
+        Job.objects.annotate(progress=Percentage('elapsed', 'estimate'))
+    """
+    def __init__(self, expression, total, **extra):
+        extra.setdefault('output_field', models.FloatField())
+        super(Percentage, self).__init__(expression, total, **extra)
+
+    def as_sql(self, compiler, connection):
+        (part, total), (part_params, total_params) = self._compile(compiler, connection)
+        return '(%s * 100.0 / %s)' % (
+            self._microseconds(self.source_expressions[0], part, connection),
+            self._microseconds(self.source_expressions[1], total, connection),
+        ), part_params + total_params
+
+
+class DecimalPercentage(Percentage):
+    """
+    The same as Percentage, but the result is a Decimal, like
+    helpers.decimal_percentage().
+    """
+    def convert_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+        return Decimal(str(float(value)))
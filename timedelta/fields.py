@@ -1,19 +1,45 @@
+from django.conf import settings
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.utils import six
 
 from collections import defaultdict
 import datetime
+from decimal import Decimal
 
-from .helpers import parse
+from . import instrumentation
+from .cache import parse
 from .forms import TimedeltaFormField
+from .helpers import iso8601_repr, total_microseconds
 
-# TODO: Figure out why django admin thinks fields of this type have changed every time an object is saved.
+class TimedeltaDescriptor(object):
+    """
+    The model attribute for a TimedeltaField.
+
+    Values are stored as they are assigned, and only converted with
+    to_python() when the attribute is read (values loaded from the database
+    have already been converted by from_db_value()).
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.field.attname]
+        if value is None or isinstance(value, datetime.timedelta):
+            return value
+        value = instance.__dict__[self.field.attname] = self.field.to_python(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
 
-class TimedeltaField(six.with_metaclass(models.SubfieldBase, models.Field)):
+
+class TimedeltaField(models.Field):
     """
     Store a datetime.timedelta as an INTERVAL in postgres, or a 
-    CHAR(20) in other database backends.
+    BIGINT number of microseconds in other database backends.
     """
     _south_introspects = True
     
@@ -24,9 +50,18 @@ class TimedeltaField(six.with_metaclass(models.SubfieldBase, models.Field)):
         self._max_value = kwargs.pop('max_value', None)
         super(TimedeltaField, self).__init__(*args, **kwargs)
     
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(TimedeltaField, self).contribute_to_class(cls, name, *args, **kwargs)
+        setattr(cls, self.attname, TimedeltaDescriptor(self))
+    
     def to_python(self, value):
         if (value is None) or isinstance(value, datetime.timedelta):
             return value
+        if instrumentation.enabled:
+            return instrumentation.call('to_python', self._to_python, value)
+        return self._to_python(value)
+    
+    def _to_python(self, value):
         if isinstance(value, int):
             return datetime.timedelta(seconds=value)
         if value == "":
@@ -34,17 +69,49 @@ class TimedeltaField(six.with_metaclass(models.SubfieldBase, models.Field)):
                 return None
             else:
                 return datetime.timedelta(0)
+        if isinstance(value, six.string_types):
+            microseconds = _serialized_microseconds(value)
+            if microseconds is not None:
+                return datetime.timedelta(0, 0, microseconds)
         return parse(value)
     
+    def get_db_converters(self, connection):
+        if not stores_microseconds(connection):
+            # psycopg2 already returns intervals as timedeltas.
+            return []
+        return super(TimedeltaField, self).get_db_converters(connection)
+    
+    def from_db_value(self, value, expression, connection, context):
+        if (value is None) or isinstance(value, datetime.timedelta):
+            return value
+        if isinstance(value, six.integer_types):
+            return datetime.timedelta(0, 0, value)
+        if isinstance(value, (float, Decimal)):
+            # Averages (or, in MySQL, sums) of a BIGINT column.
+            return datetime.timedelta(microseconds=int(round(value)))
+        # Values stored as strings, before we stored microseconds.
+        return self.to_python(value)
+    
     def get_prep_value(self, value):
+        if instrumentation.enabled:
+            return instrumentation.call('get_prep_value', self._get_prep_value, value)
+        return self._get_prep_value(value)
+    
+    def _get_prep_value(self, value):
         if self.null and value == "":
             return None
-        if (value is None) or isinstance(value, six.string_types):
-            return value
-        return str(value).replace(',', '')
+        return self.to_python(value)
         
-    def get_db_prep_value(self, value, connection=None, prepared=None):
-        return self.get_prep_value(value)
+    def get_db_prep_value(self, value, connection=None, prepared=False):
+        """
+        PostgreSQL drivers adapt a timedelta to an interval themselves, so it
+        is passed as it is: other backends get the number of microseconds.
+        """
+        if not prepared and not isinstance(value, datetime.timedelta):
+            value = self.get_prep_value(value)
+        if value is None or connection is None or not stores_microseconds(connection):
+            return value
+        return total_microseconds(value)
         
     def formfield(self, *args, **kwargs):
         defaults = {'form_class':TimedeltaFormField}
@@ -61,8 +128,17 @@ class TimedeltaField(six.with_metaclass(models.SubfieldBase, models.Field)):
                 raise ValidationError('More than maximum allowed value')
     
     def value_to_string(self, obj):
-        value = self._get_val_from_obj(obj)
-        return unicode(value)
+        """
+        Serialize as an ISO8601 duration, or as an integer number of
+        microseconds followed by 'us' if TIMEDELTA_SERIALIZATION is
+        'microseconds'. Both are read back by to_python().
+        """
+        value = self.value_from_object(obj)
+        if value is None:
+            return ''
+        if getattr(settings, 'TIMEDELTA_SERIALIZATION', 'iso8601') == 'microseconds':
+            return six.text_type('%i%s' % (total_microseconds(value), MICROSECONDS_SUFFIX))
+        return six.text_type(iso8601_repr(value))
     
     def get_default(self):
         """
@@ -78,6 +154,8 @@ class TimedeltaField(six.with_metaclass(models.SubfieldBase, models.Field)):
         return ""
         
     def db_type(self, connection):
+        if stores_microseconds(connection):
+            return 'bigint'
         return 'interval'
 
     def deconstruct(self):
@@ -87,3 +165,34 @@ class TimedeltaField(six.with_metaclass(models.SubfieldBase, models.Field)):
         if self._max_value is not None:
             kwargs['max_value'] = self._max_value
         return name, path, args, kwargs
+
+
+# Marks the integer form written by value_to_string(), so that it can't be
+# mistaken for a plain number (which to_python() reads as seconds).
+MICROSECONDS_SUFFIX = 'us'
+
+
+def _serialized_microseconds(value):
+    """
+    The number of microseconds in a string written by value_to_string()
+    with TIMEDELTA_SERIALIZATION = 'microseconds', or None for any other
+    string.
+
+    >>> _serialized_microseconds('-1500000us'), _serialized_microseconds('90')
+    (-1500000, None)
+    """
+    value = value.strip()
+    if not value.endswith(MICROSECONDS_SUFFIX):
+        return None
+    digits = value[:-len(MICROSECONDS_SUFFIX)]
+    if not digits.lstrip('-').isdigit() or digits.count('-') > 1:
+        return None
+    return int(digits)
+
+
+def stores_microseconds(connection):
+    """
+    Does a TimedeltaField store an integer number of microseconds on this
+    connection? Otherwise, it uses a native INTERVAL.
+    """
+    return connection.vendor != 'postgresql'
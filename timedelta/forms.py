@@ -5,8 +5,8 @@ from django.utils import six
 import datetime
 from collections import defaultdict
 
-from .widgets import TimedeltaWidget
-from .helpers import parse
+from .widgets import TimedeltaWidget, microseconds_or_none
+from .cache import parse
 
 class TimedeltaFormField(forms.Field):
     
@@ -19,6 +19,35 @@ class TimedeltaFormField(forms.Field):
         defaults.update(kwargs)
         super(TimedeltaFormField, self).__init__(*args, **defaults)
         
+    def has_changed(self, initial, data):
+        """
+        Compare the number of microseconds in initial and data, rather than
+        the values themselves, which may be strings in different formats.
+        
+        >>> t = TimedeltaFormField()
+        >>> t.has_changed(datetime.timedelta(0, 90), '1 minute, 30 seconds')
+        False
+        >>> t.has_changed(datetime.timedelta(0, 90), '1:30:00')
+        True
+        >>> t.has_changed(None, '')
+        False
+        >>> t.has_changed(None, 'foo')
+        True
+        """
+        try:
+            data = microseconds_or_none(data)
+        except TypeError:
+            return True
+        try:
+            initial = microseconds_or_none(initial)
+        except TypeError:
+            pass
+        return initial != data
+    
+    # Django < 1.8 calls this _has_changed (and Django < 1.6 asks the
+    # widget instead).
+    _has_changed = has_changed
+        
     def clean(self, value):
         """
         This doesn't really need to be here: it should be tested in
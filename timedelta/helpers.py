@@ -2,13 +2,64 @@ from __future__ import division
 
 import re
 import datetime
-from decimal import Decimal
+from array import array
+from decimal import (
+    Decimal, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_DOWN,
+    ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_UP, getcontext,
+)
 
 from django.utils import six
 
-STRFDATETIME = re.compile('([dgGhHis])')
+from . import instrumentation
+
+
+class _LazyPattern(object):
+    r"""
+    A regular expression that is compiled the first time it is used,
+    rather than when this module is imported. After that, its methods are
+    those of the compiled pattern, so it costs nothing more to use.
+
+    >>> pattern = _LazyPattern(r'(\d+)')
+    >>> pattern.findall('1 day, 2 hours')
+    ['1', '2']
+    """
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __getattr__(self, name):
+        compiled = re.compile(self.pattern, self.flags)
+        for method in ('match', 'search', 'findall', 'finditer', 'sub', 'split'):
+            setattr(self, method, getattr(compiled, method))
+        return getattr(compiled, name)
+
+
+STRFDATETIME = _LazyPattern('([dgGhHis])')
 STRFDATETIME_REPL = lambda x: '%%(%s)s' % x.group()
 
+# The array typecode for a signed 64 bit integer: python 2 does not have 'q'.
+try:
+    array('q')
+    MICROSECONDS_TYPECODE = 'q'
+except ValueError:
+    MICROSECONDS_TYPECODE = 'l'
+
+_UNSET = object()
+_numpy_module = _UNSET
+
+def _numpy():
+    """
+    Import numpy on first use, as it is optional, and slow to import.
+    Returns None if it is not installed.
+    """
+    global _numpy_module
+    if _numpy_module is _UNSET:
+        try:
+            import numpy as _numpy_module
+        except ImportError:
+            _numpy_module = None
+    return _numpy_module
+
 def nice_repr(timedelta, display="long", sep=", "):
     """
     Turns a datetime.timedelta object into a nice string repr.
@@ -56,30 +107,96 @@ def nice_repr(timedelta, display="long", sep=", "):
     '0 seconds'
     """
 
+    if instrumentation.enabled:
+        return instrumentation.call('nice_repr', _nice_repr, timedelta, display, sep)
+    return _nice_repr(timedelta, display, sep)
+
+def _nice_repr(timedelta, display, sep):
     assert isinstance(timedelta, datetime.timedelta), "First argument must be a timedelta."
 
-    result = []
-
-    weeks = int(timedelta.days / 7)
-    days = timedelta.days % 7
-    hours = int(timedelta.seconds / 3600)
-    minutes = int((timedelta.seconds % 3600) / 60)
-    seconds = timedelta.seconds % 60
-
-    if display == "sql":
-        days += weeks * 7
-        return "%i %02i:%02i:%02i" % (days, hours, minutes, seconds)
-    elif display == 'minimal':
-        words = ["w", "d", "h", "m", "s"]
-    elif display == 'short':
-        words = [" wks", " days", " hrs", " min", " sec"]
-    elif display == 'long':
-        words = [" weeks", " days", " hours", " minutes", " seconds"]
-    else:
-        # Use django template-style formatting.
-        # Valid values are:
-        # d,g,G,h,H,i,s
-        return STRFDATETIME.sub(STRFDATETIME_REPL, display) % {
+    try:
+        formatter = _nice_repr_formats[display, sep]
+    except KeyError:
+        formatter = nice_repr_format(display, sep)
+    return formatter.format(timedelta)
+
+
+NICE_REPR_WORDS = {
+    'minimal': ("w", "d", "h", "m", "s"),
+    'short': (" wks", " days", " hrs", " min", " sec"),
+    'long': (" weeks", " days", " hours", " minutes", " seconds"),
+}
+
+class NiceReprFormat(object):
+    """
+    A nice_repr() display format, worked out once so that it can be used to
+    format any number of timedeltas.
+
+    >>> NiceReprFormat('short', ' ').format(datetime.timedelta(days=8, seconds=61))
+    '1 wk 1 day 1 min 1 sec'
+    >>> NiceReprFormat('H:i').format(datetime.timedelta(seconds=3900))
+    '01:05'
+    """
+    __slots__ = ('display', 'sep', 'units', 'zero', 'template')
+
+    def __init__(self, display="long", sep=", "):
+        self.display = display
+        self.sep = sep
+        self.units = self.zero = self.template = None
+        if display in NICE_REPR_WORDS:
+            words = NICE_REPR_WORDS[display]
+            self.units = tuple(
+                (word, word.rstrip('s') if len(word) > 1 else word)
+                for word in words
+            )
+            # values with less than one second, which are considered zeroes,
+            # are displayed as 0 of the smallest unit
+            self.zero = '0%s' % words[-1]
+        elif display != "sql":
+            # Use django template-style formatting.
+            # Valid values are:
+            # d,g,G,h,H,i,s
+            self.template = STRFDATETIME.sub(STRFDATETIME_REPL, display)
+
+    def format(self, timedelta):
+        days = timedelta.days
+        weeks = int(days / 7)
+        days = days % 7
+        seconds = timedelta.seconds
+        hours = seconds // 3600
+        minutes = seconds % 3600 // 60
+        seconds = seconds % 60
+        return self.format_parts(weeks, days, hours, minutes, seconds)
+
+    def format_parts(self, weeks, days, hours, minutes, seconds):
+        """
+        Format a timedelta that has already been split into weeks, days (of
+        the week), hours, minutes and seconds.
+        """
+        units = self.units
+        if units is not None:
+            # Each unit is (plural, singular), so indexing on value == 1
+            # picks the right word.
+            result = []
+            if weeks:
+                result.append("%i%s" % (weeks, units[0][weeks == 1]))
+            if days:
+                result.append("%i%s" % (days, units[1][days == 1]))
+            if hours:
+                result.append("%i%s" % (hours, units[2][hours == 1]))
+            if minutes:
+                result.append("%i%s" % (minutes, units[3][minutes == 1]))
+            if seconds:
+                result.append("%i%s" % (seconds, units[4][seconds == 1]))
+            if not result:
+                return self.zero
+            return self.sep.join(result)
+
+        if self.template is None:
+            days += weeks * 7
+            return "%i %02i:%02i:%02i" % (days, hours, minutes, seconds)
+
+        return self.template % {
             'd': days,
             'g': hours,
             'G': hours if hours > 9 else '0%s' % hours,
@@ -89,21 +206,26 @@ def nice_repr(timedelta, display="long", sep=", "):
             's': seconds if seconds > 9 else '0%s' % seconds
         }
 
-    values = [weeks, days, hours, minutes, seconds]
-
-    for i in range(len(values)):
-        if values[i]:
-            if values[i] == 1 and len(words[i]) > 1:
-                result.append("%i%s" % (values[i], words[i].rstrip('s')))
-            else:
-                result.append("%i%s" % (values[i], words[i]))
 
-    # values with less than one second, which are considered zeroes
-    if len(result) == 0:
-        # display as 0 of the smallest unit
-        result.append('0%s' % (words[-1]))
+NICE_REPR_FORMAT_CACHE_SIZE = 256
+_nice_repr_formats = {}
 
-    return sep.join(result)
+def nice_repr_format(display="long", sep=", "):
+    """
+    Return the NiceReprFormat for display and sep, which is kept for the
+    next call. At most NICE_REPR_FORMAT_CACHE_SIZE formats are kept: after
+    that, they are all forgotten and worked out again as they are needed.
+    """
+    key = (display, sep)
+    try:
+        return _nice_repr_formats[key]
+    except KeyError:
+        pass
+    formatter = NiceReprFormat(display, sep)
+    if len(_nice_repr_formats) >= NICE_REPR_FORMAT_CACHE_SIZE:
+        _nice_repr_formats.clear()
+    _nice_repr_formats[key] = formatter
+    return formatter
 
 
 def iso8601_repr(timedelta, format=None):
@@ -111,50 +233,169 @@ def iso8601_repr(timedelta, format=None):
     Represent a timedelta as an ISO8601 duration.
     http://en.wikipedia.org/wiki/ISO_8601#Durations
 
+    A year is taken to be 365 days, fractions of a second are kept, and
+    negative durations have a leading '-'. parse_iso8601() reads these back.
+
     >>> from datetime import timedelta as td
     >>> iso8601_repr(td(days=1, hours=2, minutes=3, seconds=4))
     'P1DT2H3M4S'
+    >>> iso8601_repr(td(days=379, microseconds=250000))
+    'P1Y2WT0.25S'
+    >>> iso8601_repr(-td(minutes=90))
+    '-PT1H30M'
+    >>> iso8601_repr(td(0))
+    'PT0S'
 
     >>> iso8601_repr(td(hours=1, minutes=10, seconds=20), 'alt')
     'PT01:10:20'
     """
-    years = int(timedelta.days / 365)
-    weeks = int((timedelta.days % 365) / 7)
-    days = timedelta.days % 7
+    negative = timedelta.days < 0
+    if negative:
+        timedelta = -timedelta
+    return _iso8601_format(negative, timedelta.days, timedelta.seconds, timedelta.microseconds, format)
+
+def _iso8601_format(negative, days, seconds, microseconds, format=None):
+    """
+    Format the (positive) parts of a timedelta as an ISO8601 duration.
+    """
+    years = days // 365
+    weeks = days % 365 // 7
+    days = days % 365 % 7
 
-    hours = int(timedelta.seconds / 3600)
-    minutes = int((timedelta.seconds % 3600) / 60)
-    seconds = timedelta.seconds % 60
+    hours = seconds // 3600
+    minutes = seconds % 3600 // 60
+    seconds = seconds % 60
+
+    result = ['-P' if negative else 'P']
 
     if format == 'alt':
         if years or weeks or days:
             raise ValueError('Does not support alt format for durations > 1 day')
-        return 'PT{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
-
-    formatting = (
-        ('P', (
-            ('Y', years),
-            ('W', weeks),
-            ('D', days),
-        )),
-        ('T', (
-            ('H', hours),
-            ('M', minutes),
-            ('S', seconds),
-        )),
-      )
-
-    result = []
-    for category, subcats in formatting:
-        result += category
-        for format, value in subcats:
-            if value:
-                result.append('%d%c' % (value, format))
-    if result[-1] == 'T':
-        result = result[:-1]
+        result.append('T{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds))
+        if microseconds:
+            result.append(('.%06d' % microseconds).rstrip('0'))
+        return ''.join(result)
+
+    if years:
+        result.append('%dY' % years)
+    if weeks:
+        result.append('%dW' % weeks)
+    if days:
+        result.append('%dD' % days)
+    if hours or minutes or seconds or microseconds or len(result) == 1:
+        result.append('T')
+        if hours:
+            result.append('%dH' % hours)
+        if minutes:
+            result.append('%dM' % minutes)
+        if microseconds:
+            result.append(('%d.%06d' % (seconds, microseconds)).rstrip('0') + 'S')
+        elif seconds or len(result) == 2:
+            result.append('%dS' % seconds)
 
     return "".join(result)
 
+
+def _days_and_seconds_many(values):
+    """
+    Split each of values (timedeltas, or an array of microseconds) into
+    whole days, and the seconds within the day: numpy arrays of each if
+    values is an array and numpy is installed, otherwise lists.
+    """
+    numpy = _numpy()
+    if numpy is not None:
+        if isinstance(values, array):
+            values = numpy.frombuffer(values, dtype='i%i' % values.itemsize)
+        if isinstance(values, numpy.ndarray):
+            if values.dtype.kind == 'm':
+                values = values.astype('timedelta64[us]').view(numpy.int64)
+            return values // 86400000000, values % 86400000000 // 1000000
+
+    if isinstance(values, array):
+        days = [value // 86400000000 for value in values]
+        seconds = [value % 86400000000 // 1000000 for value in values]
+        return days, seconds
+
+    return [value.days for value in values], [value.seconds for value in values]
+
+
+def _store_many(strings, out):
+    if out is None:
+        return strings
+    out[:len(strings)] = strings
+    return out
+
+
+def nice_repr_many(values, display="long", sep=", ", out=None):
+    """
+    nice_repr() every item of values: a sequence of timedeltas, or an array
+    of microseconds (an array.array, or a numpy integer or timedelta64
+    array). Arrays are split into weeks, days, hours, minutes and seconds
+    in one go if numpy is installed.
+
+    Returns a list of strings, or if out is given (a list, or a numpy
+    array, at least as long as values), fills that in and returns it.
+
+    >>> nice_repr_many([datetime.timedelta(1), datetime.timedelta(seconds=90)])
+    ['1 day', '1 minute, 30 seconds']
+    >>> nice_repr_many(array('q', [3600000000, 0]), 'minimal')
+    ['1h', '0s']
+    """
+    days, seconds = _days_and_seconds_many(values)
+    format_parts = nice_repr_format(display, sep).format_parts
+
+    if isinstance(days, list):
+        strings = [
+            format_parts(int(day / 7), day % 7, second // 3600, second % 3600 // 60, second % 60)
+            for day, second in zip(days, seconds)
+        ]
+    else:
+        numpy = _numpy()
+        weeks = numpy.where(days < 0, -(-days // 7), days // 7)
+        strings = [
+            format_parts(*parts) for parts in zip(
+                weeks.tolist(), (days % 7).tolist(),
+                (seconds // 3600).tolist(), (seconds % 3600 // 60).tolist(), (seconds % 60).tolist(),
+            )
+        ]
+    return _store_many(strings, out)
+
+
+def iso8601_repr_many(values, format=None, out=None):
+    """
+    iso8601_repr() every item of values, which may be a sequence of
+    timedeltas or an array of microseconds, as for nice_repr_many().
+
+    >>> iso8601_repr_many(array('q', [93784000000, -1500000, 0]))
+    ['P1DT2H3M4S', '-PT1.5S', 'PT0S']
+    """
+    numpy = _numpy()
+    if numpy is not None and isinstance(values, (array, numpy.ndarray)):
+        if isinstance(values, array):
+            values = numpy.frombuffer(values, dtype='i%i' % values.itemsize)
+        elif values.dtype.kind == 'm':
+            values = values.astype('timedelta64[us]').view(numpy.int64)
+        magnitudes = numpy.abs(values)
+        strings = [
+            _iso8601_format(negative, days, seconds, microseconds, format)
+            for negative, days, seconds, microseconds in zip(
+                (values < 0).tolist(),
+                (magnitudes // 86400000000).tolist(),
+                (magnitudes % 86400000000 // 1000000).tolist(),
+                (magnitudes % 1000000).tolist(),
+            )
+        ]
+        return _store_many(strings, out)
+
+    if not isinstance(values, array):
+        values = [total_microseconds(value) for value in values]
+    strings = []
+    for value in values:
+        days, microseconds = divmod(abs(value), 86400000000)
+        seconds, microseconds = divmod(microseconds, 1000000)
+        strings.append(_iso8601_format(value < 0, days, seconds, microseconds, format))
+    return _store_many(strings, out)
+
 def parse(string):
     """
     Parse a string into a timedelta object.
@@ -268,42 +509,485 @@ def parse(string):
     >>> parse('  50 days 00:00:00   ')
     datetime.timedelta(50)
     """
+    if instrumentation.enabled:
+        return instrumentation.parse(_parse, string)
+    return _parse(string)
+
+def _parse(string):
     string = string.strip()
+    if not isinstance(string, six.text_type):
+        string = six.text_type(string)
 
-    if string == "":
+    microseconds = _parse_microseconds(string)
+    if microseconds is None:
         raise TypeError("'%s' is not a valid time interval" % string)
-    # This is the format we get from sometimes Postgres, sqlite,
-    # and from serialization
-    d = re.match(r'^((?P<days>[-+]?\d+) days?,? )?(?P<sign>[-+]?)(?P<hours>\d+):'
-                 r'(?P<minutes>\d+)(:(?P<seconds>\d+(\.\d+)?))?$',
-                 six.text_type(string))
-    if d:
-        d = d.groupdict(0)
-        if d['sign'] == '-':
-            for k in 'hours', 'minutes', 'seconds':
-                d[k] = '-' + d[k]
-        d.pop('sign', None)
+    return datetime.timedelta(0, 0, microseconds)
+
+
+# Number of microseconds in each unit the parser understands.
+MICROSECONDS = {
+    'weeks': 604800000000,
+    'days': 86400000000,
+    'hours': 3600000000,
+    'minutes': 60000000,
+    'seconds': 1000000,
+}
+
+# This is the format we get from sometimes Postgres, sqlite,
+# and from serialization
+COLON_FORMAT = _LazyPattern(
+    r'^(?:([-+]?\d+) days?,? )?([-+]?)(\d+):(\d+)(?::(\d+)(?:\.(\d+))?)?$'
+)
+
+# This is the more flexible format: "[X weeks,] [Y days,] [Z hours,]
+# [A minutes,] [B seconds]". Rather than one regex with five optional
+# groups, it is scanned as a sequence of (number, unit) tokens: anything
+# that is not part of a token is captured by the last group, and makes the
+# string invalid.
+FLEXIBLE_TOKEN = _LazyPattern(
+    r'(-?(?:\d*\.\d+|\d+))\W*([a-z]+)\W*|(.)',
+    re.DOTALL
+)
+
+# Every spelling of each unit, and the number of microseconds it stands
+# for. Units must appear from largest to smallest, and at most once each.
+FLEXIBLE_UNITS = {}
+for _unit, _spellings in (
+    ('weeks', ('w', 'wk', 'wks', 'wee', 'week', 'weeks')),
+    ('days', ('d', 'day', 'days')),
+    ('hours', ('h', 'hr', 'hrs', 'hou', 'hour', 'hours')),
+    ('minutes', ('m', 'min', 'mins', 'minute', 'minutes')),
+    ('seconds', ('s', 'sec', 'secs', 'second', 'seconds')),
+):
+    for _spelling in _spellings:
+        FLEXIBLE_UNITS[_spelling] = MICROSECONDS[_unit]
+del _unit, _spellings, _spelling
+
+NON_WORD = _LazyPattern(r'\W*$')
+
+# A duration such as P1Y2W3DT4H5M6.5S, optionally with a sign. Any of the
+# numbers may have a fraction (after a '.' or ','). Months are not accepted,
+# as they have no fixed length: a year is taken to be 365 days.
+ISO8601_FORMAT = _LazyPattern(
+    r'^([-+]?)P(?:(\d+(?:[.,]\d+)?)Y)?(?:(\d+(?:[.,]\d+)?)W)?(?:(\d+(?:[.,]\d+)?)D)?'
+    r'(?:T(?=\d)(?:(\d+(?:[.,]\d+)?)H)?(?:(\d+(?:[.,]\d+)?)M)?(?:(\d+(?:[.,]\d+)?)S)?)?$'
+)
+# The 'alt' format, PThh:mm:ss.
+ISO8601_ALT_FORMAT = _LazyPattern(r'^([-+]?)PT(\d\d):(\d\d):(\d\d)(?:[.,](\d+))?$')
+
+
+def _iso8601_microseconds(string):
+    """
+    Return the number of microseconds in an ISO8601 duration, or None if
+    the (stripped) string is not one.
+
+    >>> _iso8601_microseconds('P1DT2H3M4.5S')
+    93784500000
+    >>> _iso8601_microseconds('-PT00:01:30')
+    -90000000
+    >>> _iso8601_microseconds('P1M') is None
+    True
+    """
+    match = ISO8601_FORMAT.match(string)
+    if match is not None:
+        sign, years, weeks, days, hours, minutes, seconds = match.groups()
+        microseconds = 0
+        # Whole numbers are by far the most common, so they are handled
+        # here rather than with a call to _iso8601_number().
+        if years is not None:
+            microseconds += int(years) * 31536000000000 if years.isdigit() else _iso8601_number(years, 31536000000000)
+        if weeks is not None:
+            microseconds += int(weeks) * 604800000000 if weeks.isdigit() else _iso8601_number(weeks, 604800000000)
+        if days is not None:
+            microseconds += int(days) * 86400000000 if days.isdigit() else _iso8601_number(days, 86400000000)
+        if hours is not None:
+            microseconds += int(hours) * 3600000000 if hours.isdigit() else _iso8601_number(hours, 3600000000)
+        if minutes is not None:
+            microseconds += int(minutes) * 60000000 if minutes.isdigit() else _iso8601_number(minutes, 60000000)
+        if seconds is not None:
+            microseconds += int(seconds) * 1000000 if seconds.isdigit() else _iso8601_number(seconds, 1000000)
     else:
-        # This is the more flexible format
-        d = re.match(
-                     r'^((?P<weeks>-?((\d*\.\d+)|\d+))\W*w((ee)?(k(s)?)?)(,)?\W*)?'
-                     r'((?P<days>-?((\d*\.\d+)|\d+))\W*d(ay(s)?)?(,)?\W*)?'
-                     r'((?P<hours>-?((\d*\.\d+)|\d+))\W*h(ou)?(r(s)?)?(,)?\W*)?'
-                     r'((?P<minutes>-?((\d*\.\d+)|\d+))\W*m(in(ute)?(s)?)?(,)?\W*)?'
-                     r'((?P<seconds>-?((\d*\.\d+)|\d+))\W*s(ec(ond)?(s)?)?)?\W*$',
-                     six.text_type(string))
-        if not d:
-            raise TypeError("'%s' is not a valid time interval" % string)
-        d = d.groupdict(0)
+        match = ISO8601_ALT_FORMAT.match(string)
+        if match is None:
+            return None
+        sign, hours, minutes, seconds, fraction = match.groups()
+        microseconds = ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000000
+        if fraction:
+            microseconds += _fraction_microseconds(fraction)
+    if sign == '-':
+        return -microseconds
+    return microseconds
+
+
+def _iso8601_number(value, unit):
+    """
+    Convert a number with a fraction (after a '.' or ','), in units of unit
+    microseconds, into a whole number of microseconds.
+    """
+    whole, _, fraction = value.replace(',', '.').partition('.')
+    if unit == 1000000:
+        return int(whole) * 1000000 + _fraction_microseconds(fraction)
+    return int(whole) * unit + _round_half_even(int(fraction) * unit, 10 ** len(fraction))
+
+
+def parse_iso8601(string):
+    """
+    Parse an ISO8601 duration, such as those from iso8601_repr(), into a
+    timedelta. parse() accepts these too, but this skips the other grammars.
+
+    >>> parse_iso8601('P1W2DT3.25S')
+    datetime.timedelta(9, 3, 250000)
+    >>> parse_iso8601('1 day')
+    Traceback (most recent call last):
+    ...
+    TypeError: '1 day' is not a valid ISO8601 duration
+    """
+    microseconds = _iso8601_microseconds(string.strip())
+    if microseconds is None:
+        raise TypeError("'%s' is not a valid ISO8601 duration" % string)
+    return datetime.timedelta(0, 0, microseconds)
+
+
+def _parse_microseconds(string):
+    """
+    Scan an already stripped string, and return the number of microseconds
+    it refers to, or None if it is not a valid time interval.
+
+    Only one of the two grammars is tried for any string that does not
+    contain a colon, and all of the arithmetic is done on integers: only
+    fractional components need rounding to the nearest microsecond.
+
+    >>> _parse_microseconds("1 day, 8:42:42.342")
+    117762342000
+    >>> _parse_microseconds("-1 day, -1:01:01")
+    -90061000000
+    >>> _parse_microseconds("2.5 minutes")
+    150000000
+    >>> _parse_microseconds("0.0000005 seconds")
+    0
+    >>> _parse_microseconds("0.0000015 seconds")
+    2
+    >>> _parse_microseconds("foo") is None
+    True
+    """
+    if not string:
+        return None
+
+    if string[0] == 'P' or string[1:2] == 'P':
+        return _iso8601_microseconds(string)
+
+    if ':' in string:
+        match = COLON_FORMAT.match(string)
+        if match is not None:
+            days, sign, hours, minutes, seconds, fraction = match.groups()
+            microseconds = (int(hours) * 3600 + int(minutes) * 60) * 1000000
+            if seconds:
+                microseconds += int(seconds) * 1000000
+                if fraction:
+                    microseconds += _fraction_microseconds(fraction)
+            if sign == '-':
+                microseconds = -microseconds
+            if days:
+                microseconds += int(days) * 86400000000
+            return microseconds
+
+    microseconds = 0
+    previous = None
+    for value, word, junk in FLEXIBLE_TOKEN.findall(string):
+        unit = FLEXIBLE_UNITS.get(word)
+        if unit is None or (previous is not None and unit >= previous):
+            # A string made up only of separators is a zero interval, as
+            # long as it does not also contain any (number, unit) tokens.
+            if junk and previous is None and NON_WORD.match(string):
+                return 0
+            return None
+        previous = unit
+        if '.' in value:
+            microseconds += _decimal_microseconds(value, unit)
+        else:
+            microseconds += int(value) * unit
+    return microseconds
+
+
+def _fraction_microseconds(fraction):
+    """
+    Convert the digits after the decimal point of a number of seconds
+    into microseconds, rounding half to even.
+
+    >>> _fraction_microseconds('342'), _fraction_microseconds('0000005')
+    (342000, 0)
+    """
+    if len(fraction) <= 6:
+        return int(fraction) * 10 ** (6 - len(fraction))
+    return _round_half_even(int(fraction), 10 ** (len(fraction) - 6))
+
+
+def _decimal_microseconds(value, unit):
+    """
+    Convert a decimal string (which may have a leading sign), in units of
+    ``unit`` microseconds, into an integer number of microseconds. Any
+    remainder is rounded half to even, like timedelta does.
+
+    >>> _decimal_microseconds('2.5', 60000000)
+    150000000
+    >>> _decimal_microseconds('-.0000025', 1000000)
+    -2
+    """
+    if '.' not in value:
+        return int(value) * unit
+    whole, _, fraction = value.partition('.')
+    return _round_half_even(int(whole + fraction) * unit, 10 ** len(fraction))
+
+
+def _round_half_even(numerator, denominator):
+    """
+    Divide two integers (denominator > 0), rounding half to even.
+
+    >>> _round_half_even(5, 2), _round_half_even(7, 2), _round_half_even(-5, 2)
+    (2, 4, -2)
+    """
+    quotient, remainder = divmod(numerator, denominator)
+    remainder *= 2
+    if remainder > denominator or (remainder == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+PARSE_MANY_MEMO_SIZE = 4096
+
+def parse_many(strings, use_numpy=None):
+    """
+    Parse many strings at once, returning a tuple of (values, errors).
+
+    values is an array of the number of microseconds each string refers to:
+    a numpy timedelta64[us] array if numpy is installed (unless use_numpy is
+    False), otherwise an array.array of 64 bit integers. errors is a list of
+    the indexes of the strings that were not valid time intervals, or that
+    are too long to fit in 64 bits: rather than raising a TypeError (or an
+    OverflowError), these have a value of 0.
+
+    timedelta objects are accepted too, and converted to microseconds like
+    the strings.
+
+    >>> values, errors = parse_many(["1 hour", "foo", "1 day, 0:00:01", "", "99999999999 weeks"], use_numpy=False)
+    >>> values.tolist()
+    [3600000000, 0, 86401000000, 0, 0]
+    >>> errors
+    [1, 3, 4]
+    """
+    values = array(MICROSECONDS_TYPECODE)
+    errors = []
+    append = values.append
+    scan = _parse_microseconds
+    # Columns tend to repeat the same few strings: remember them, up to a
+    # point, for the length of this call.
+    seen = {}
+
+    for index, string in enumerate(strings):
+        if isinstance(string, six.string_types):
+            try:
+                microseconds = seen[string]
+            except KeyError:
+                microseconds = scan(six.text_type(string.strip()))
+                if len(seen) < PARSE_MANY_MEMO_SIZE:
+                    seen[string] = microseconds
+        elif isinstance(string, datetime.timedelta):
+            microseconds = total_microseconds(string)
+        else:
+            microseconds = None
+        if microseconds is not None:
+            try:
+                append(microseconds)
+                continue
+            except OverflowError:
+                pass
+        errors.append(index)
+        append(0)
+
+    if use_numpy is not False:
+        numpy = _numpy()
+        if numpy is not None:
+            values = numpy.frombuffer(values, dtype=numpy.int64).view('timedelta64[us]')
+        elif use_numpy:
+            raise ImportError('numpy is not installed')
+
+    return values, errors
+
+
+def _ratio(number):
+    """
+    The exact value of an int, float or Decimal, as a tuple of integers
+    (numerator, denominator), with a positive denominator.
+
+    >>> _ratio(3), _ratio(1.5), _ratio(Decimal('-0.25'))
+    ((3, 1), (3, 2), (-1, 4))
+    """
+    if isinstance(number, float):
+        return number.as_integer_ratio()
+    if isinstance(number, six.integer_types):
+        return number, 1
+    try:
+        return number.as_integer_ratio()
+    except AttributeError:
+        # Decimal.as_integer_ratio() is new in python 3.6.
+        pass
+    sign, digits, exponent = number.as_tuple()
+    numerator = int(''.join(map(str, digits)))
+    if sign:
+        numerator = -numerator
+    if exponent >= 0:
+        return numerator * 10 ** exponent, 1
+    return numerator, 10 ** -exponent
+
+
+# The decimal module's rounding modes that _divide_rounded() supports.
+ROUNDING_MODES = frozenset([
+    ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_DOWN, ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_UP,
+])
+
+
+def _check_rounding(rounding):
+    if rounding not in ROUNDING_MODES:
+        raise ValueError('Unsupported rounding mode: %r' % (rounding,))
+
+
+def _divide_rounded(numerator, denominator, rounding=ROUND_HALF_EVEN):
+    """
+    Divide two integers, rounding the result with one of the decimal
+    module's rounding modes (except ROUND_05UP).
+
+    >>> [_divide_rounded(n, 2, ROUND_HALF_EVEN) for n in (-3, -1, 1, 3)]
+    [-2, 0, 0, 2]
+    >>> [_divide_rounded(n, 2, ROUND_HALF_UP) for n in (-3, -1, 1, 3)]
+    [-2, -1, 1, 2]
+    >>> [_divide_rounded(n, -2, ROUND_DOWN) for n in (-3, -1, 1, 3)]
+    [1, 0, 0, -1]
+    >>> _divide_rounded(3, 4, 'ROUND_05UP')
+    Traceback (most recent call last):
+        ...
+    ValueError: Unsupported rounding mode: 'ROUND_05UP'
+
+    An exact quotient needs no rounding, so rounding is only checked when
+    the result is inexact.
+    """
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    quotient, remainder = divmod(numerator, denominator)
+    if not remainder or rounding == ROUND_FLOOR:
+        return quotient
+    if rounding == ROUND_HALF_EVEN:
+        remainder *= 2
+        if remainder > denominator or (remainder == denominator and quotient % 2):
+            return quotient + 1
+        return quotient
+    if rounding == ROUND_CEILING:
+        return quotient + 1
+    if rounding == ROUND_DOWN:
+        return quotient + 1 if quotient < 0 else quotient
+    if rounding == ROUND_UP:
+        return quotient if quotient < 0 else quotient + 1
+    if rounding != ROUND_HALF_UP and rounding != ROUND_HALF_DOWN:
+        _check_rounding(rounding)
+
+    remainder *= 2
+    if remainder != denominator:
+        return quotient + 1 if remainder > denominator else quotient
+    if rounding == ROUND_HALF_UP:
+        return quotient if quotient < 0 else quotient + 1
+    return quotient + 1 if quotient < 0 else quotient
+
+
+def _round_array(quotient, inexact, above_half, half, rounding):
+    """
+    Round the floor quotients of a numpy array division, given where there
+    was a remainder (inexact), and where it was more than (above_half), or
+    exactly (half), half of the divisor.
+    """
+    if rounding == ROUND_FLOOR:
+        return quotient
+    if rounding == ROUND_CEILING:
+        return quotient + inexact
+    if rounding == ROUND_DOWN:
+        return quotient + (inexact & (quotient < 0))
+    if rounding == ROUND_UP:
+        return quotient + (inexact & (quotient >= 0))
+
+    if rounding == ROUND_HALF_EVEN:
+        tie = quotient % 2 == 1
+    elif rounding == ROUND_HALF_UP:
+        tie = quotient >= 0
+    else:
+        tie = quotient < 0
+    return quotient + (above_half | (half & tie))
+
+
+def _divide_rounded_array(numpy, numerators, denominator, rounding=ROUND_HALF_EVEN):
+    """
+    _divide_rounded() for a numpy array of numerators. The callers check
+    rounding, once for the whole array.
+    """
+    if denominator < 0:
+        numerators, denominator = -numerators, -denominator
+    quotient = numpy.floor_divide(numerators, denominator)
+    remainder = numpy.remainder(numerators, denominator)
+    doubled = remainder * 2
+    return _round_array(quotient, remainder != 0, doubled > denominator, doubled == denominator, rounding)
 
-    return datetime.timedelta(**dict(( (k, float(v)) for k,v in d.items())))
 
+INT64_MAX = 2 ** 63 - 1
 
-def divide(obj1, obj2, as_float=False):
+def _scale_many(values, numerator, denominator, rounding):
+    """
+    Multiply each of values (timedeltas, or an array of microseconds) by
+    numerator / denominator, rounding to a whole number of microseconds.
+    """
+    if not denominator:
+        raise ZeroDivisionError('division by zero')
+    _check_rounding(rounding)
+
+    if isinstance(values, array):
+        return array(values.typecode, [
+            _divide_rounded(value * numerator, denominator, rounding) for value in values
+        ])
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        if values.dtype.kind == 'm':
+            values = values.astype('timedelta64[us]').view(numpy.int64)
+            return _scale_many(values, numerator, denominator, rounding).view('timedelta64[us]')
+        values = values.astype(numpy.int64, copy=False)
+        largest = max(-int(values.min()), int(values.max())) if values.size else 0
+        if largest * abs(numerator) <= INT64_MAX:
+            return _divide_rounded_array(numpy, values * numerator, denominator, rounding)
+        # A float's ratio has a large numerator (0.1 is
+        # 3602879701896397 / 2 ** 55), so the products can overflow even
+        # when the results are small enough.
+        divisor = abs(denominator)
+        fits = largest * abs(numerator) // divisor < INT64_MAX and abs(numerator) <= INT64_MAX
+        if fits and (not divisor & (divisor - 1) or divisor < 2 ** 42):
+            from . import _int64
+            return _int64.scale_array(numpy, values, numerator, denominator, rounding)
+        # The results would overflow (or the denominator is too large to
+        # divide by in limbs), so fall back to python integers.
+        result = _divide_rounded_array(numpy, values.astype(object) * numerator, denominator, rounding)
+        return result.astype(numpy.int64)
+
+    return [
+        datetime.timedelta(0, 0, _divide_rounded(total_microseconds(value) * numerator, denominator, rounding))
+        for value in values
+    ]
+
+
+def divide(obj1, obj2, as_float=False, rounding=None):
     """
     Allows for the division of timedeltas by other timedeltas, or by
     floats/Decimals
 
+    Dividing by a number gives a timedelta, rounded to the nearest
+    microsecond (or as given by rounding, one of the decimal module's
+    rounding modes). Dividing by a timedelta gives an integer, truncated
+    towards zero by default, or a float if as_float is True.
+
     >>> from datetime import timedelta as td
     >>> divide(td(1), td(1))
     1
@@ -319,6 +1003,10 @@ def divide(obj1, obj2, as_float=False):
     2.6666666666666665
     >>> divide(datetime.timedelta(8), 2.0)
     datetime.timedelta(4)
+    >>> divide(td(seconds=1, microseconds=500000), td(microseconds=500001))
+    2
+    >>> divide(td(microseconds=5), 2), divide(td(microseconds=5), 2, rounding=ROUND_HALF_UP)
+    (datetime.timedelta(0, 0, 2), datetime.timedelta(0, 0, 3))
     >>> divide(datetime.timedelta(8), 2, as_float=True)
     Traceback (most recent call last):
         ...
@@ -328,20 +1016,66 @@ def divide(obj1, obj2, as_float=False):
     assert isinstance(obj1, datetime.timedelta), "First argument must be a timedelta."
     assert isinstance(obj2, (datetime.timedelta, int, float, Decimal)), "Second argument must be a timedelta or number"
 
-    sec1 = obj1.days * 86400 + obj1.seconds
+    microseconds = (obj1.days * 86400 + obj1.seconds) * 1000000 + obj1.microseconds
     if isinstance(obj2, datetime.timedelta):
-        sec2 = obj2.days * 86400 + obj2.seconds
-        value = sec1 / sec2
+        divisor = (obj2.days * 86400 + obj2.seconds) * 1000000 + obj2.microseconds
         if as_float:
-            return value
-        return int(value)
+            return microseconds / divisor
+        if rounding is None:
+            # Truncate towards zero, like int() does.
+            quotient = microseconds // divisor
+            if quotient < 0 and quotient * divisor != microseconds:
+                quotient += 1
+            return quotient
+        return _divide_rounded(microseconds, divisor, rounding)
     else:
         if as_float:
             assert None, "as_float=True is inappropriate when dividing timedelta by a number."
-        secs = sec1 / obj2
-        if isinstance(secs, Decimal):
-            secs = float(secs)
-        return datetime.timedelta(seconds=secs)
+        numerator, denominator = _ratio(obj2)
+        return datetime.timedelta(0, 0, _divide_rounded(microseconds * denominator, numerator, rounding or ROUND_HALF_EVEN))
+
+def divide_many(values, obj, as_float=False, rounding=None):
+    """
+    divide() every item of values by obj.
+
+    values may be a sequence of timedeltas, in which case a list is
+    returned, or an array of microseconds: an array.array, or a numpy
+    integer or timedelta64 array. Dividing an array by a number gives an
+    array of the same type; dividing by a timedelta gives an array of
+    integers (or of floats, if as_float is True).
+
+    >>> divide_many(array('q', [3, -3, 4]), 2).tolist()
+    [2, -2, 2]
+    >>> divide_many([datetime.timedelta(hours=3)], datetime.timedelta(hours=2), as_float=True)
+    [1.5]
+    """
+    assert isinstance(obj, (datetime.timedelta, int, float, Decimal)), "Second argument must be a timedelta or number"
+
+    if not isinstance(obj, datetime.timedelta):
+        if as_float:
+            assert None, "as_float=True is inappropriate when dividing timedelta by a number."
+        numerator, denominator = _ratio(obj)
+        return _scale_many(values, denominator, numerator, rounding or ROUND_HALF_EVEN)
+
+    divisor = total_microseconds(obj)
+    rounding = rounding or ROUND_DOWN
+    _check_rounding(rounding)
+    if isinstance(values, array):
+        if as_float:
+            return array('d', [value / divisor for value in values])
+        return array(values.typecode, [_divide_rounded(value, divisor, rounding) for value in values])
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        if values.dtype.kind == 'm':
+            values = values.astype('timedelta64[us]').view(numpy.int64)
+        if as_float:
+            return values / divisor
+        if not divisor:
+            raise ZeroDivisionError('division by zero')
+        return _divide_rounded_array(numpy, values, divisor, rounding)
+
+    return [divide(value, obj, as_float, rounding) for value in values]
 
 def modulo(obj1, obj2):
     """
@@ -354,6 +1088,8 @@ def modulo(obj1, obj2):
     datetime.timedelta(0)
     >>> modulo(td(15), 4 * 3600 * 24)
     datetime.timedelta(3)
+    >>> modulo(td(seconds=1, microseconds=5), td(microseconds=7))
+    datetime.timedelta(0, 0, 6)
 
     >>> modulo(5, td(1))
     Traceback (most recent call last):
@@ -367,12 +1103,41 @@ def modulo(obj1, obj2):
     assert isinstance(obj1, datetime.timedelta), "First argument must be a timedelta."
     assert isinstance(obj2, (datetime.timedelta, int)), "Second argument must be a timedelta or int."
 
-    sec1 = obj1.days * 86400 + obj1.seconds
     if isinstance(obj2, datetime.timedelta):
-        sec2 = obj2.days * 86400 + obj2.seconds
-        return datetime.timedelta(seconds=sec1 % sec2)
+        return datetime.timedelta(0, 0, total_microseconds(obj1) % total_microseconds(obj2))
+    else:
+        return datetime.timedelta(0, 0, total_microseconds(obj1) % (obj2 * 1000000))
+
+def modulo_many(values, obj):
+    """
+    modulo() every item of values by obj.
+
+    values may be a sequence of timedeltas, in which case a list is
+    returned, or an array of microseconds: an array.array, or a numpy
+    integer or timedelta64 array, which is returned as the same type.
+
+    >>> modulo_many(array('q', [5, -5]), datetime.timedelta(microseconds=3)).tolist()
+    [2, 1]
+    """
+    assert isinstance(obj, (datetime.timedelta, int)), "Second argument must be a timedelta or int."
+
+    if isinstance(obj, datetime.timedelta):
+        divisor = total_microseconds(obj)
     else:
-        return datetime.timedelta(seconds=(sec1 % obj2))
+        divisor = obj * 1000000
+
+    if isinstance(values, array):
+        return array(values.typecode, [value % divisor for value in values])
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        if values.dtype.kind == 'm':
+            return modulo_many(values.astype('timedelta64[us]').view(numpy.int64), obj).view('timedelta64[us]')
+        if not divisor:
+            raise ZeroDivisionError('integer division or modulo by zero')
+        return values % divisor
+
+    return [datetime.timedelta(0, 0, total_microseconds(value) % divisor) for value in values]
 
 def percentage(obj1, obj2):
     """
@@ -381,11 +1146,13 @@ def percentage(obj1, obj2):
     200.0
     >>> percentage(datetime.timedelta(2), datetime.timedelta(4))
     50.0
+    >>> percentage(datetime.timedelta(microseconds=1), datetime.timedelta(microseconds=4))
+    25.0
     """
     assert isinstance(obj1, datetime.timedelta), "First argument must be a timedelta."
     assert isinstance(obj2, datetime.timedelta), "Second argument must be a timedelta."
 
-    return divide(obj1 * 100, obj2, as_float=True)
+    return total_microseconds(obj1) * 100 / total_microseconds(obj2)
 
 def decimal_percentage(obj1, obj2):
     """
@@ -397,9 +1164,13 @@ def decimal_percentage(obj1, obj2):
     return Decimal(str(percentage(obj1, obj2)))
 
 
-def multiply(obj, val):
+def multiply(obj, val, rounding=ROUND_HALF_EVEN):
     """
     Allows for the multiplication of timedeltas by float values.
+
+    The result is exact, rounded to the nearest microsecond (or as given by
+    rounding, one of the decimal module's rounding modes).
+
     >>> multiply(datetime.timedelta(seconds=20), 1.5)
     datetime.timedelta(0, 30)
     >>> multiply(datetime.timedelta(1), 2.5)
@@ -408,6 +1179,8 @@ def multiply(obj, val):
     datetime.timedelta(3)
     >>> multiply(datetime.timedelta(1), Decimal("5.5"))
     datetime.timedelta(5, 43200)
+    >>> multiply(datetime.timedelta(microseconds=7), Decimal("0.5"), rounding=ROUND_CEILING)
+    datetime.timedelta(0, 0, 4)
     >>> multiply(datetime.date.today(), 2.5)
     Traceback (most recent call last):
         ...
@@ -421,11 +1194,29 @@ def multiply(obj, val):
     assert isinstance(obj, datetime.timedelta), "First argument must be a timedelta."
     assert isinstance(val, (int, float, Decimal)), "Second argument must be a number."
 
-    sec = obj.days * 86400 + obj.seconds
-    sec *= val
-    if isinstance(sec, Decimal):
-        sec = float(sec)
-    return datetime.timedelta(seconds=sec)
+    microseconds = (obj.days * 86400 + obj.seconds) * 1000000 + obj.microseconds
+    if isinstance(val, six.integer_types):
+        return datetime.timedelta(0, 0, microseconds * val)
+    numerator, denominator = _ratio(val)
+    return datetime.timedelta(0, 0, _divide_rounded(microseconds * numerator, denominator, rounding))
+
+def multiply_many(values, val, rounding=ROUND_HALF_EVEN):
+    """
+    multiply() every item of values by val.
+
+    values may be a sequence of timedeltas, in which case a list is
+    returned, or an array of microseconds: an array.array, or a numpy
+    integer or timedelta64 array, which is returned as the same type.
+
+    >>> multiply_many(array('q', [1, 2, 3]), 0.5).tolist()
+    [0, 1, 2]
+    >>> multiply_many([datetime.timedelta(hours=1)], Decimal('1.5'))
+    [datetime.timedelta(0, 5400)]
+    """
+    assert isinstance(val, (int, float, Decimal)), "Second argument must be a number."
+
+    numerator, denominator = _ratio(val)
+    return _scale_many(values, numerator, denominator, rounding)
 
 
 def round_to_nearest(obj, timedelta):
@@ -486,49 +1277,256 @@ def round_to_nearest(obj, timedelta):
     >>> round_to_nearest(datetime.time(0,20), td)
     datetime.time(0, 30)
 
-    TODO: test with tzinfo (non-naive) datetimes/times.
+    Ties round up, and times wrap around midnight:
+
+    >>> round_to_nearest(datetime.timedelta(minutes=45), td)
+    datetime.timedelta(0, 3600)
+    >>> round_to_nearest(datetime.timedelta(minutes=-45), td)
+    datetime.timedelta(-1, 84600)
+    >>> round_to_nearest(datetime.time(23, 50), td)
+    datetime.time(0, 0)
+
+    The time of day of an aware datetime is rounded, and the tzinfo kept.
+    An aware time is rounded to a naive time.
+
+    >>> class UTC(datetime.tzinfo):
+    ...     def utcoffset(self, dt):
+    ...         return datetime.timedelta(0)
+    >>> utc = UTC()
+    >>> rounded = round_to_nearest(datetime.datetime(2010,1,1,9,22, tzinfo=utc), td)
+    >>> rounded.replace(tzinfo=None), rounded.tzinfo is utc
+    (datetime.datetime(2010, 1, 1, 9, 30), True)
+    >>> round_to_nearest(datetime.time(9, 22, tzinfo=utc), td)
+    datetime.time(9, 30)
+
+    >>> round_to_nearest(datetime.timedelta(1), datetime.timedelta(0))
+    Traceback (most recent call last):
+        ...
+    AssertionError: Second argument must be a positive timedelta.
     """
 
     assert isinstance(obj, (datetime.datetime, datetime.timedelta, datetime.time)), "First argument must be datetime, time or timedelta."
     assert isinstance(timedelta, datetime.timedelta), "Second argument must be a timedelta."
 
-    time_only = False
+    step = total_microseconds(timedelta)
+    assert step > 0, "Second argument must be a positive timedelta."
+
     if isinstance(obj, datetime.timedelta):
-        counter = datetime.timedelta(0)
-    elif isinstance(obj, datetime.datetime):
-        counter = datetime.datetime.combine(obj.date(), datetime.time(0, tzinfo=obj.tzinfo))
-    elif isinstance(obj, datetime.time):
-        counter = datetime.datetime.combine(datetime.date.today(), datetime.time(0, tzinfo=obj.tzinfo))
-        obj = datetime.datetime.combine(datetime.date.today(), obj)
-        time_only = True
-
-    diff = abs(obj - counter)
-    while counter < obj:
-        old_diff = diff
-        counter += timedelta
-        diff = abs(obj - counter)
-
-    if counter == obj:
-        result = obj
-    elif diff <= old_diff:
-        result = counter
-    else:
-        result = counter - timedelta
+        return datetime.timedelta(0, 0, _round_microseconds(total_microseconds(obj), step))
 
-    if time_only:
-        return result.time()
-    else:
-        return result
+    # Datetimes and times are rounded from midnight (of the same day).
+    since_midnight = (obj.hour * 3600 + obj.minute * 60 + obj.second) * 1000000 + obj.microsecond
+    offset = _round_microseconds(since_midnight, step) - since_midnight
+
+    if isinstance(obj, datetime.datetime):
+        if not offset:
+            return obj
+        return obj + datetime.timedelta(0, 0, offset)
+
+    since_midnight = (since_midnight + offset) % MICROSECONDS['days']
+    seconds, microseconds = divmod(since_midnight, 1000000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return datetime.time(hours, minutes, seconds, microseconds)
+
+
+def _round_microseconds(value, step):
+    """
+    Round value to the nearest multiple of step (both integers), with
+    ties rounding up.
+    """
+    remainder = value % step
+    if not remainder:
+        return value
+    if remainder * 2 >= step:
+        return value - remainder + step
+    return value - remainder
+
+
+def round_to_nearest_many(objs, timedelta):
+    """
+    Round every item of objs to the nearest whole number of timedeltas.
+
+    objs may be a sequence of anything round_to_nearest() accepts, in which
+    case a list is returned, or an array of microseconds: an array.array,
+    or a numpy integer or timedelta64 array, which are rounded in one go,
+    and returned as the same type.
+
+    >>> round_to_nearest_many([datetime.timedelta(minutes=14), datetime.timedelta(minutes=15)], datetime.timedelta(minutes=30))
+    [datetime.timedelta(0), datetime.timedelta(0, 1800)]
+    >>> round_to_nearest_many(array('q', [-1, 0, 1, 2]), datetime.timedelta(microseconds=2)).tolist()
+    [0, 0, 2, 2]
+    """
+    assert isinstance(timedelta, datetime.timedelta), "Second argument must be a timedelta."
+    step = total_microseconds(timedelta)
+    assert step > 0, "Second argument must be a positive timedelta."
+
+    if isinstance(objs, array):
+        return array(objs.typecode, [_round_microseconds(value, step) for value in objs])
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(objs, numpy.ndarray):
+        if objs.dtype.kind == 'm':
+            return round_to_nearest_many(objs.astype('timedelta64[us]').view(numpy.int64), timedelta).view('timedelta64[us]')
+        remainder = objs % step
+        return objs - remainder + numpy.where(remainder * 2 >= step, step, 0)
+
+    return [round_to_nearest(obj, timedelta) for obj in objs]
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def time_bucket(obj, width):
+    """
+    Return the start of the bucket, width wide, that obj falls into.
+
+    Buckets are counted from the unix epoch: midnight on 1 January 1970, in
+    UTC for aware datetimes, or in the same (unknown) timezone for naive
+    ones. This is how timedelta.expressions.TimeBucket() groups rows in the
+    database. obj may also be a timedelta, in which case the buckets are
+    counted from zero.
+
+    >>> time_bucket(datetime.datetime(2012, 1, 1, 9, 43), datetime.timedelta(minutes=15))
+    datetime.datetime(2012, 1, 1, 9, 30)
+    >>> time_bucket(datetime.datetime(2012, 1, 1, 9, 43), datetime.timedelta(hours=6))
+    datetime.datetime(2012, 1, 1, 6, 0)
+    >>> time_bucket(datetime.timedelta(minutes=-1), datetime.timedelta(hours=1))
+    datetime.timedelta(-1, 82800)
+    """
+    assert isinstance(obj, (datetime.datetime, datetime.timedelta)), "First argument must be a datetime or timedelta."
+    assert isinstance(width, datetime.timedelta), "Second argument must be a timedelta."
+
+    step = total_microseconds(width)
+    assert step > 0, "Second argument must be a positive timedelta."
+
+    if isinstance(obj, datetime.timedelta):
+        value = total_microseconds(obj)
+        return datetime.timedelta(0, 0, value - value % step)
+
+    remainder = _epoch_microseconds(obj) % step
+    if not remainder:
+        return obj
+    return obj - datetime.timedelta(0, 0, remainder)
+
+
+def _epoch_microseconds(obj):
+    """
+    The number of microseconds from the epoch to a datetime.
+    """
+    value = total_microseconds(obj.replace(tzinfo=None) - EPOCH)
+    offset = obj.utcoffset()
+    if offset:
+        value -= total_microseconds(offset)
+    return value
+
+
+def time_bucket_many(objs, width):
+    """
+    Return the start of the bucket, width wide, that each item of objs
+    falls into: see time_bucket().
+
+    objs may be a sequence of datetimes or timedeltas, in which case a list
+    is returned, or a numpy datetime64 or timedelta64 array, which is
+    bucketed in one go.
+
+    >>> time_bucket_many([datetime.datetime(2012, 1, 1, 9, 43), datetime.datetime(2012, 1, 1, 9, 44, 59)], datetime.timedelta(minutes=5))
+    [datetime.datetime(2012, 1, 1, 9, 40), datetime.datetime(2012, 1, 1, 9, 40)]
+    """
+    assert isinstance(width, datetime.timedelta), "Second argument must be a timedelta."
+    step = total_microseconds(width)
+    assert step > 0, "Second argument must be a positive timedelta."
+
+    numpy = _numpy()
+    if numpy is not None and isinstance(objs, numpy.ndarray) and objs.dtype.kind in 'Mm':
+        unit = 'datetime64[us]' if objs.dtype.kind == 'M' else 'timedelta64[us]'
+        values = objs.astype(unit).view(numpy.int64)
+        return (values - values % step).view(unit)
+
+    return [time_bucket(obj, width) for obj in objs]
+
+
+HOUR_MICROSECONDS = 3600000000
+_HOUR_MICROSECONDS = Decimal(HOUR_MICROSECONDS)
+
+# decimal_places -> (10 ** decimal_places, the Decimal string format for
+# that many places, the Decimal to quantize() to)
+_decimal_hours_scales = {}
+
+def _decimal_hours_scale(decimal_places):
+    try:
+        return _decimal_hours_scales[decimal_places]
+    except KeyError:
+        exponent = -decimal_places if decimal_places > 0 else 0
+        scale = (10 ** -exponent, '%%dE%i' % exponent, Decimal(10) ** exponent)
+        _decimal_hours_scales[decimal_places] = scale
+        return scale
+
+def _decimal_hours(microseconds, scale, rounding):
+    """
+    decimal_hours() for a number of microseconds, with the scale for its
+    decimal_places (or None), and the decimal context's rounding mode.
+    """
+    if scale is None:
+        return Decimal(microseconds) / _HOUR_MICROSECONDS
+    multiplier, format, quantizer = scale
+    if rounding != ROUND_HALF_EVEN:
+        return (Decimal(microseconds) / _HOUR_MICROSECONDS).quantize(quantizer)
+    quotient, remainder = divmod(microseconds * multiplier, HOUR_MICROSECONDS)
+    remainder *= 2
+    if remainder > HOUR_MICROSECONDS or (remainder == HOUR_MICROSECONDS and quotient & 1):
+        quotient += 1
+    if not quotient and microseconds < 0:
+        # Like quantize(), keep the sign of a negative value that rounds to zero.
+        return Decimal('-' + format % 0)
+    return Decimal(format % quotient)
 
 def decimal_hours(timedelta, decimal_places=None):
     """
     Return a decimal value of the number of hours that this timedelta
-    object refers to.
+    object refers to, rounded to decimal_places if it is given.
+
+    >>> decimal_hours(datetime.timedelta(minutes=90))
+    Decimal('1.5')
+    >>> decimal_hours(datetime.timedelta(minutes=20), 2)
+    Decimal('0.33')
+    >>> decimal_hours(datetime.timedelta(microseconds=-1), 3)
+    Decimal('-0.000')
+    """
+    microseconds = (timedelta.days * 86400 + timedelta.seconds) * 1000000 + timedelta.microseconds
+    if not decimal_places:
+        return Decimal(microseconds) / _HOUR_MICROSECONDS
+    try:
+        scale = _decimal_hours_scales[decimal_places]
+    except KeyError:
+        scale = _decimal_hours_scale(decimal_places)
+    return _decimal_hours(microseconds, scale, getcontext().rounding)
+
+def decimal_hours_many(values, decimal_places=None):
+    """
+    decimal_hours() for every item of values, which may be a sequence of
+    timedeltas, or an array of microseconds: an array.array, or a numpy
+    integer or timedelta64 array. Returns a list of Decimals.
+
+    >>> decimal_hours_many([datetime.timedelta(hours=1), datetime.timedelta(minutes=45)], 1)
+    [Decimal('1.0'), Decimal('0.8')]
+    >>> decimal_hours_many(array('q', [5400000000]))
+    [Decimal('1.5')]
     """
-    hours = Decimal(timedelta.days*24) + Decimal(timedelta.seconds) / 3600
-    if decimal_places:
-        return hours.quantize(Decimal(str(10**-decimal_places)))
-    return hours
+    numpy = _numpy()
+    if isinstance(values, array):
+        microseconds = values
+    elif numpy is not None and isinstance(values, numpy.ndarray):
+        if values.dtype.kind == 'm':
+            values = values.astype('timedelta64[us]').view(numpy.int64)
+        microseconds = values.tolist()
+    else:
+        microseconds = [
+            (value.days * 86400 + value.seconds) * 1000000 + value.microseconds
+            for value in values
+        ]
+    scale = _decimal_hours_scale(decimal_places) if decimal_places else None
+    rounding = getcontext().rounding
+    return [_decimal_hours(value, scale, rounding) for value in microseconds]
 
 def week_containing(date):
     if date.weekday():
@@ -536,6 +1534,15 @@ def week_containing(date):
 
     return date, date + datetime.timedelta(6)
 
+def total_microseconds(timedelta):
+    """
+    The (integer) number of microseconds in a timedelta.
+
+    >>> total_microseconds(datetime.timedelta(-1, 1, 1))
+    -86398999999
+    """
+    return (timedelta.days * 86400 + timedelta.seconds) * 1000000 + timedelta.microseconds
+
 try:
     datetime.timedelta().total_seconds
     def total_seconds(timedelta):
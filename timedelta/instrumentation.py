@@ -0,0 +1,217 @@
+"""
+Opt-in counters and timers for the places that parse and format
+timedeltas, to see how much of a request they take.
+
+Nothing is recorded until instrumentation is enabled, either by calling
+enable(), or by adding the middleware to your settings:
+
+    MIDDLEWARE_CLASSES = [
+        ...
+        'timedelta.instrumentation.InstrumentationMiddleware',
+    ]
+
+The middleware starts each request with empty stats, and when it is done
+sends the request_stats signal, and logs the totals to the
+'timedelta.instrumentation' logger at DEBUG level.
+
+Stats are kept per thread: get_stats() returns the current thread's. They
+record, for each of:
+
+    parse                        helpers.parse()
+    nice_repr                    helpers.nice_repr()
+    to_python, get_prep_value    TimedeltaField's
+    filter:<name>                the timedelta, iso8601 and decimal_hours filters
+
+the number of calls, the number of those that raised an exception, and
+the time they took (including any of the others that they call: to_python
+usually calls parse). They also count which grammar each string given to
+parse() was read with ('colon', 'flexible' or 'iso8601'), and the hits
+and misses of the parse and nice_repr caches (see timedelta.cache).
+
+When instrumentation is disabled, each of those functions costs only one
+more attribute lookup.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.dispatch import Signal
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+# Sent by InstrumentationMiddleware at the end of each request.
+request_stats = Signal(providing_args=['request', 'stats'])
+
+enabled = False
+
+
+def enable():
+    """
+    Start recording stats.
+    """
+    global enabled
+    enabled = True
+
+
+def disable():
+    """
+    Stop recording stats: those already recorded are kept.
+    """
+    global enabled
+    enabled = False
+
+
+class Stats(object):
+    """
+    The counters and timers for one thread.
+
+    >>> stats = Stats()
+    >>> stats.add('parse', 0.5)
+    >>> stats.add('parse', 0.25, failed=True)
+    >>> stats.calls['parse'], stats.failures['parse'], stats.seconds['parse']
+    (2, 1, 0.75)
+    >>> stats
+    <Stats: parse 2 calls, 1 failed, 750000.0 us>
+    """
+    __slots__ = ('calls', 'failures', 'seconds', 'grammars', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.failures = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.grammars = defaultdict(int)
+        self.cache_hits = defaultdict(int)
+        self.cache_misses = defaultdict(int)
+
+    def add(self, name, seconds, failed=False):
+        self.calls[name] += 1
+        self.seconds[name] += seconds
+        if failed:
+            self.failures[name] += 1
+
+    def as_dict(self):
+        """
+        The stats as a dict of plain dicts, suitable for logging or JSON.
+        """
+        return dict((slot, dict(getattr(self, slot))) for slot in self.__slots__)
+
+    def __repr__(self):
+        return '<Stats: %s>' % ('; '.join(
+            '%s %i calls, %i failed, %.1f us' % (
+                name, self.calls[name], self.failures[name], self.seconds[name] * 1e6,
+            )
+            for name in sorted(self.calls)
+        ) or 'empty')
+
+
+_local = threading.local()
+
+
+def get_stats():
+    """
+    Return the Stats for the current thread.
+    """
+    try:
+        return _local.stats
+    except AttributeError:
+        _local.stats = Stats()
+        return _local.stats
+
+
+def reset_stats():
+    """
+    Start the current thread's Stats again from zero, and return it.
+    """
+    stats = get_stats()
+    stats.reset()
+    return stats
+
+
+def call(name, function, *args):
+    """
+    Call function(*args), and record it (and whether it raised) in the
+    current thread's stats under name.
+    """
+    started = timer()
+    try:
+        result = function(*args)
+    except Exception:
+        get_stats().add(name, timer() - started, failed=True)
+        raise
+    get_stats().add(name, timer() - started)
+    return result
+
+
+def grammar(string):
+    """
+    Which of parse()'s grammars a (stripped) string is read with.
+
+    >>> grammar('P1DT2H'), grammar('1 day, 2:00:00'), grammar('1 day, 2 hours')
+    ('iso8601', 'colon', 'flexible')
+    """
+    if string[:1] == 'P' or string[1:2] == 'P':
+        return 'iso8601'
+    if ':' in string:
+        return 'colon'
+    return 'flexible'
+
+
+def parse(function, string):
+    """
+    Record a call to parse() (which is function) in the stats.
+    """
+    try:
+        stripped = string.strip()
+    except AttributeError:
+        stripped = ''
+    get_stats().grammars[grammar(stripped)] += 1
+    return call('parse', function, string)
+
+
+def cache_lookup(name, hit):
+    """
+    Record a hit (or miss) in one of the caches in timedelta.cache.
+    """
+    stats = get_stats()
+    if hit:
+        stats.cache_hits[name] += 1
+    else:
+        stats.cache_misses[name] += 1
+
+
+class InstrumentationMiddleware(MiddlewareMixin):
+    """
+    Enable instrumentation, and record the stats of each request
+    separately: see the module docstring.
+    """
+    def __init__(self, get_response=None):
+        if MiddlewareMixin is object:
+            self.get_response = get_response
+        else:
+            super(InstrumentationMiddleware, self).__init__(get_response)
+        enable()
+
+    def process_request(self, request):
+        reset_stats()
+
+    def process_response(self, request, response):
+        stats = get_stats()
+        if stats.calls:
+            # logging is imported here, as helpers (which imports this
+            # module) is used in processes that don't otherwise need it.
+            import logging
+            logger = logging.getLogger('timedelta.instrumentation')
+            request_stats.send(sender=self.__class__, request=request, stats=stats)
+            logger.debug('%s %s: %r', request.method, request.path, stats)
+        return response
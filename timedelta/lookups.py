@@ -0,0 +1,121 @@
+"""
+Lookups for TimedeltaField.
+
+``duration__seconds`` compares (or annotates) the number of seconds in a
+duration. The comparisons (exact, gt, gte, lt, lte and range) are rewritten
+to compare the column itself with the equivalent duration, so they can use
+a plain index on the column on every backend:
+
+    Job.objects.filter(duration__seconds__gte=7200)
+    Job.objects.filter(duration__seconds__range=(60, 3600))
+
+They are registered by the app's AppConfig, so ``'timedelta'`` must be in
+INSTALLED_APPS.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db.models import FloatField
+from django.db.models.lookups import Lookup, Transform
+from django.utils.functional import cached_property
+
+from .expressions import TotalSeconds
+
+
+class Seconds(Transform):
+    lookup_name = 'seconds'
+
+    @cached_property
+    def output_field(self):
+        return FloatField()
+
+    def as_sql(self, compiler, connection):
+        return compiler.compile(TotalSeconds(self.lhs))
+
+
+def _duration(seconds):
+    if isinstance(seconds, Decimal):
+        seconds = float(seconds)
+    return datetime.timedelta(seconds=seconds)
+
+
+class SecondsLookup(Lookup):
+    operator = None
+
+    def get_prep_lookup(self):
+        # The value is a number of seconds, rather than something our
+        # output_field (a FloatField) should prepare.
+        return self.rhs
+
+    def prepare(self, seconds, connection):
+        field = self.lhs.lhs.output_field
+        return field.get_db_prep_value(_duration(seconds), connection)
+
+    def as_sql(self, compiler, connection):
+        if not self.rhs_is_direct_value():
+            lhs_sql, params = compiler.compile(self.lhs)
+            rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+            return '%s %s %s' % (lhs_sql, self.operator, rhs_sql), list(params) + list(rhs_params)
+        lhs_sql, params = compiler.compile(self.lhs.lhs)
+        return '%s %s %%s' % (lhs_sql, self.operator), list(params) + [self.prepare(self.rhs, connection)]
+
+
+class SecondsExact(SecondsLookup):
+    lookup_name = 'exact'
+    operator = '='
+
+
+class SecondsGreaterThan(SecondsLookup):
+    lookup_name = 'gt'
+    operator = '>'
+
+
+class SecondsGreaterThanOrEqual(SecondsLookup):
+    lookup_name = 'gte'
+    operator = '>='
+
+
+class SecondsLessThan(SecondsLookup):
+    lookup_name = 'lt'
+    operator = '<'
+
+
+class SecondsLessThanOrEqual(SecondsLookup):
+    lookup_name = 'lte'
+    operator = '<='
+
+
+class SecondsRange(SecondsLookup):
+    lookup_name = 'range'
+
+    def as_sql(self, compiler, connection):
+        low, high = self.rhs
+        if not any(hasattr(bound, 'resolve_expression') for bound in (low, high)):
+            lhs_sql, params = compiler.compile(self.lhs.lhs)
+            return '%s BETWEEN %%s AND %%s' % lhs_sql, list(params) + [
+                self.prepare(low, connection),
+                self.prepare(high, connection),
+            ]
+        # An expression is a number of seconds too, so compare it with the
+        # transform (which can't use the index). Django doesn't resolve
+        # expressions inside the range's tuple, and the joins are already
+        # set up by now, so they may only refer to this model's fields.
+        lhs_sql, params = compiler.compile(self.lhs)
+        params = list(params)
+        bounds = []
+        for bound in (low, high):
+            if hasattr(bound, 'resolve_expression'):
+                bound = bound.resolve_expression(compiler.query, allow_joins=False)
+                bound_sql, bound_params = compiler.compile(bound)
+                bounds.append(bound_sql)
+                params.extend(bound_params)
+            else:
+                bounds.append('%s')
+                params.append(float(bound))
+        return '%s BETWEEN %s AND %s' % (lhs_sql, bounds[0], bounds[1]), params
+
+
+for lookup in (SecondsExact, SecondsGreaterThan, SecondsGreaterThanOrEqual,
+               SecondsLessThan, SecondsLessThanOrEqual, SecondsRange):
+    Seconds.register_lookup(lookup)
+del lookup
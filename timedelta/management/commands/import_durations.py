@@ -0,0 +1,71 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from ...bulk import DEFAULT_CHUNK_SIZE, import_durations
+
+
+class Command(BaseCommand):
+    help = ('Loads a CSV or TSV file into a model, parsing the columns for '
+            'TimedeltaFields in a pool of worker processes. The first line '
+            'of the file must name the model field for each column.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='The model to load into, as app_label.ModelName.')
+        parser.add_argument('path', help='The CSV (or TSV) file to load.')
+        parser.add_argument('--workers', type=int, default=None,
+            help='The number of worker processes. Defaults to the number of CPUs.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help='The number of bytes of the file each worker parses at a time.')
+        parser.add_argument('--unordered', action='store_false', dest='ordered', default=True,
+            help='Save each chunk as soon as it is parsed, rather than in file order.')
+        parser.add_argument('--delimiter', default=None,
+            help='The column delimiter. Defaults to a tab for .tsv files, or a comma.')
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='The number of rows saved by each INSERT.')
+        parser.add_argument('--skip-invalid', action='store_true', default=False,
+            help='Leave out rows with invalid durations, rather than stopping.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        verbosity = options.get('verbosity', 1)
+
+        def report(result, seconds):
+            if verbosity < 2:
+                return
+            elapsed = result.seconds + seconds
+            self.stdout.write(
+                'Chunk %i: %i rows (%i invalid), %i bytes, parsed in %.3fs, saved in %.3fs (%.0f rows/s)' % (
+                    result.index, len(result.rows), len(result.errors), result.size,
+                    result.seconds, seconds, len(result.rows) / elapsed if elapsed else 0,
+                )
+            )
+
+        delimiter = options['delimiter']
+        if delimiter == '\\t':
+            delimiter = '\t'
+
+        try:
+            saved = import_durations(
+                options['path'], model,
+                workers=options['workers'],
+                chunk_size=options['chunk_size'],
+                ordered=options['ordered'],
+                delimiter=delimiter,
+                encoding=options['encoding'],
+                batch_size=options['batch_size'],
+                using=options['database'],
+                skip_invalid=options['skip_invalid'],
+                report=report,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if verbosity:
+            self.stdout.write('Saved %i rows.' % saved)
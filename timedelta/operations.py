@@ -0,0 +1,195 @@
+"""
+Migration operations for TimedeltaFields.
+"""
+import datetime
+
+from django.db.migrations.operations.base import Operation
+from django.utils import six
+
+from .fields import TimedeltaField, stores_microseconds
+from .helpers import parse, total_microseconds
+
+
+class AddTotalSecondsIndex(Operation):
+    """
+    Add an index for ordering and filtering on expressions.TotalSeconds()
+    of a TimedeltaField. Add it to the operations of a migration:
+
+        operations = [
+            AddTotalSecondsIndex('job', 'duration'),
+        ]
+
+    In PostgreSQL this is an index on EXTRACT(EPOCH FROM column). Other
+    backends store a number of microseconds, which sorts the same way as
+    the number of seconds, so the column itself is indexed.
+
+    Note that the ``__seconds`` lookups compare the column directly, so a
+    plain ``db_index=True`` on the field is enough for those.
+    """
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, model_name, name, index_name=None):
+        self.model_name = model_name
+        self.name = name
+        self.index_name = index_name
+
+    def deconstruct(self):
+        kwargs = {
+            'model_name': self.model_name,
+            'name': self.name,
+        }
+        if self.index_name is not None:
+            kwargs['index_name'] = self.index_name
+        return self.__class__.__name__, [], kwargs
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def _index_name(self, model, column):
+        if self.index_name:
+            return self.index_name
+        return '%s_%s_seconds' % (model._meta.db_table, column)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        column = model._meta.get_field(self.name).column
+        quote = schema_editor.quote_name
+        if stores_microseconds(schema_editor.connection):
+            expression = quote(column)
+        else:
+            expression = '(EXTRACT(EPOCH FROM %s))' % quote(column)
+        schema_editor.execute('CREATE INDEX %s ON %s (%s)' % (
+            quote(self._index_name(model, column)),
+            quote(model._meta.db_table),
+            expression,
+        ))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        column = model._meta.get_field(self.name).column
+        sql = 'DROP INDEX %s' % schema_editor.quote_name(self._index_name(model, column))
+        if schema_editor.connection.vendor == 'mysql':
+            sql += ' ON %s' % schema_editor.quote_name(model._meta.db_table)
+        schema_editor.execute(sql)
+
+    def describe(self):
+        return 'Add a TotalSeconds index on %s.%s' % (self.model_name, self.name)
+
+
+# Returned by a conversion in ConvertDurationsToMicroseconds to leave a value.
+_UNCHANGED = object()
+
+
+class IntervalTimedeltaField(TimedeltaField):
+    """
+    A TimedeltaField as it was declared before BIGINT storage, with an
+    INTERVAL column on every backend (only used to alter the column).
+    """
+    def db_type(self, connection):
+        return 'interval'
+
+
+class ConvertDurationsToMicroseconds(Operation):
+    """
+    Upgrade a TimedeltaField's column from the old storage, as text in an
+    INTERVAL column, to a BIGINT number of microseconds, on backends other
+    than PostgreSQL. Add it to the operations of a migration for each
+    TimedeltaField whose table was created by an older version:
+
+        operations = [
+            ConvertDurationsToMicroseconds('job', 'duration'),
+        ]
+
+    Text rows (such as '2 days, 0:00:00') are parsed and rewritten as
+    microseconds, and then the column is altered. In PostgreSQL, which
+    still uses a native INTERVAL, it does nothing.
+
+    Until this has run, the database sees old rows as text, so aggregates,
+    ordering and lookups that are computed in SQL get them wrong.
+    """
+    reversible = True
+
+    def __init__(self, model_name, name):
+        self.model_name = model_name
+        self.name = name
+
+    def deconstruct(self):
+        return self.__class__.__name__, [], {
+            'model_name': self.model_name,
+            'name': self.name,
+        }
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def _fields(self, model):
+        field = model._meta.get_field(self.name)
+        name, path, args, kwargs = field.deconstruct()
+        interval = IntervalTimedeltaField(*args, **kwargs)
+        interval.set_attributes_from_name(field.name)
+        interval.model = model
+        return interval, field
+
+    def _convert(self, schema_editor, model, convert):
+        """
+        Rewrite each value of the column with convert(value), or leave it
+        if that returns _UNCHANGED.
+        """
+        column = model._meta.get_field(self.name).column
+        quote = schema_editor.quote_name
+        table, pk = quote(model._meta.db_table), quote(model._meta.pk.column)
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SELECT %s, %s FROM %s WHERE %s IS NOT NULL' % (pk, quote(column), table, quote(column)))
+            updates = []
+            for key, value in cursor.fetchall():
+                value = convert(value)
+                if value is not _UNCHANGED:
+                    updates.append((value, key))
+            if updates:
+                cursor.executemany('UPDATE %s SET %s = %%s WHERE %s = %%s' % (table, quote(column), pk), updates)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if not stores_microseconds(schema_editor.connection):
+            return
+
+        def microseconds(value):
+            if not isinstance(value, six.string_types):
+                return _UNCHANGED
+            if not value.strip():
+                return None if model._meta.get_field(self.name).null else 0
+            try:
+                return total_microseconds(parse(value))
+            except TypeError:
+                raise ValueError('%s.%s holds an invalid duration: %r' % (self.model_name, self.name, value))
+
+        self._convert(schema_editor, model, microseconds)
+        interval, field = self._fields(model)
+        schema_editor.alter_field(model, interval, field)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if not stores_microseconds(schema_editor.connection):
+            return
+
+        interval, field = self._fields(model)
+        schema_editor.alter_field(model, field, interval)
+
+        def text(value):
+            if isinstance(value, six.string_types):
+                return _UNCHANGED
+            return six.text_type(datetime.timedelta(0, 0, value))
+
+        self._convert(schema_editor, model, text)
+
+    def describe(self):
+        return 'Convert %s.%s to microseconds' % (self.model_name, self.name)
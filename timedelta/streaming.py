@@ -0,0 +1,389 @@
+"""
+Statistics over streams of durations that are too long to keep in memory.
+
+A DurationStats is fed timedeltas (or strings, or integer microseconds)
+one at a time, or from an iterable, and keeps their exact count, sum,
+minimum, maximum and variance, and a QuantileSketch for approximate
+percentiles in bounded memory:
+
+    >>> stats = DurationStats()
+    >>> stats.update(datetime.timedelta(seconds=seconds) for seconds in range(1, 101))
+    >>> stats.count, stats.mean(), stats.max()
+    (100, datetime.timedelta(0, 50, 500000), datetime.timedelta(0, 100))
+    >>> stats.quantile(0.5)
+    datetime.timedelta(0, 50, 150600)
+
+Partial results from separate processes can be combined with merge(),
+and passed between them with to_dict() and from_dict(), which use only
+JSON-friendly values.
+"""
+from __future__ import division
+
+import datetime
+import math
+from array import array
+from itertools import islice
+
+from .arrays import TimedeltaArray, _microseconds
+from .helpers import MICROSECONDS_TYPECODE, PARSE_MANY_MEMO_SIZE, _divide_rounded
+
+# How many values update() converts to microseconds at a time.
+CHUNK_SIZE = 4096
+
+
+class QuantileSketch(object):
+    """
+    An estimate of the distribution of a stream of integers, which
+    answers quantile() queries to within relative_accuracy (as a fraction
+    of the true value), like DDSketch.
+
+    Values are counted in buckets whose bounds grow geometrically, so the
+    number of buckets only grows with the logarithm of the range of the
+    values: at the default accuracy of 1%, about 2000 buckets cover every
+    possible timedelta. If there would be more than max_buckets positive
+    (or negative) buckets, the ones nearest zero are merged together, so
+    only quantiles that fall among the smallest values lose accuracy.
+
+    >>> sketch = QuantileSketch()
+    >>> for value in range(1, 1001):
+    ...     sketch.add(value)
+    >>> int(sketch.quantile(0.9))
+    907
+    """
+    __slots__ = (
+        'relative_accuracy', 'max_buckets', 'count', 'zeros', 'positive', 'negative',
+        '_gamma', '_log_gamma', '_floors',
+    )
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        assert 0 < relative_accuracy < 1, "relative_accuracy must be between 0 and 1."
+        assert max_buckets > 0, "max_buckets must be positive."
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.count = 0
+        self.zeros = 0
+        # Bucket index -> count, for values above and below zero.
+        self.positive = {}
+        self.negative = {}
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        # The lowest index kept in each store, once buckets have been merged.
+        self._floors = {'positive': None, 'negative': None}
+
+    def _index(self, magnitude):
+        return int(math.ceil(math.log(magnitude) / self._log_gamma))
+
+    def _value(self, index):
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, value, count=1):
+        self.count += count
+        if value > 0:
+            self._add('positive', self.positive, self._index(value), count)
+        elif value < 0:
+            self._add('negative', self.negative, self._index(-value), count)
+        else:
+            self.zeros += count
+
+    def add_many(self, values):
+        """
+        add() each of a sequence of numbers.
+        """
+        log, ceil, log_gamma = math.log, math.ceil, self._log_gamma
+        positive, negative = self.positive, self.negative
+        zeros = 0
+        for value in values:
+            if value > 0:
+                index = int(ceil(log(value) / log_gamma))
+                positive[index] = positive.get(index, 0) + 1
+            elif value < 0:
+                index = int(ceil(log(-value) / log_gamma))
+                negative[index] = negative.get(index, 0) + 1
+            else:
+                zeros += 1
+        self.count += len(values)
+        self.zeros += zeros
+        self._bound('positive', positive)
+        self._bound('negative', negative)
+
+    def _bound(self, name, store):
+        """
+        Move any buckets below the store's floor up to it, and merge the
+        lowest buckets if there are too many.
+        """
+        floor = self._floors[name]
+        if floor is not None:
+            for index in [index for index in store if index < floor]:
+                store[floor] = store.get(floor, 0) + store.pop(index)
+        if len(store) > self.max_buckets:
+            self._collapse(name, store)
+
+    def _add(self, name, store, index, count):
+        floor = self._floors[name]
+        if floor is not None and index < floor:
+            index = floor
+        try:
+            store[index] += count
+        except KeyError:
+            store[index] = count
+            if len(store) > self.max_buckets:
+                self._collapse(name, store)
+
+    def _collapse(self, name, store):
+        indexes = sorted(store)
+        excess = len(indexes) - self.max_buckets
+        floor = indexes[excess]
+        for index in indexes[:excess]:
+            store[floor] += store.pop(index)
+        self._floors[name] = floor
+
+    def merge(self, other):
+        """
+        Add the counts of another sketch, with the same relative_accuracy,
+        to this one.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches with the same relative_accuracy can be merged.')
+        self.count += other.count
+        self.zeros += other.zeros
+        for name, store, other_store in (
+            ('positive', self.positive, other.positive),
+            ('negative', self.negative, other.negative),
+        ):
+            for index, count in other_store.items():
+                self._add(name, store, index, count)
+        return self
+
+    def quantile(self, q):
+        """
+        The approximate value below which a fraction q of the values fall,
+        or None if no values have been added.
+        """
+        assert 0 <= q <= 1, "q must be between 0 and 1."
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'max_buckets': self.max_buckets,
+            'count': self.count,
+            'zeros': self.zeros,
+            'positive': sorted(self.positive.items()),
+            'negative': sorted(self.negative.items()),
+            'floors': self._floors,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'], data['max_buckets'])
+        sketch.count = data['count']
+        sketch.zeros = data['zeros']
+        sketch.positive = dict((index, count) for index, count in data['positive'])
+        sketch.negative = dict((index, count) for index, count in data['negative'])
+        sketch._floors = dict(data['floors'])
+        return sketch
+
+
+class DurationStats(object):
+    """
+    Exact count, sum, minimum, maximum, mean and variance of a stream of
+    durations, and approximate quantiles (see QuantileSketch).
+
+    Sums are kept as integer microseconds (and squared microseconds), so
+    they are exact, and merging the stats of two streams gives exactly
+    the stats of both.
+
+    Values may be timedeltas, strings that parse() accepts, or integer
+    microseconds. None is skipped.
+    """
+    __slots__ = ('count', 'total', 'total_squares', 'minimum', 'maximum', 'sketch')
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.count = 0
+        self.total = 0
+        self.total_squares = 0
+        self.minimum = None
+        self.maximum = None
+        self.sketch = QuantileSketch(relative_accuracy, max_buckets)
+
+    def __repr__(self):
+        return '<DurationStats: %i durations, mean %s>' % (self.count, self.mean() if self.count else None)
+
+    def add(self, value):
+        if value is not None:
+            self._add(_microseconds(value, {}))
+
+    def _add(self, microseconds):
+        self.count += 1
+        self.total += microseconds
+        self.total_squares += microseconds * microseconds
+        if self.minimum is None or microseconds < self.minimum:
+            self.minimum = microseconds
+        if self.maximum is None or microseconds > self.maximum:
+            self.maximum = microseconds
+        self.sketch.add(microseconds)
+
+    def update(self, values):
+        """
+        add() each of values, which may be any iterable: a queryset's
+        iterator(), a TimedeltaArray, or an array of microseconds.
+        """
+        if isinstance(values, TimedeltaArray):
+            values = values.microseconds
+        if isinstance(values, (array, memoryview)):
+            for start in range(0, len(values), CHUNK_SIZE):
+                self._add_many(values[start:start + CHUNK_SIZE])
+            return
+
+        values = iter(values)
+        seen = {}
+        while True:
+            chunk = list(islice(values, CHUNK_SIZE))
+            if not chunk:
+                return
+            if len(seen) >= PARSE_MANY_MEMO_SIZE:
+                seen.clear()
+            self._add_many(array(MICROSECONDS_TYPECODE, [
+                _microseconds(value, seen) for value in chunk if value is not None
+            ]))
+
+    def _add_many(self, microseconds):
+        if not len(microseconds):
+            return
+        self.count += len(microseconds)
+        self.total += sum(microseconds)
+        self.total_squares += sum([value * value for value in microseconds])
+        low, high = min(microseconds), max(microseconds)
+        if self.minimum is None or low < self.minimum:
+            self.minimum = low
+        if self.maximum is None or high > self.maximum:
+            self.maximum = high
+        self.sketch.add_many(microseconds)
+
+    @classmethod
+    def from_queryset(cls, queryset, field, **kwargs):
+        """
+        The stats of a TimedeltaField over a queryset, which is read with
+        iterator() as integer microseconds (see
+        expressions.values_list_microseconds), so it is never all in memory.
+        Other arguments are passed to DurationStats().
+        """
+        from .expressions import values_list_microseconds
+
+        stats = cls(**kwargs)
+        stats.update(values_list_microseconds(queryset, field, flat=True).iterator())
+        return stats
+
+    def merge(self, other):
+        """
+        Add the stats of another stream to this one.
+        """
+        self.sketch.merge(other.sketch)
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+        for value in (other.minimum, other.maximum):
+            if value is not None:
+                if self.minimum is None or value < self.minimum:
+                    self.minimum = value
+                if self.maximum is None or value > self.maximum:
+                    self.maximum = value
+        return self
+
+    def _timedelta(self, microseconds):
+        if microseconds is None:
+            return None
+        return datetime.timedelta(0, 0, microseconds)
+
+    def sum(self):
+        return datetime.timedelta(0, 0, self.total)
+
+    def min(self):
+        return self._timedelta(self.minimum)
+
+    def max(self):
+        return self._timedelta(self.maximum)
+
+    def mean(self):
+        """
+        The mean, rounded half to even to a whole microsecond, or None if
+        there are no values.
+        """
+        if not self.count:
+            return None
+        return datetime.timedelta(0, 0, _divide_rounded(self.total, self.count))
+
+    def variance(self, ddof=0):
+        """
+        The variance, in square microseconds, as a float: the population
+        variance, or with ddof=1 the sample variance. None if there are
+        not enough values.
+        """
+        if self.count <= ddof:
+            return None
+        return (self.count * self.total_squares - self.total * self.total) / (self.count * (self.count - ddof))
+
+    def stdev(self, ddof=0):
+        """
+        The standard deviation (see variance()), as a timedelta.
+        """
+        variance = self.variance(ddof)
+        if variance is None:
+            return None
+        return datetime.timedelta(0, 0, int(round(math.sqrt(variance))))
+
+    def quantile(self, q):
+        """
+        The approximate q quantile (0.5 for the median, 0.99 for the 99th
+        percentile), within the sketch's relative accuracy, or None if
+        there are no values.
+        """
+        value = self.sketch.quantile(q)
+        if value is None:
+            return None
+        # The sketch estimates the middle of a bucket, which might be
+        # beyond the values actually seen.
+        return datetime.timedelta(0, 0, min(max(int(round(value)), self.minimum), self.maximum))
+
+    def quantiles(self, qs):
+        return [self.quantile(q) for q in qs]
+
+    def to_dict(self):
+        """
+        The stats, as a dict of JSON-friendly values, to be rebuilt with
+        from_dict().
+        """
+        return {
+            'count': self.count,
+            'total': self.total,
+            'total_squares': self.total_squares,
+            'minimum': self.minimum,
+            'maximum': self.maximum,
+            'sketch': self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls.__new__(cls)
+        stats.count = data['count']
+        stats.total = data['total']
+        stats.total_squares = data['total_squares']
+        stats.minimum = data['minimum']
+        stats.maximum = data['maximum']
+        stats.sketch = QuantileSketch.from_dict(data['sketch'])
+        return stats
@@ -1,10 +1,13 @@
 from django import template
 register = template.Library()
 
+from .. import instrumentation
 from ..helpers import decimal_hours as dh
 
 @register.filter(name='decimal_hours')
 def decimal_hours(value, decimal_places=None):
     if value is None:
         return value
+    if instrumentation.enabled:
+        return instrumentation.call('filter:decimal_hours', dh, value, decimal_places)
     return dh(value, decimal_places)
@@ -2,18 +2,24 @@ from django import template
 register = template.Library()
 
 # Don't really like using relative imports, but no choice here!
-from ..helpers import nice_repr, iso8601_repr, total_seconds as _total_seconds
+from .. import instrumentation
+from ..cache import nice_repr
+from ..helpers import iso8601_repr, total_seconds as _total_seconds
 
 @register.filter(name='timedelta')
 def timedelta(value, display="long"):
     if value is None:
         return value
+    if instrumentation.enabled:
+        return instrumentation.call('filter:timedelta', nice_repr, value, display)
     return nice_repr(value, display)
 
 @register.filter(name='iso8601')
 def iso8601(value):
     if value is None:
         return value
+    if instrumentation.enabled:
+        return instrumentation.call('filter:iso8601', iso8601_repr, value)
     return iso8601_repr(value)
 
 @register.filter(name='total_seconds')
@@ -1,14 +1,32 @@
 from unittest import TestCase
+from array import array
 import datetime
 import doctest
+import os
+import shutil
+import tempfile
 
-from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.exceptions import FieldError, ValidationError
+from django.core import serializers
+from django.core.management import call_command, CommandError
+from django.db import connection, models
+from django.db.models import Count
+from django import forms, test
+from django.test.utils import override_settings
 from django.utils import six
 
 from .fields import TimedeltaField
+import timedelta.aggregates
+import timedelta.arrays
+import timedelta.bulk
+import timedelta.cache
+import timedelta.expressions
+import timedelta.fields
+import timedelta.operations
+import timedelta.streaming
 import timedelta.helpers
 import timedelta.forms
+import timedelta.instrumentation
 import timedelta.widgets
 
 class MinMaxTestModel(models.Model):
@@ -54,8 +72,831 @@ class TimedeltaModelFieldTest(TestCase):
         self.assertEquals(datetime.timedelta(2), obj.min)
         self.assertEquals(datetime.timedelta(0, 120), obj.max)
         self.assertEquals(datetime.timedelta(3), obj.minmax)
+    
+    def test_lazy_conversion(self):
+        obj = MinMaxTestModel(min='2 days', max=60)
+        self.assertEquals('2 days', obj.__dict__['min'])
+        self.assertEquals(datetime.timedelta(2), obj.min)
+        self.assertEquals(datetime.timedelta(2), obj.__dict__['min'])
+        self.assertEquals(datetime.timedelta(0, 60), obj.max)
+        self.assertEquals(None, MinMaxTestModel(min=None).min)
+
+class ParseCacheTest(TestCase):
+    def test_disabled_by_default(self):
+        self.assertEqual(None, timedelta.cache.get_parse_cache())
+        self.assertEqual(datetime.timedelta(hours=1), timedelta.cache.parse('1 hour'))
+    
+    def test_cache(self):
+        with override_settings(TIMEDELTA_PARSE_CACHE_SIZE=2):
+            cache = timedelta.cache.get_parse_cache()
+            self.assertEqual(2, cache.maxsize)
+            
+            field = TimedeltaField()
+            self.assertEqual(datetime.timedelta(hours=1), field.to_python('1 hour'))
+            self.assertEqual(datetime.timedelta(hours=1), field.to_python(' 1 hour '))
+            self.assertEqual(datetime.timedelta(1), field.to_python('1 day, 0:00:00'))
+            self.assertEqual(datetime.timedelta(minutes=30), field.to_python('30 minutes'))
+            self.assertRaises(TypeError, field.to_python, 'foo')
+            
+            self.assertEqual({
+                'hits': 1,
+                'misses': 4,
+                'evictions': 1,
+                'size': 2,
+                'maxsize': 2,
+            }, cache.info())
+        
+        self.assertEqual(None, timedelta.cache.get_parse_cache())
+
+class MinMaxTestForm(forms.ModelForm):
+    class Meta:
+        model = MinMaxTestModel
+        fields = ['min', 'max', 'minmax']
+
+class FormChangedTest(TestCase):
+    def test_unchanged(self):
+        obj = MinMaxTestModel(min=datetime.timedelta(1), max=datetime.timedelta(0, 90), minmax=datetime.timedelta(3))
+        rendered = MinMaxTestForm(instance=obj)
+        self.assertTrue('value="1 minute, 30 seconds"' in six.text_type(rendered['max']))
+        
+        data = {'min': '1 day', 'max': '1 minute, 30 seconds', 'minmax': '3 days, 0:00:00'}
+        form = MinMaxTestForm(data, instance=obj)
+        self.assertTrue(form.is_valid())
+        self.assertEqual([], form.changed_data)
+        
+        form = MinMaxTestForm(dict(data, minmax='4 days'), instance=obj)
+        self.assertEqual(['minmax'], form.changed_data)
+
+    def test_formset(self):
+        from django.forms.formsets import formset_factory
+        
+        DurationFormSet = formset_factory(MinMaxTestForm, extra=0)
+        initial = [{'max': datetime.timedelta(0, 90)}] * 100
+        stats = timedelta.instrumentation.reset_stats()
+        timedelta.instrumentation.enable()
+        try:
+            with override_settings(TIMEDELTA_NICE_REPR_CACHE_SIZE=10):
+                DurationFormSet(initial=initial).as_table()
+        finally:
+            timedelta.instrumentation.disable()
+        self.assertEqual(1, stats.calls['nice_repr'])
+        self.assertEqual(99, stats.cache_hits['nice_repr'])
+
+class NiceReprCacheTest(TestCase):
+    def test_cache(self):
+        self.assertEqual(None, timedelta.cache.get_nice_repr_cache())
+        with override_settings(TIMEDELTA_NICE_REPR_CACHE_SIZE=10):
+            cache = timedelta.cache.get_nice_repr_cache()
+            self.assertEqual('1 hour', timedelta.cache.nice_repr(datetime.timedelta(hours=1)))
+            self.assertEqual('1 hour', timedelta.cache.nice_repr(datetime.timedelta(hours=1, microseconds=1)))
+            self.assertEqual('1h', timedelta.cache.nice_repr(datetime.timedelta(hours=1), 'minimal'))
+            self.assertEqual('01:00', timedelta.cache.nice_repr(datetime.timedelta(hours=1), 'H:i'))
+            self.assertEqual({
+                'hits': 1,
+                'misses': 3,
+                'evictions': 0,
+                'size': 3,
+                'maxsize': 10,
+            }, cache.info())
+    
+    def test_formats(self):
+        self.assertTrue(timedelta.helpers.nice_repr_format('H:i', ' ') is timedelta.helpers.nice_repr_format('H:i', ' '))
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        timedelta.instrumentation.enable()
+        self.stats = timedelta.instrumentation.reset_stats()
+    
+    def tearDown(self):
+        timedelta.instrumentation.disable()
+    
+    def test_disabled(self):
+        timedelta.instrumentation.disable()
+        timedelta.helpers.parse('1 hour')
+        self.assertEqual({}, self.stats.calls)
+    
+    def test_counters(self):
+        from django.template import Context, Template
+        field = TimedeltaField()
+        with override_settings(TIMEDELTA_PARSE_CACHE_SIZE=10):
+            field.to_python('1 hour')
+            field.to_python('1 hour')
+            field.get_prep_value('1 day, 0:00:00')
+            self.assertRaises(TypeError, field.to_python, 'foo')
+        Template('{% load timedelta %}{{ value|timedelta }} {{ value|iso8601 }}').render(Context({
+            'value': datetime.timedelta(hours=1),
+        }))
+        
+        stats = self.stats.as_dict()
+        self.assertEqual({
+            'to_python': 4,
+            'get_prep_value': 1,
+            'parse': 3,
+            'nice_repr': 1,
+            'filter:timedelta': 1,
+            'filter:iso8601': 1,
+        }, stats['calls'])
+        self.assertEqual({'to_python': 1, 'parse': 1}, stats['failures'])
+        self.assertEqual({'flexible': 2, 'colon': 1}, stats['grammars'])
+        self.assertEqual({'parse': 1}, stats['cache_hits'])
+        self.assertEqual({'parse': 3}, stats['cache_misses'])
+        self.assertTrue(stats['seconds']['to_python'] >= stats['seconds']['parse'] > 0)
+    
+    def test_middleware(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        
+        received = []
+        def receiver(sender, request, stats, **kwargs):
+            received.append((request.path, dict(stats.calls)))
+        timedelta.instrumentation.request_stats.connect(receiver)
+        try:
+            middleware = timedelta.instrumentation.InstrumentationMiddleware()
+            request = RequestFactory().get('/jobs/')
+            timedelta.helpers.parse('1 hour')
+            middleware.process_request(request)
+            timedelta.helpers.parse('2 hours')
+            middleware.process_response(request, HttpResponse())
+        finally:
+            timedelta.instrumentation.request_stats.disconnect(receiver)
+        self.assertEqual([('/jobs/', {'parse': 1})], received)
+
+class ImportTestModel(models.Model):
+    name = models.CharField(max_length=20)
+    duration = TimedeltaField()
+    limit = TimedeltaField(null=True, blank=True)
+
+class ImportDurationsTest(test.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'durations.csv')
+        with open(self.path, 'w') as handle:
+            handle.write('name,duration\n')
+            for i in range(200):
+                handle.write('row %i,"%i hours, %i minutes"\n' % (i, i, i % 60))
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_import(self):
+        chunks = []
+        saved = timedelta.bulk.import_durations(
+            self.path, ImportTestModel, workers=2, chunk_size=512,
+            report=lambda result, seconds: chunks.append(result.index)
+        )
+        self.assertEqual(200, saved)
+        self.assertEqual(list(range(len(chunks))), chunks)
+        self.assertTrue(len(chunks) > 1)
+        
+        objects = list(ImportTestModel.objects.order_by('pk'))
+        self.assertEqual(['row %i' % i for i in range(200)], [obj.name for obj in objects])
+        self.assertEqual(datetime.timedelta(hours=199, minutes=19), objects[-1].duration)
+    
+    def test_invalid(self):
+        with open(self.path, 'a') as handle:
+            handle.write('bad,"3 fortnights"\n')
+        
+        self.assertRaises(ValueError, timedelta.bulk.import_durations,
+            self.path, ImportTestModel, workers=2, chunk_size=512)
+        
+        call_command('import_durations', 'timedelta.ImportTestModel', self.path,
+            workers=2, chunk_size=512, ordered=False, skip_invalid=True, verbosity=0)
+        self.assertEqual(200, ImportTestModel.objects.count())
+    
+    def test_short_rows(self):
+        with open(self.path, 'a') as handle:
+            handle.write('no duration\n')
+        
+        start = len('name,duration\n')
+        result = timedelta.bulk.parse_chunk(self.path, 0, start, os.path.getsize(self.path), [1])
+        self.assertEqual(['no duration'], result.errors)
+        self.assertEqual(200, len(result.rows))
+        
+        self.assertRaises(ValueError, timedelta.bulk.import_durations,
+            self.path, ImportTestModel, workers=2, chunk_size=512)
+        saved = timedelta.bulk.import_durations(
+            self.path, ImportTestModel, workers=2, chunk_size=512, skip_invalid=True)
+        self.assertEqual(200, saved)
+    
+    def test_unknown_column(self):
+        with open(self.path, 'w') as handle:
+            handle.write('name,length\nrow,1 hour\n')
+        
+        self.assertRaisesRegexp(ValueError, "'length'", timedelta.bulk.import_durations,
+            self.path, ImportTestModel, workers=1)
+        self.assertRaisesRegexp(CommandError, "'length'", call_command, 'import_durations',
+            'timedelta.ImportTestModel', self.path, workers=1, verbosity=0)
+    
+    def test_empty_values(self):
+        with open(self.path, 'w') as handle:
+            handle.write('name,duration,limit\nlimited,1 hour,2 hours\nunlimited,1 hour,\n')
+        
+        timedelta.bulk.import_durations(self.path, ImportTestModel, workers=1)
+        self.assertEqual([
+            ('limited', datetime.timedelta(hours=2)),
+            ('unlimited', None),
+        ], list(ImportTestModel.objects.order_by('pk').values_list('name', 'limit')))
+        
+        # duration is not null=True, so it can't be left empty.
+        with open(self.path, 'a') as handle:
+            handle.write('empty,,\n')
+        self.assertRaises(ValueError, timedelta.bulk.import_durations,
+            self.path, ImportTestModel, workers=1)
+
+class EventTestModel(models.Model):
+    start = models.DateTimeField()
+    duration = TimedeltaField()
+
+class EventNoteTestModel(models.Model):
+    event = models.ForeignKey(EventTestModel)
+    text = models.CharField(max_length=20)
+
+class StorageTest(test.TestCase):
+    def test_microseconds(self):
+        durations = [
+            datetime.timedelta(-1, 1),
+            datetime.timedelta(0, 59, 1),
+            datetime.timedelta(2),
+            datetime.timedelta(0, 3600),
+        ]
+        for duration in durations:
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=duration)
+        
+        self.assertEqual(sorted(durations), [
+            obj.duration for obj in EventTestModel.objects.order_by('duration')
+        ])
+        self.assertEqual(sorted(durations)[1:3], list(
+            EventTestModel.objects.filter(
+                duration__gte='59.000001 seconds', duration__lt=datetime.timedelta(2)
+            ).order_by('duration').values_list('duration', flat=True)
+        ))
+        
+        if timedelta.fields.stores_microseconds(connection):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT duration FROM %s ORDER BY duration' % EventTestModel._meta.db_table)
+                self.assertEqual([-86399000000, 59000001, 3600000000, 172800000000], [
+                    row[0] for row in cursor.fetchall()
+                ])
+    
+    def test_prep_value(self):
+        field = EventTestModel._meta.get_field('duration')
+        self.assertEqual(datetime.timedelta(0, 90), field.get_prep_value('1.5 minutes'))
+        self.assertEqual(datetime.timedelta(0, 0, 1), field.get_prep_value(datetime.timedelta(0, 0, 1)))
+        if timedelta.fields.stores_microseconds(connection):
+            expected = 90000000
+        else:
+            expected = datetime.timedelta(0, 90)
+        self.assertEqual(expected, field.get_db_prep_save('1.5 minutes', connection))
+        self.assertEqual(expected, field.get_db_prep_save(datetime.timedelta(0, 90), connection))
+    
+    def test_values_list_microseconds(self):
+        for duration in (datetime.timedelta(0, 59, 1), datetime.timedelta(-1)):
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=duration)
+        queryset = EventTestModel.objects.order_by('duration')
+        
+        self.assertEqual([-86400000000, 59000001], list(
+            timedelta.expressions.values_list_microseconds(queryset, 'duration', flat=True).iterator()
+        ))
+        self.assertEqual([
+            (datetime.datetime(2012, 1, 1), -86400000000),
+            (datetime.datetime(2012, 1, 1), 59000001),
+        ], list(timedelta.expressions.values_list_microseconds(queryset, 'start', 'duration')))
+    
+    def test_values_list_microseconds_paths(self):
+        event = EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=datetime.timedelta(0, 1))
+        EventNoteTestModel.objects.create(event=event, text='note')
+        
+        self.assertEqual([(event.pk, 1000000)], list(
+            timedelta.expressions.values_list_microseconds(EventTestModel.objects.all(), 'pk', 'duration')
+        ))
+        self.assertEqual([(event.pk, 1000000)], list(
+            timedelta.expressions.values_list_microseconds(EventNoteTestModel.objects.all(), 'event__pk', 'event__duration')
+        ))
+        queryset = EventTestModel.objects.annotate(notes=models.Count('eventnotetestmodel'))
+        self.assertEqual([(1, 1000000)], list(
+            timedelta.expressions.values_list_microseconds(queryset, 'notes', 'duration')
+        ))
+        self.assertEqual(datetime.timedelta(0, 1), timedelta.streaming.DurationStats.from_queryset(
+            EventNoteTestModel.objects.all(), 'event__duration').sum())
+    
+    def test_legacy_strings(self):
+        if not timedelta.fields.stores_microseconds(connection):
+            return
+        obj = EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=datetime.timedelta(0))
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE %s SET duration = %%s' % EventTestModel._meta.db_table, ['1 day 2:00:00'])
+        self.assertEqual(datetime.timedelta(1, 7200), EventTestModel.objects.get(pk=obj.pk).duration)
+
+class SerializationTest(test.TestCase):
+    def setUp(self):
+        self.durations = [
+            datetime.timedelta(-1, 1),
+            datetime.timedelta(0, 59, 1),
+            datetime.timedelta(400, 3600, 500000),
+            datetime.timedelta(0),
+        ]
+        for duration in self.durations:
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=duration)
+    
+    def round_trip(self):
+        data = serializers.serialize('json', EventTestModel.objects.order_by('pk'))
+        EventTestModel.objects.all().delete()
+        for obj in serializers.deserialize('json', data):
+            obj.save()
+        self.assertEqual(self.durations, list(
+            EventTestModel.objects.order_by('pk').values_list('duration', flat=True)
+        ))
+        return data
+    
+    def test_iso8601(self):
+        data = self.round_trip()
+        self.assertTrue('"-PT23H59M59S"' in data, data)
+        self.assertTrue('"P1Y5WT1H0.5S"' in data, data)
+        self.assertTrue('"PT0S"' in data, data)
+    
+    def test_microseconds(self):
+        with override_settings(TIMEDELTA_SERIALIZATION='microseconds'):
+            data = self.round_trip()
+        self.assertTrue('"-86399000000us"' in data, data)
+        self.assertTrue('"59000001us"' in data, data)
+    
+    def test_to_python(self):
+        field = EventTestModel._meta.get_field('duration')
+        self.assertEqual(datetime.timedelta(0, 90), field.to_python('PT1M30S'))
+        self.assertEqual(datetime.timedelta(0, 0, 90), field.to_python('90us'))
+        self.assertRaises(TypeError, field.to_python, '90')
+        self.assertEqual(datetime.timedelta(0, 90), field.to_python(90))
+        for duration in self.durations:
+            self.assertEqual(duration, field.to_python(timedelta.helpers.iso8601_repr(duration)))
+
+class SecondsTest(test.TestCase):
+    def setUp(self):
+        for minutes in (1, 30, 60, 90, 150):
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=datetime.timedelta(minutes=minutes))
+    
+    def durations(self, **kwargs):
+        return [
+            obj.duration.seconds // 60
+            for obj in EventTestModel.objects.filter(**kwargs).order_by('duration')
+        ]
+    
+    def test_lookups(self):
+        self.assertEqual([60], self.durations(duration__seconds=3600))
+        self.assertEqual([90, 150], self.durations(duration__seconds__gt=3600))
+        self.assertEqual([60, 90, 150], self.durations(duration__seconds__gte=3600.0))
+        self.assertEqual([1, 30], self.durations(duration__seconds__lt=3600))
+        self.assertEqual([1, 30, 60], self.durations(duration__seconds__lte=3600))
+        self.assertEqual([30, 60, 90], self.durations(duration__seconds__range=(1800, 5400)))
+    
+    def test_range_expressions(self):
+        queryset = EventTestModel.objects.annotate(
+            low=models.Value(1800, output_field=models.IntegerField()),
+            high=models.Value(5400.0, output_field=models.FloatField()),
+        ).order_by('duration')
+        for bounds in ((models.F('low'), models.F('high')), (models.F('low'), 5400), (1800, models.F('high'))):
+            self.assertEqual([30, 60, 90], [
+                obj.duration.seconds // 60 for obj in queryset.filter(duration__seconds__range=bounds)
+            ])
+        # The joins are set up before the lookup is compiled.
+        self.assertRaises(FieldError, list, queryset.filter(
+            duration__seconds__range=(models.F('eventnotetestmodel__pk'), 5400)))
+    
+    def test_expressions(self):
+        self.assertEqual([9000.0, 5400.0, 3600.0, 1800.0, 60.0], list(
+            EventTestModel.objects.annotate(
+                seconds=timedelta.expressions.TotalSeconds('duration')
+            ).order_by('-seconds').values_list('seconds', flat=True)
+        ))
+        self.assertEqual([60000000, 1800000000], list(
+            EventTestModel.objects.annotate(
+                microseconds=timedelta.expressions.TotalMicroseconds('duration')
+            ).filter(duration__seconds__lt=3600).order_by('microseconds').values_list('microseconds', flat=True)
+        ))
+    
+    def test_index_operation(self):
+        from django.apps import apps
+        from django.db.migrations.state import ProjectState
+        
+        state = ProjectState.from_apps(apps)
+        operation = timedelta.operations.AddTotalSecondsIndex('eventtestmodel', 'duration')
+        table = EventTestModel._meta.db_table
+        
+        def indexes():
+            with connection.cursor() as cursor:
+                return connection.introspection.get_constraints(cursor, table)
+        
+        with connection.schema_editor() as editor:
+            operation.database_forwards('timedelta', editor, state, state)
+        self.assertIn('%s_duration_seconds' % table, indexes())
+        
+        with connection.schema_editor() as editor:
+            operation.database_backwards('timedelta', editor, state, state)
+        self.assertNotIn('%s_duration_seconds' % table, indexes())
+
+    def test_convert_operation(self):
+        from django.apps import apps
+        from django.db.migrations.state import ProjectState
+        
+        EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=datetime.timedelta(hours=1))
+        legacy = EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=datetime.timedelta(0))
+        table = connection.ops.quote_name(EventTestModel._meta.db_table)
+        with connection.cursor() as cursor:
+            # The text that older versions stored.
+            cursor.execute('UPDATE %s SET duration = %%s WHERE id = %%s' % table, ['2 days, 0:00:00', legacy.pk])
+        # from_db_value() still reads the text, but the database does not.
+        total = sum(EventTestModel.objects.values_list('duration', flat=True), datetime.timedelta(0))
+        self.assertNotEqual(total, EventTestModel.objects.aggregate(
+            total=timedelta.aggregates.Sum('duration'))['total'])
+        
+        state = ProjectState.from_apps(apps)
+        operation = timedelta.operations.ConvertDurationsToMicroseconds('eventtestmodel', 'duration')
+        with connection.schema_editor() as editor:
+            operation.database_forwards('timedelta', editor, state, state)
+        self.assertEqual(total, EventTestModel.objects.aggregate(
+            total=timedelta.aggregates.Sum('duration'))['total'])
+        self.assertEqual([legacy.pk], list(EventTestModel.objects.filter(
+            duration__gt=datetime.timedelta(1)).values_list('pk', flat=True)))
+        
+        with connection.schema_editor() as editor:
+            operation.database_backwards('timedelta', editor, state, state)
+        self.assertEqual(datetime.timedelta(2), EventTestModel.objects.get(pk=legacy.pk).duration)
+        with connection.schema_editor() as editor:
+            operation.database_forwards('timedelta', editor, state, state)
+        self.assertEqual(datetime.timedelta(2), EventTestModel.objects.get(pk=legacy.pk).duration)
+
+class AggregateTest(test.TestCase):
+    def test_aggregates(self):
+        for duration in ('1 hour', '2 hours, 1 second', '0:00:00.000001'):
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=duration)
+        
+        self.assertEqual({
+            'total': datetime.timedelta(0, 10801, 1),
+            'average': datetime.timedelta(0, 3600, 333334),
+            'shortest': datetime.timedelta(0, 0, 1),
+            'longest': datetime.timedelta(0, 7201),
+        }, EventTestModel.objects.aggregate(
+            total=timedelta.aggregates.Sum('duration'),
+            average=timedelta.aggregates.Avg('duration'),
+            shortest=timedelta.aggregates.Min('duration'),
+            longest=timedelta.aggregates.Max('duration'),
+        ))
+    
+    def test_empty(self):
+        self.assertEqual({'duration__sum': None, 'duration__avg': None}, EventTestModel.objects.aggregate(
+            timedelta.aggregates.Sum('duration'),
+            timedelta.aggregates.Avg('duration'),
+        ))
+    
+    def test_annotate(self):
+        for day in (1, 1, 2):
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, day), duration=datetime.timedelta(hours=day))
+        self.assertEqual([
+            (datetime.datetime(2012, 1, 1), datetime.timedelta(hours=2)),
+            (datetime.datetime(2012, 1, 2), datetime.timedelta(hours=2)),
+        ], list(EventTestModel.objects.values_list('start').annotate(
+            total=timedelta.aggregates.Sum('duration')
+        ).order_by('start')))
+
+class DistributionTest(test.TestCase):
+    def setUp(self):
+        self.minutes = [1, 2, 3, 4, 10, 20, 30, 60, 120, 600]
+        for minutes in self.minutes:
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=datetime.timedelta(minutes=minutes))
+    
+    def test_percentile_aggregates(self):
+        self.assertEqual({
+            'median': datetime.timedelta(minutes=15),
+            'p90': datetime.timedelta(minutes=168),
+        }, EventTestModel.objects.aggregate(
+            median=timedelta.aggregates.Median('duration'),
+            p90=timedelta.aggregates.Percentile('duration', 0.9),
+        ))
+    
+    def test_percentiles(self):
+        self.assertEqual([
+            datetime.timedelta(minutes=1),
+            datetime.timedelta(minutes=15),
+            datetime.timedelta(minutes=168),
+            datetime.timedelta(minutes=600),
+        ], timedelta.aggregates.percentiles(EventTestModel.objects.all(), 'duration', [0, 0.5, 0.9, 1]))
+        self.assertEqual([None], timedelta.aggregates.percentiles(EventTestModel.objects.none(), 'duration', [0.5]))
+        self.assertEqual([None], timedelta.aggregates.percentiles(
+            EventTestModel.objects.filter(duration__gt=datetime.timedelta(1)), 'duration', [0.5]
+        ))
+    
+    def test_percentiles_deleted(self):
+        class DeletingQuerySet(models.QuerySet):
+            # Deletes the longest row just after the first count, as another
+            # connection could between percentiles()' queries.
+            deleted = []
+            
+            def count(self):
+                count = super(DeletingQuerySet, self).count()
+                if not self.deleted:
+                    self.deleted.append(EventTestModel.objects.order_by('-duration')[0].delete())
+                return count
+        
+        queryset = DeletingQuerySet(EventTestModel)
+        self.assertEqual([datetime.timedelta(minutes=120)],
+            timedelta.aggregates.percentiles(queryset, 'duration', [1]))
+    
+    def test_histogram(self):
+        histogram = timedelta.aggregates.DurationHistogram('duration', [
+            datetime.timedelta(minutes=2),
+            datetime.timedelta(minutes=10),
+            datetime.timedelta(hours=1),
+        ])
+        self.assertEqual([
+            (None, datetime.timedelta(minutes=2)),
+            (datetime.timedelta(minutes=2), datetime.timedelta(minutes=10)),
+            (datetime.timedelta(minutes=10), datetime.timedelta(hours=1)),
+            (datetime.timedelta(hours=1), None),
+        ], histogram.buckets())
+        self.assertEqual([1, 3, 3, 3], histogram.count(EventTestModel.objects.all()))
+        self.assertEqual([0, 0, 0, 0], histogram.count(EventTestModel.objects.none()))
+        
+        self.assertRaises(ValueError, timedelta.aggregates.DurationHistogram, 'duration', [
+            datetime.timedelta(2), datetime.timedelta(1)
+        ])
+
+class TimeBucketTest(test.TestCase):
+    def test_group_by_bucket(self):
+        starts = [
+            datetime.datetime(1969, 12, 31, 23, 50),
+            datetime.datetime(2012, 1, 1, 9, 0),
+            datetime.datetime(2012, 1, 1, 9, 14, 59),
+            datetime.datetime(2012, 1, 1, 9, 15),
+            datetime.datetime(2012, 1, 1, 11, 59),
+        ]
+        for start in starts:
+            EventTestModel.objects.create(start=start, duration=datetime.timedelta(0))
+        
+        width = datetime.timedelta(minutes=15)
+        buckets = EventTestModel.objects.annotate(
+            bucket=timedelta.expressions.TimeBucket('start', width)
+        ).values_list('bucket').annotate(count=Count('pk')).order_by('bucket')
+        
+        expected = {}
+        for bucket in timedelta.helpers.time_bucket_many(starts, width):
+            expected[bucket] = expected.get(bucket, 0) + 1
+        
+        self.assertEqual(sorted(expected.items()), list(buckets))
+        self.assertEqual(4, len(buckets))
+    
+    def test_width(self):
+        self.assertRaises(ValueError, timedelta.expressions.TimeBucket, 'start', datetime.timedelta(microseconds=1))
+
+class ArithmeticTest(test.TestCase):
+    def setUp(self):
+        self.durations = [datetime.timedelta(hours=1), datetime.timedelta(days=1, seconds=7), datetime.timedelta(-1, 3600)]
+        for duration in self.durations:
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=duration)
+    
+    def annotated(self, expression):
+        return list(EventTestModel.objects.annotate(value=expression).order_by('pk').values_list('value', flat=True))
+    
+    def test_update(self):
+        EventTestModel.objects.update(duration=timedelta.expressions.Multiply('duration', 1.5))
+        self.assertEqual(
+            [timedelta.helpers.multiply(duration, 1.5) for duration in self.durations],
+            list(EventTestModel.objects.order_by('pk').values_list('duration', flat=True))
+        )
+        EventTestModel.objects.update(duration=timedelta.expressions.Divide('duration', 4))
+        self.assertEqual(
+            [duration * 3 / 8 for duration in self.durations],
+            list(EventTestModel.objects.order_by('pk').values_list('duration', flat=True))
+        )
+    
+    def test_divide(self):
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(
+            [timedelta.helpers.divide(duration, hour) for duration in self.durations],
+            self.annotated(timedelta.expressions.Divide('duration', hour))
+        )
+        self.assertEqual(
+            [timedelta.helpers.divide(duration, hour, as_float=True) for duration in self.durations],
+            self.annotated(timedelta.expressions.Divide('duration', hour, as_float=True))
+        )
+        self.assertEqual([1, 1, 1], self.annotated(timedelta.expressions.Divide('duration', 'duration')))
+    
+    def test_modulo(self):
+        for divisor in (datetime.timedelta(minutes=7), datetime.timedelta(minutes=-7), 420):
+            self.assertEqual(
+                [timedelta.helpers.modulo(duration, divisor) for duration in self.durations],
+                self.annotated(timedelta.expressions.Modulo('duration', divisor))
+            )
+    
+    def test_rounding_modes(self):
+        from decimal import ROUND_05UP
+        hour = datetime.timedelta(hours=1)
+        values = array('q', [1, 3, 5])
+        for rounding in (ROUND_05UP, 'ROUND_HALF_NEAREST'):
+            self.assertRaises(ValueError, timedelta.helpers.multiply, hour, 1e-7, rounding)
+            self.assertRaises(ValueError, timedelta.helpers.divide, hour, 7, rounding=rounding)
+            self.assertRaises(ValueError, timedelta.helpers.multiply_many, values, 3, rounding)
+            self.assertRaises(ValueError, timedelta.helpers.multiply_many, [hour], 3, rounding)
+            self.assertRaises(ValueError, timedelta.helpers.divide_many, values, hour, rounding=rounding)
+            # Exact results need no rounding, so the scalar helpers don't check it.
+            self.assertEqual(datetime.timedelta(hours=3), timedelta.helpers.multiply(hour, 3, rounding))
+    
+    def test_scale_many_int64(self):
+        numpy = timedelta.helpers._numpy()
+        if numpy is None:
+            return
+        from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_EVEN, ROUND_HALF_UP
+        for factor in (0.1, -0.7, 1.1, 2.0 ** -70, Decimal('0.333333333333'), Decimal('-1.23456789')):
+            numerator, denominator = timedelta.helpers._ratio(factor)
+            # The products overflow an int64, but the results do not.
+            values = [
+                value for value in (0, 1, -1, 5, -5, 10 ** 12 + 7, -(10 ** 15) - 3, 2 ** 62, -(2 ** 63), 2 ** 63 - 1)
+                if abs(value * numerator) // denominator < 2 ** 63 - 1
+            ]
+            microseconds = numpy.array(values, dtype=numpy.int64)
+            for rounding in (ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_EVEN, ROUND_HALF_UP):
+                self.assertEqual(
+                    [timedelta.helpers._divide_rounded(value * numerator, denominator, rounding) for value in values],
+                    timedelta.helpers.multiply_many(microseconds, factor, rounding).tolist()
+                )
+    
+    def test_scale_many_int64_random(self):
+        numpy = timedelta.helpers._numpy()
+        if numpy is None:
+            return
+        import random
+        from decimal import Decimal
+        random = random.Random(0)
+        factors = [
+            0.1, 1.1, -0.7, 2.5e-10, 3.999999, 12345.678, 1 / 3.0, 2.0 ** -62, -(2.0 ** -70), 1.5, 3,
+            Decimal('0.333333333333'), Decimal('-1.23456789'), Decimal('7E-15'),
+        ]
+        for factor in factors:
+            numerator, denominator = timedelta.helpers._ratio(factor)
+            for scale in (10 ** 9, 10 ** 15, 2 ** 63 - 1):
+                limit = min(scale, int(2 ** 62 // max(abs(factor), 1)))
+                values = [random.randint(-limit, limit) for i in range(100)] + [0, 1, -1, limit, -limit]
+                microseconds = numpy.array(values, dtype=numpy.int64)
+                for rounding in sorted(timedelta.helpers.ROUNDING_MODES):
+                    self.assertEqual(
+                        [timedelta.helpers._divide_rounded(value * numerator, denominator, rounding) for value in values],
+                        timedelta.helpers.multiply_many(microseconds, factor, rounding).tolist(),
+                        (factor, scale, rounding)
+                    )
+        for divisor in (3, 7, 0.1, Decimal('1.7'), -3.3, 1e-5, 123456789):
+            numerator, denominator = timedelta.helpers._ratio(divisor)
+            values = [random.randint(-2 ** 63, 2 ** 63 - 1) for i in range(100)] + [-2 ** 63, 2 ** 63 - 1, 0]
+            for rounding in sorted(timedelta.helpers.ROUNDING_MODES):
+                expected = [timedelta.helpers._divide_rounded(value * denominator, numerator, rounding) for value in values]
+                if any(abs(value) > 2 ** 63 - 1 for value in expected):
+                    continue
+                self.assertEqual(expected, timedelta.helpers.divide_many(
+                    numpy.array(values, dtype=numpy.int64), divisor, rounding=rounding).tolist(), (divisor, rounding))
+    
+    def test_percentage(self):
+        day = datetime.timedelta(1)
+        self.assertEqual(
+            [timedelta.helpers.percentage(duration, day) for duration in self.durations],
+            self.annotated(timedelta.expressions.Percentage('duration', day))
+        )
+        self.assertEqual(
+            [timedelta.helpers.decimal_percentage(duration, day) for duration in self.durations],
+            self.annotated(timedelta.expressions.DecimalPercentage('duration', day))
+        )
+
+class TimedeltaArrayTest(TestCase):
+    def test_reductions(self):
+        values = [datetime.timedelta(seconds=seconds, microseconds=seconds % 7) for seconds in range(-500, 1000, 7)]
+        durations = timedelta.arrays.TimedeltaArray(values)
+        self.assertEqual(len(values), len(durations))
+        self.assertEqual(values, list(durations))
+        self.assertEqual(sum(values, datetime.timedelta(0)), durations.sum())
+        self.assertEqual(min(values), durations.min())
+        self.assertEqual(max(values), durations.max())
+        self.assertEqual(sorted(values, reverse=True), durations.sorted(reverse=True).tolist())
+        self.assertEqual(values[3], durations[3])
+        self.assertEqual(values[-1], durations[-1])
+        self.assertRaises(ValueError, timedelta.arrays.TimedeltaArray().mean)
+    
+    def test_slices(self):
+        durations = timedelta.arrays.TimedeltaArray(['1 hour', '1 day, 0:00:00', 'P1W', 60000000])
+        grown = durations[:]
+        copy = grown[1:3]
+        grown.extend(copy)
+        self.assertEqual([datetime.timedelta(1), datetime.timedelta(7)], copy.tolist())
+        self.assertEqual(6, len(grown))
+        
+        view = durations.view(1, 3)
+        self.assertRaises(BufferError, durations.append, 0)
+        self.assertEqual([datetime.timedelta(1), datetime.timedelta(7)], view.tolist())
+        self.assertEqual(datetime.timedelta(4), view.mean())
+        view.append(datetime.timedelta(0))
+        self.assertEqual(3, len(view))
+        self.assertEqual(4, len(durations))
+        durations.extend(view)
+        self.assertEqual(datetime.timedelta(0), durations[-1])
+        self.assertEqual(durations, timedelta.arrays.TimedeltaArray(list(durations)))
+        
+        values = [datetime.timedelta(minutes=minutes) for minutes in (5, 1, 4, 2, 3, 9)]
+        durations = timedelta.arrays.TimedeltaArray(values)
+        for index in (slice(None, None, 2), slice(None, None, -1), slice(4, 0, -3)):
+            stepped = durations.view(index.start, index.stop, index.step)
+            self.assertEqual(durations[index], stepped)
+            self.assertEqual(values[index], stepped.tolist())
+            self.assertEqual(min(values[index]), stepped.min())
+            self.assertEqual(max(values[index]), stepped.max())
+            self.assertEqual(sorted(values[index]), stepped.sorted().tolist())
+
+class StreamingTest(test.TestCase):
+    def test_stats(self):
+        import json
+        import random
+        random.seed(3)
+        values = [random.randint(-10 ** 9, 10 ** 11) for i in range(20000)] + [0] * 100
+        first, second = timedelta.streaming.DurationStats(), timedelta.streaming.DurationStats()
+        first.update(values[:5000])
+        second.update(datetime.timedelta(0, 0, value) for value in values[5000:])
+        stats = first.merge(timedelta.streaming.DurationStats.from_dict(json.loads(json.dumps(second.to_dict()))))
+        
+        self.assertEqual(len(values), stats.count)
+        self.assertEqual(datetime.timedelta(0, 0, sum(values)), stats.sum())
+        self.assertEqual(datetime.timedelta(0, 0, min(values)), stats.min())
+        self.assertEqual(datetime.timedelta(0, 0, max(values)), stats.max())
+        mean = sum(values) / float(len(values))
+        variance = sum((value - mean) ** 2 for value in values) / float(len(values) - 1)
+        self.assertAlmostEqual(1, stats.variance(ddof=1) / variance, places=9)
+        
+        values.sort()
+        for q in (0.01, 0.25, 0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            estimate = timedelta.helpers.total_microseconds(stats.quantile(q))
+            self.assertTrue(abs(estimate - exact) <= abs(exact) * 0.01 + 1, (q, exact, estimate))
+    
+    def test_bounded(self):
+        sketch = timedelta.streaming.QuantileSketch(max_buckets=10)
+        sketch.add_many(range(1, 100000))
+        self.assertEqual(10, len(sketch.positive))
+        self.assertAlmostEqual(99000, sketch.quantile(0.99), delta=990)
+    
+    def test_from_queryset(self):
+        durations = [datetime.timedelta(minutes=minutes) for minutes in (5, 10, 15, 20)]
+        for duration in durations:
+            EventTestModel.objects.create(start=datetime.datetime(2012, 1, 1), duration=duration)
+        stats = timedelta.streaming.DurationStats.from_queryset(EventTestModel.objects.all(), 'duration')
+        self.assertEqual(4, stats.count)
+        self.assertEqual(datetime.timedelta(minutes=12, seconds=30), stats.mean())
+        self.assertEqual(datetime.timedelta(minutes=5), stats.quantile(0))
+        self.assertEqual(datetime.timedelta(minutes=20), stats.quantile(1))
+
+class PackageTest(TestCase):
+    def test_public_names(self):
+        self.assertTrue(timedelta.parse is timedelta.helpers.parse)
+        self.assertTrue(timedelta.TimedeltaField is TimedeltaField)
+        self.assertTrue('nice_repr' in dir(timedelta))
+        self.assertRaises(AttributeError, getattr, timedelta, 'missing')
+        self.assertEqual(3, len(timedelta.__version__.split('.')))
+    
+    def test_lazy_import(self):
+        import subprocess
+        import sys
+        code = (
+            "import sys, timedelta; timedelta.__version__; "
+            "sys.exit('timedelta.fields' in sys.modules or 'django.db' in sys.modules)"
+        )
+        path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(0, subprocess.call([sys.executable, '-c', code], cwd=path))
+
+class DecimalHoursTest(TestCase):
+    def test_quantize(self):
+        from decimal import Decimal, ROUND_HALF_UP, localcontext
+        values = [datetime.timedelta(seconds=seconds, microseconds=7) for seconds in range(-7300, 7300, 9)]
+        for decimal_places in (None, 0, 1, 2, 5, 12):
+            for value in values:
+                hours = Decimal(timedelta.helpers.total_microseconds(value)) / Decimal(3600000000)
+                if decimal_places:
+                    hours = hours.quantize(Decimal(10) ** -decimal_places)
+                self.assertEqual(str(hours), str(timedelta.helpers.decimal_hours(value, decimal_places)))
+            self.assertEqual(
+                [timedelta.helpers.decimal_hours(value, decimal_places) for value in values],
+                timedelta.helpers.decimal_hours_many(values, decimal_places)
+            )
+        with localcontext() as context:
+            context.rounding = ROUND_HALF_UP
+            self.assertEqual(Decimal('0.13'), timedelta.helpers.decimal_hours(datetime.timedelta(seconds=450), 2))
+    
+    def test_filter(self):
+        from django.template import Context, Template
+        template = Template('{% load decimal_hours %}{{ value|decimal_hours:2 }} {{ none|decimal_hours }}')
+        self.assertEqual('1.75 None', template.render(Context({
+            'value': datetime.timedelta(minutes=105), 'none': None,
+        })))
 
 def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(timedelta.aggregates))
+    tests.addTests(doctest.DocTestSuite(timedelta.arrays))
+    tests.addTests(doctest.DocTestSuite(timedelta.cache))
+    tests.addTests(doctest.DocTestSuite(timedelta.fields))
     tests.addTests(doctest.DocTestSuite(timedelta.helpers))
+    tests.addTests(doctest.DocTestSuite(timedelta.instrumentation))
+    tests.addTests(doctest.DocTestSuite(timedelta.streaming))
     tests.addTests(doctest.DocTestSuite(timedelta.forms))
+    tests.addTests(doctest.DocTestSuite(timedelta.widgets))
     return tests
@@ -3,44 +3,59 @@ import datetime
 from django import forms
 from django.utils import six
 
-from .helpers import nice_repr, parse
+from .cache import nice_repr, parse
+from .helpers import total_microseconds
+
+
+def microseconds_or_none(value):
+    """
+    The canonical form of a value from a form or a model, for comparing:
+    its number of microseconds, or None if it is empty. Integers are a
+    number of seconds, and strings are parsed (raising a TypeError if they
+    are not valid).
+
+    >>> microseconds_or_none('1 minute, 30 seconds') == microseconds_or_none(datetime.timedelta(0, 90))
+    True
+    >>> microseconds_or_none(' ') is None
+    True
+    """
+    if value is None or isinstance(value, datetime.timedelta):
+        return value if value is None else total_microseconds(value)
+    if isinstance(value, six.integer_types):
+        return value * 1000000
+    value = value.strip()
+    if not value:
+        return None
+    return total_microseconds(parse(value))
+
 
 class TimedeltaWidget(forms.TextInput):
-    def __init__(self, *args, **kwargs):
-        return super(TimedeltaWidget, self).__init__(*args, **kwargs)
+    def format_value(self, value):
+        """
+        The string to render for value. Each form in a formset renders a
+        copy of the widget, so repeated values are only formatted once if
+        the nice_repr cache is enabled (see timedelta.cache).
+        """
+        if value is None:
+            return ""
+        if isinstance(value, six.string_types):
+            return value
+        if isinstance(value, int):
+            value = datetime.timedelta(seconds=value)
+        return nice_repr(value)
         
     def render(self, name, value, attrs=None):
-        if value is None:
-            value = ""
-        elif isinstance(value, six.string_types):
-            pass
-        else:
-            if isinstance(value, int):
-                value = datetime.timedelta(seconds=value)
-            value = nice_repr(value)
-        return super(TimedeltaWidget, self).render(name, value, attrs)
+        return super(TimedeltaWidget, self).render(name, self.format_value(value), attrs)
     
     def _has_changed(self, initial, data):
         """
         We need to make sure the objects are of the canonical form, as a
         string comparison may needlessly fail.
         """
-        if initial in ["", None] and data in ["", None]:
-            return False
-            
-        if initial in ["", None] or data in ["", None]:
+        try:
+            data = microseconds_or_none(data)
+        except TypeError:
+            # initial didn't throw a TypeError, so this must be different
+            # from initial
             return True
-        
-        if initial:
-            if not isinstance(initial, datetime.timedelta):
-                initial = parse(initial)
-
-        if not isinstance(data, datetime.timedelta):
-            try:
-                data = parse(data)
-            except TypeError:
-                # initial didn't throw a TypeError, so this must be different
-                # from initial
-                return True
-        
-        return initial != data
+        return microseconds_or_none(initial) != data